@@ -21,11 +21,13 @@ import logging
 import sys
 import traceback
 
-import requests
+from bookshops.utils import budget
+from bookshops.utils import httpclient
 
 log = logging.getLogger(__name__)
 
 DATA_SOURCE_NAME = "Discogs.com"
+DISCOGS_API_URL = "http://api.discogs.com"
 DISCOGS_IMG_URL = "http://s.pixogs.com/image/"
 DEFAULT_IMG_SIZE = "150"  # "90" or "150"
 TYPE_CD = "cd"
@@ -49,13 +51,18 @@ class Scraper:
 
     """
 
+    def set_constants(self):
+        #: Base url of the API
+        self.SOURCE_URL_BASE = DISCOGS_API_URL
+
     def __init__(self, *args, **kwargs):
         """
         Constructs the query url to the discogs API.
         doc: http://www.discogs.com/developers/resources/database/release.html
         """
+        self.set_constants()
         self.discogs_url = "http://discogs.com"
-        self.api_url = "http://api.discogs.com"
+        self.api_url = self.SOURCE_URL_BASE
         self.db_search = self.api_url + "/database/search?q="
         self.url = ""
         self.ean = None
@@ -63,6 +70,8 @@ class Scraper:
         self.headers = {"User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:29.0) Gecko/20100101 Firefox/29.0"}
 
         self.stacktraces = []  # store stacktraces
+        #: We don't cache the Discogs results.
+        self.from_cache = False
 
         if not args and not kwargs:
             log.debug("give some search keywords")
@@ -110,19 +119,24 @@ class Scraper:
             # log.error("--- error getting the image url: ", e)
             return ""
 
-    def search(self):
+    def search(self, deadline=None):
         """
         if ean search, returns a dict with all the info
 
         returns: a couple results / stacktraces.
 
         - publishers: a list of labels (str)
+        - deadline: in seconds, for the search and the release requests (see budget).
         """
+        with budget.scope(deadline):
+            return self._search()
+
+    def _search(self):
         self.stacktraces = []
         if self.ean:
             card = {}
             card["data_source"] = DATA_SOURCE_NAME
-            res = requests.get(self.url, headers=self.headers)
+            res = httpclient.get(self.url, headers=self.headers)
             try:
                 json_res = json.loads(res.text)
                 uri = json_res["results"][0]["uri"]
@@ -136,7 +150,7 @@ class Scraper:
             if release:
                 release_url = self.api_url + "/releases/" + release
                 log.debug("release_url: %s" % release_url)
-                rel = requests.get(release_url, headers=self.headers)
+                rel = httpclient.get(release_url, headers=self.headers)
 
                 try:
                     val = json.loads(rel.text)
@@ -167,7 +181,7 @@ class Scraper:
             # usual case: a search by keywords
             try:
                 to_ret = []
-                res = requests.get(self.url, headers=self.headers)
+                res = httpclient.get(self.url, headers=self.headers)
                 if res.status_code == 403:
                     return to_ret, ["Discogs: 403 Error", traceback.format_exc()]
                 json_res = json.loads(res.text)
@@ -227,6 +241,14 @@ class Scraper:
 
             return to_ret, self.stacktraces
 
+    async def asearch(self, deadline=None):
+        """Coroutine version of search().
+
+        An ean search chains two requests (the search, then the
+        release), so we run the whole search on the http thread pool.
+        """
+        return await httpclient.to_thread(self.search, deadline=deadline)
+
 
 def postSearch(self):
     """Return the info we could not get at the first time/connection.
@@ -22,10 +22,11 @@ import logging
 
 import clize
 import lxml.html
-import requests
 from sigtools.modifiers import annotate
 from sigtools.modifiers import kwoargs
 
+from bookshops.utils import budget
+from bookshops.utils import httpclient
 from bookshops.utils.scraperUtils import print_card
 from bookshops.utils.scraperUtils import Timer
 
@@ -64,10 +65,24 @@ class Scraper(object):
             self.url = self.discogs_url + self.search_prefix + query + self.search_suffix
             log.debug("we'll search: %s" % self.url)
 
-    def search(self):
+    def search(self, deadline=None):
+        """
+        - deadline: in seconds (see budget).
+        """
+        with budget.scope(deadline):
+            req = httpclient.get(self.url, headers=self.headers)
+        return self._parse_response(req)
+
+    async def asearch(self, deadline=None):
+        """Coroutine version of search().
+        """
+        with budget.scope(deadline):
+            req = await httpclient.aget(self.url, headers=self.headers)
+        return self._parse_response(req)
+
+    def _parse_response(self, req):
         to_ret = []
         title, cover, details_url = "", "", ""
-        req = requests.get(self.url, headers=self.headers)
         tree = lxml.html.fromstring(req.content)
         # Get the 50 (first page) references
         cards = tree.xpath("//*[contains(@class, 'card_large')]")
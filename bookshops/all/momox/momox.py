@@ -9,6 +9,7 @@ import clize
 from sigtools.modifiers import annotate
 from sigtools.modifiers import autokwoargs
 
+from bookshops.utils import cardstore
 from bookshops.utils.baseScraper import BaseScraper
 from bookshops.utils.decorators import catch_errors
 from bookshops.utils.scraperUtils import priceFromText
@@ -43,6 +44,8 @@ class Scraper(BaseScraper):
         #: Number of results to display
         self.NBR_RESULTS_QPARAM = ""
         self.NBR_RESULTS = 12
+        #: The text of the page when nothing matched.
+        self.NO_RESULTS_TEXT = "Aucun résultat"
 
     def __init__(self, *args, **kwargs):
         """
@@ -140,6 +143,12 @@ class Scraper(BaseScraper):
         """
         Searches DVDs. Returns a tuple: list of DVDs (dicts), stacktraces.
         """
+        if self.cached_results is not None:
+            return self.cached_results, []
+
+        self._fetch_if_needed(kwargs.get('deadline'))
+        if self.timed_out:
+            return [], [self.timed_out]
         bk_list = []
         stacktraces = []
 
@@ -165,6 +174,8 @@ class Scraper(BaseScraper):
 
             bk_list.append(b.to_dict())
 
+        if not self.nocache:
+            cardstore.put_many(bk_list)
         return bk_list, stacktraces
 
 
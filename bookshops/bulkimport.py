@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import a file of ISBNs (a distributor invoice, an inventory…).
+
+The ISBNs are read from a text file (one or more per line) or a CSV
+file (the first cell of each row that is an ISBN), and deduplicated.
+They are searched on Dilicom by batches of 100 when DILICOM_USER and
+DILICOM_PASSWORD are set, and the ISBNs Dilicom doesn't know on the
+websites (librairiedeparis, then lelivre). Without Dilicom, they are all
+searched on the websites. The results are written as they come, one
+JSON object per line:
+
+    {"isbn": "9782732486819", "found": true, "status": "found", "source": "dilicom", "card": {...}, "errors": []}
+
+The status is "found", "not_found" (the sources answered they don't
+know it), or "error" (a timeout, a site down…: we don't know).
+
+If the import is interrupted, run it again with the same output file:
+the ISBNs already in it are not searched again, except the errors. An
+ISBN can then have several lines: the last one is its result. The
+progress is also saved in output.checkpoint.
+
+    $ bulkimport inventaire.csv -o inventaire.ndjson
+
+or
+
+    from bookshops.bulkimport import bulk_import
+    stats = bulk_import("inventaire.csv", "inventaire.ndjson")
+"""
+
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import time
+
+import clize
+from sigtools.modifiers import annotate
+from sigtools.modifiers import autokwoargs
+import toolz
+from tqdm import tqdm
+
+from bookshops import federated
+from bookshops.frFR.dilicom import dilicomScraper
+from bookshops.utils.scraperUtils import canonical_isbn
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.ERROR)
+log = logging.getLogger(__name__)
+
+#: The websites to search, in order, without Dilicom.
+DEFAULT_SOURCES = ['librairiedeparis', 'lelivre']
+
+#: Number of ISBNs searched at the same time on the websites, and of
+#: Dilicom batches (at most dilicomScraper.MAX_PARALLEL).
+WORKERS = 4
+
+#: The statuses of the records.
+FOUND = 'found'
+NOT_FOUND = 'not_found'
+ERROR = 'error'
+
+#: Save the progress every N ISBNs.
+CHECKPOINT_EVERY = 100
+
+
+def read_isbns(path):
+    """
+    Read the ISBNs of a text or CSV file.
+
+    Return: a tuple: list of unique ISBN-13, in order, number of
+    duplicates, list of the values that are not ISBNs.
+    """
+    isbns = []
+    seen = set()
+    duplicates = 0
+    invalid = []
+    with io.open(path, encoding='utf8', errors='replace') as f:
+        if path.lower().endswith('.csv'):
+            try:
+                dialect = csv.Sniffer().sniff(f.read(4096), delimiters=",;\t")
+            except csv.Error:
+                # One column: no delimiter to find.
+                dialect = csv.excel
+            f.seek(0)
+            rows = csv.reader(f, dialect)
+        else:
+            rows = (line.split() for line in f)
+        for row in rows:
+            cells = [it.strip() for it in row if it.strip()]
+            if not cells:
+                continue
+            found = [canonical_isbn(it) for it in cells]
+            found = [it for it in found if it]
+            if not found:
+                invalid.append(cells[0])
+                continue
+            # CSV: one ISBN per row. Text: all the ISBNs of the line.
+            for isbn in found[:1] if path.lower().endswith('.csv') else found:
+                if isbn in seen:
+                    duplicates += 1
+                    continue
+                seen.add(isbn)
+                isbns.append(isbn)
+    return isbns, duplicates, invalid
+
+
+def _record(isbn, card=None, source=None, errors=None, failed=False):
+    """
+    - failed: we didn't find it because of an error, not because the
+      sources don't know it.
+    """
+    if card is not None:
+        status = FOUND
+    else:
+        status = ERROR if failed else NOT_FOUND
+    return {
+        'isbn': isbn,
+        'found': card is not None,
+        'status': status,
+        'source': source,
+        'card': card,
+        'errors': errors or [],
+    }
+
+
+def _json_default(obj):
+    """
+    Serialize what json doesn't know, like the Dilicom dates (datetime).
+    """
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def to_json(record):
+    return json.dumps(record, default=_json_default)
+
+
+def search_dilicom(isbns):
+    """
+    Search a batch of ISBNs (100 max) on Dilicom.
+
+    An ISBN is not found when Dilicom says it doesn't know it. The others
+    without a card are errors, with the errors of the whole batch (a
+    timeout, a bad password…).
+
+    Return: a list of records.
+    """
+    bk_list, stacktraces = dilicomScraper.Scraper(*isbns).bulk_search(isbns)
+    by_isbn = {canonical_isbn(it.get('isbn')): it for it in bk_list}
+    batch_errors = [it for it in stacktraces if not any(isbn in it for isbn in isbns)]
+    records = []
+    for isbn in isbns:
+        card = by_isbn.get(isbn)
+        if card is not None:
+            records.append(_record(isbn, card, 'dilicom'))
+            continue
+        errors = [it for it in stacktraces if isbn in it]
+        unknown = "EAN inconnu {}".format(isbn) in errors
+        records.append(_record(isbn, errors=errors + batch_errors, failed=not unknown))
+    return records
+
+
+def search_websites(isbn, sources=DEFAULT_SOURCES):
+    """
+    Search one ISBN on the websites, in order, until one knows it.
+
+    If a website failed (an exception, or errors with its results), the
+    ISBN is an error: that website may know it.
+
+    Return: a list with one record.
+    """
+    errors = []
+    for source in sources:
+        try:
+            bk_list, stacktraces = federated.get_scraper(source)(isbn).search()
+        except Exception as e:
+            log.error("bulkimport: error searching {} on {}: {}".format(isbn, source, e))
+            errors.append("{}: {}".format(source, e))
+            continue
+        errors += stacktraces
+        if bk_list:
+            return [_record(isbn, bk_list[0], source, errors)]
+    return [_record(isbn, errors=errors, failed=bool(errors))]
+
+
+def has_dilicom():
+    return bool(os.getenv('DILICOM_USER') and os.getenv('DILICOM_PASSWORD'))
+
+
+class ImportStats(object):
+
+    def __init__(self, total=0, already_done=0, duplicates=0, invalid=0):
+        self.total = total
+        self.already_done = already_done
+        self.duplicates = duplicates
+        self.invalid = invalid
+        self.done = 0
+        self.found = 0
+        self.not_found = 0
+        self.errors = 0
+        self.start = time.time()
+
+    def add(self, record):
+        self.done += 1
+        if record['status'] == FOUND:
+            self.found += 1
+        elif record['status'] == NOT_FOUND:
+            self.not_found += 1
+        else:
+            self.errors += 1
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def throughput(self):
+        """
+        ISBNs per second, in this run.
+        """
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'already_done': self.already_done,
+            'done': self.done,
+            'found': self.found,
+            'not_found': self.not_found,
+            'errors': self.errors,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'elapsed': round(self.elapsed(), 2),
+            'isbn_per_second': round(self.throughput(), 2),
+        }
+
+
+def read_done(output):
+    """
+    The ISBNs already in the output file, from a previous run, except
+    the errors: we search them again. A last line cut by a crash is
+    removed.
+
+    Return: a set of ISBNs.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    good_size = 0
+    with open(output, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line.decode('utf8'))
+                if record.get('status') == ERROR:
+                    done.discard(record['isbn'])
+                else:
+                    done.add(record['isbn'])
+            except (ValueError, KeyError):
+                break
+            good_size += len(line)
+    if good_size != os.path.getsize(output):
+        log.warning("bulkimport: removing an incomplete line at the end of {}".format(output))
+        with open(output, 'r+b') as f:
+            f.truncate(good_size)
+    return done
+
+
+def write_checkpoint(output, input_path, stats):
+    checkpoint = dict(stats.to_dict(), input=input_path, updated_at=time.time())
+    tmp = output + '.checkpoint.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, output + '.checkpoint')
+
+
+def _results(jobs, workers):
+    """
+    Run these jobs (function, args…) on `workers` threads.
+
+    Yield: the tuples records, JSON lines of each job, as they finish.
+    A job that fails is logged and skipped: its ISBNs are not written,
+    they will be searched again at the next run.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Submit by windows: an interruption doesn't waste many requests.
+        for window in toolz.partition_all(workers * 4, jobs):
+            futures = [executor.submit(*job) for job in window]
+            for future in as_completed(futures):
+                try:
+                    records = future.result()
+                    lines = [to_json(record) + "\n" for record in records]
+                except Exception as e:
+                    log.error("bulkimport: {}".format(e))
+                    continue
+                yield records, lines
+
+
+def bulk_import(input_path, output, sources=DEFAULT_SOURCES, use_dilicom=None,
+                workers=WORKERS, progress=True):
+    """
+    Search all the ISBNs of this file and write the results in output
+    (NDJSON). Resume a previous run on the same output.
+
+    - use_dilicom: None: use Dilicom if its credentials are set. The
+      ISBNs Dilicom doesn't know are searched on the sources.
+    - workers: number of ISBNs searched at the same time on the
+      websites, and of Dilicom batches (at most
+      dilicomScraper.MAX_PARALLEL).
+
+    Return: an ImportStats.
+    """
+    isbns, duplicates, invalid = read_isbns(input_path)
+    if invalid:
+        log.warning("bulkimport: {} values are not ISBNs, for example {}".format(len(invalid), invalid[:3]))
+    done = read_done(output)
+    todo = [it for it in isbns if it not in done]
+    stats = ImportStats(total=len(isbns), already_done=len(isbns) - len(todo),
+                        duplicates=duplicates, invalid=len(invalid))
+    if use_dilicom is None:
+        use_dilicom = has_dilicom()
+
+    bar = tqdm(total=len(todo), unit="isbn", disable=not progress)
+    with open(output, 'a') as out:
+
+        def write(results):
+            results = list(results)
+            for record, line in results:
+                out.write(line)
+                stats.add(record)
+                if stats.done % CHECKPOINT_EVERY == 0:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    write_checkpoint(output, input_path, stats)
+            bar.update(len(results))
+            bar.set_postfix(found=stats.found, rate="{:.1f}/s".format(stats.throughput()))
+
+        if use_dilicom:
+            jobs = [(search_dilicom, batch) for batch in toolz.partition_all(dilicomScraper.BATCH_SIZE, todo)]
+            todo = []
+            for records, lines in _results(jobs, min(workers, dilicomScraper.MAX_PARALLEL)):
+                # Unknown on Dilicom: maybe on the websites.
+                unknown = [it['isbn'] for it in records if it['status'] == NOT_FOUND] if sources else []
+                todo += unknown
+                write((record, line) for record, line in zip(records, lines) if record['isbn'] not in unknown)
+
+        jobs = [(search_websites, isbn, sources) for isbn in todo]
+        for records, lines in _results(jobs, workers):
+            write(zip(records, lines))
+    bar.close()
+    write_checkpoint(output, input_path, stats)
+    return stats
+
+
+@annotate(output='o', sources='s', workers='w', no_dilicom='n')
+@autokwoargs()
+def main(input_file, output="", sources=",".join(DEFAULT_SOURCES), workers=WORKERS, no_dilicom=False):
+    """
+    Search all the ISBNs of a text or CSV file, write the results as
+    JSON lines. Run again to resume.
+
+    input_file: the file of ISBNs.
+
+    output: the result file (default: input_file.ndjson).
+
+    sources: the websites to search, in order, without Dilicom or when Dilicom doesn't know the ISBN.
+
+    workers: number of ISBNs searched at the same time on the websites, and of Dilicom batches (at most DILICOM_MAX_PARALLEL).
+
+    no_dilicom: don't use Dilicom, even with DILICOM_USER and DILICOM_PASSWORD.
+    """
+    output = output or os.path.splitext(input_file)[0] + ".ndjson"
+    stats = bulk_import(input_file, output, sources=sources.split(','),
+                        use_dilicom=False if no_dilicom else None, workers=int(workers))
+    for key, val in stats.to_dict().items():
+        print("{:>16}: {}".format(key, val))
+
+
+def run():
+    exit(clize.run(main))
+
+
+if __name__ == '__main__':
+    clize.run(main)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Find the card of one ISBN, as fast as possible (a barcode scan).
+
+Unlike federated.search, we don't want the answers of all the sources,
+only the first good one. The sources are tried in order. If a source
+didn't answer after its usual (p90) response time, we also ask the next
+one and take the first complete card that arrives:
+
+    from bookshops import cascade
+
+    card, stacktraces = cascade.resolve("9782732486819")
+
+The hedge delays adapt to the response times we measure.
+
+    cascade.stats()
+    {'resolved': 10, 'hedged': 2, 'not_found': 1,
+     'wins': {'dilicom': 8, 'librairiedeparis': 2},
+     'p90': {'dilicom': 0.8, 'librairiedeparis': 1.2, 'lelivre': None}}
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import importlib
+import logging
+import threading
+import time
+import traceback
+
+from bookshops import federated
+from bookshops.utils import budget
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: The sources to ask, in order. Without credentials, Dilicom fails at once and we go on.
+DEFAULT_SOURCES = ['dilicom', 'librairiedeparis', 'lelivre']
+
+#: A card is complete when it has these fields.
+COMPLETE_FIELDS = ['title', 'price']
+
+#: Hedge delay (seconds) while we don't have enough samples for a source.
+DEFAULT_DELAY = 1.0
+
+#: Bounds of the hedge delay.
+MIN_DELAY = 0.1
+MAX_DELAY = 5.0
+
+#: Keep the last N response times of each source.
+MAX_SAMPLES = 100
+
+#: Use the p90 once we have this many samples.
+MIN_SAMPLES = 5
+
+#: Sources not in federated.SOURCES.
+EXTRA_SOURCES = {
+    'dilicom': 'bookshops.frFR.dilicom.dilicomScraper',
+}
+
+
+def get_scraper(source):
+    if source in EXTRA_SOURCES:
+        return importlib.import_module(EXTRA_SOURCES[source]).Scraper
+    return federated.get_scraper(source)
+
+
+def is_complete(card):
+    return bool(card) and all(card.get(field) for field in COMPLETE_FIELDS)
+
+
+class Latencies(object):
+    """
+    The last response times of each source.
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, source, seconds):
+        with self.lock:
+            if source not in self.samples:
+                self.samples[source] = deque(maxlen=self.max_samples)
+            self.samples[source].append(seconds)
+
+    def p90(self, source):
+        """
+        Return: the 90th percentile, or None if we don't have enough samples.
+        """
+        with self.lock:
+            samples = sorted(self.samples.get(source, []))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+
+    def delay(self, source):
+        """
+        How long we wait for this source before asking the next one.
+        """
+        p90 = self.p90(source)
+        if p90 is None:
+            return DEFAULT_DELAY
+        return min(MAX_DELAY, max(MIN_DELAY, p90))
+
+
+class Cascade(object):
+
+    def __init__(self, sources=DEFAULT_SOURCES, latencies=None):
+        self.sources = list(sources)
+        self.latencies = latencies or Latencies()
+        self.lock = threading.Lock()
+        self.resolved = 0
+        self.hedged = 0
+        self.not_found = 0
+        self.wins = {}
+
+    def _search(self, source, isbn, deadline=None):
+        """
+        Search the ISBN on one source and record its response time.
+
+        Return: a tuple list of cards, stacktraces.
+        """
+        start = time.time()
+        try:
+            if deadline is None:
+                scraper = get_scraper(source)(isbn)
+                res, stacktraces = scraper.search()
+            else:
+                scraper = get_scraper(source)(isbn, FETCH=False)
+                res, stacktraces = scraper.search(deadline=deadline)
+        except Exception as e:
+            log.error("cascade: error with source {}: {}".format(source, e))
+            return [], [traceback.format_exc()]
+        # A cache hit (simplecache, cardstore, negcache) says nothing of
+        # the source's response time.
+        if not getattr(scraper, 'from_cache', False):
+            self.latencies.add(source, time.time() - start)
+        return res or [], stacktraces or []
+
+    def _count(self, counter, source=None):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if source:
+                self.wins[source] = self.wins.get(source, 0) + 1
+
+    def resolve(self, isbn, sources=None, deadline=None):
+        """
+        Ask the sources in order, hedging the slow ones.
+
+        - deadline: in seconds. When it is passed, return the best card we got.
+
+        Return: a tuple card (or None), stacktraces. If no card is
+        complete, the first incomplete one.
+        """
+        sources = list(sources or self.sources)
+        deadline = budget.get(deadline)
+        executor = ThreadPoolExecutor(max_workers=len(sources) or 1)
+        futures = {}
+        fallback = None
+        fallback_source = None
+        stacktraces = []
+
+        def launch():
+            source = sources[len(futures)]
+            future = executor.submit(self._search, source, isbn, deadline)
+            futures[future] = source
+            return future
+
+        try:
+            pending = {launch()}
+            while pending:
+                last = sources[len(futures) - 1]
+                timeout = self.latencies.delay(last) if len(futures) < len(sources) else None
+                if deadline is not None:
+                    remaining = deadline.remaining()
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = futures[future]
+                    res, errors = future.result()
+                    stacktraces += errors
+                    card = next(filter(is_complete, res), None)
+                    if card is not None:
+                        self._count('resolved', source)
+                        return card, stacktraces
+                    if res and fallback is None:
+                        fallback, fallback_source = res[0], source
+                if deadline is not None and deadline.expired():
+                    log.info("cascade: deadline passed for {}".format(isbn))
+                    break
+                if len(futures) < len(sources):
+                    # The last source is slow (we hedge), or it gave nothing: ask the next one.
+                    if not done:
+                        self._count('hedged')
+                        log.debug("cascade: {} is slow for {}, asking {} too".format(
+                            last, isbn, sources[len(futures)]))
+                    pending.add(launch())
+        finally:
+            # The late sources finish in the background (and record their time).
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        if fallback is None:
+            self._count('not_found')
+        else:
+            self._count('resolved', fallback_source)
+        return fallback, stacktraces
+
+    def stats(self):
+        with self.lock:
+            return {
+                'resolved': self.resolved,
+                'hedged': self.hedged,
+                'not_found': self.not_found,
+                'wins': dict(self.wins),
+                'p90': {source: self.latencies.p90(source) for source in self.sources},
+            }
+
+
+CASCADE = Cascade()
+
+
+def resolve(isbn, sources=None, deadline=None):
+    return CASCADE.resolve(isbn, sources=sources, deadline=deadline)
+
+
+def stats():
+    return CASCADE.stats()
@@ -5,13 +5,16 @@ import logging
 
 import addict
 import clize
-import requests
 from bs4 import BeautifulSoup
 from sigtools.modifiers import annotate
 from sigtools.modifiers import kwoargs
 
+from bookshops.utils import budget
+from bookshops.utils import cardstore
+from bookshops.utils import httpclient
 from bookshops.utils.baseScraper import BaseScraper
 from bookshops.utils.decorators import catch_errors
+from bookshops.utils.enrich import enrich
 from bookshops.utils.scraperUtils import priceFromText
 from bookshops.utils.scraperUtils import priceStr2Float
 from bookshops.utils.scraperUtils import print_card
@@ -43,6 +46,8 @@ CONSTANTS = [
     #: Number of results to display
     ("NBR_RESULTS_QPARAM", "NOMBRE"),
     ("NBR_RESULTS", 12),
+    #: The text of the page when nothing matched.
+    ("NO_RESULTS_TEXT", "keine Treffer"),
 ]
 
 
@@ -124,12 +129,15 @@ class Scraper(BaseScraper):
     """
     query = ""
 
-    def __init__(self, *args, **kwargs):
-        """
-        """
+    def set_constants(self):
         # set constants to self from a list
         for tup in CONSTANTS:
             self.__setattr__(tup[0], tup[1])
+
+    def __init__(self, *args, **kwargs):
+        """
+        """
+        self.set_constants()
         super(Scraper, self).__init__(*args, **kwargs)
 
     def pagination(self):
@@ -230,6 +238,13 @@ class Scraper(BaseScraper):
         args: list of words
 
         """
+        if self.cached_results is not None:
+            log.debug("search: hit cache.")
+            return self.cached_results, []
+
+        self._fetch_if_needed(kwargs.get('deadline'))
+        if self.timed_out:
+            return [], [self.timed_out]
         bk_list = []
         stacktraces = []
 
@@ -259,6 +274,8 @@ class Scraper(BaseScraper):
 
             bk_list.append(b.to_dict())
 
+        if not self.nocache:
+            cardstore.put_many(bk_list)
         return bk_list, stacktraces
 
 
@@ -273,7 +290,7 @@ def _isbn(details_url):
     isbn = None
     try:
         log.info("Looking for isbn of {}...".format(details_url))
-        req = requests.get(details_url)
+        req = httpclient.get(details_url)
         soup = BeautifulSoup(req.content, "lxml")
         isbn = soup.find(class_="col49 floatRight")
         isbn = isbnlib.get_isbnlike(isbn.text)
@@ -284,20 +301,24 @@ def _isbn(details_url):
 
     except Exception as e:
         log.error("Error while getting the isbn from url '{}': {}".format(details_url, e))
-        return isbn
+        return isbn, None
 
     return isbn, soup
 
 
 def _description(details_url, soup=None):
     """
+    The description, from the soup of the details page we already got.
+
+    Return: str or None.
     """
     if soup:
         desc = soup.find(class_="paging_container3")
-
-        return desc
+        if desc:
+            return desc.text.strip()
 
 
+@budget.with_deadline
 def postSearch(card, isbn=None, description=None):
     """Get a card (dictionnary) with 'details_url'.
 
@@ -319,13 +340,20 @@ def postSearch(card, isbn=None, description=None):
     if not isbn:
         card.isbn, soup = _isbn(card.details_url)
 
-    # if not description:
-        # card.description = _description(card.details_url, soup=soup)
+    if not description:
+        card.description = _description(card.details_url, soup=soup)
 
     card = card.to_dict()
+    cardstore.put(card)
     return card
 
 
+async def apostSearch(card, isbn=None, description=None):
+    """Coroutine version of postSearch.
+    """
+    return await httpclient.to_thread(postSearch, card, isbn=isbn, description=description)
+
+
 @annotate(isbn="i", timing="t", words=clize.Parameter.REQUIRED)
 @kwoargs("isbn", "timing")
 def main(isbn=False, timing=False, *words):
@@ -340,12 +368,9 @@ def main(isbn=False, timing=False, *words):
     scrap = Scraper(*words)
     bklist, errors = scrap.search()
 
-    # Getting all the isbn will take longer, even with multiprocessing.
+    # Getting all the isbn will take longer, even concurrently.
     if isbn:
-        import multiprocessing
-        pool = multiprocessing.Pool(8)
-        # bklist = [postSearch(it) for it in bklist]
-        bklist = pool.map(postSearch, bklist)
+        bklist = enrich(bklist, postSearch)
 
     end = time.time()
     print((" Nb results: {}".format(len(bklist))))
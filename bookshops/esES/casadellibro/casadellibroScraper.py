@@ -24,17 +24,21 @@ http://www.casadellibro.com
 
 from bs4 import BeautifulSoup
 import logging
-import requests
 
 import clize
 from sigtools.modifiers import annotate
 from sigtools.modifiers import kwoargs
 
+from bookshops.utils import budget
+from bookshops.utils import cardstore
+from bookshops.utils import httpclient
 from bookshops.utils.baseScraper import BaseScraper
 from bookshops.utils.scraperUtils import isbn_cleanup
+from bookshops.utils.scraperUtils import priceFromText
 from bookshops.utils.scraperUtils import priceStr2Float
 from bookshops.utils.scraperUtils import print_card
 from bookshops.utils.decorators import catch_errors
+from bookshops.utils.enrich import enrich
 
 logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
 log = logging.getLogger(__name__)
@@ -57,6 +61,8 @@ class Scraper(BaseScraper):
         self.TYPE_BOOK = "book"
         self.URL_END = "&idtipoproducto=-1&tipoproducto=1&nivel=5"
         self.ISBN_QPARAM = ""
+        #: The text of the page when nothing matched.
+        self.NO_RESULTS_TEXT = "No se han encontrado resultados"
 
     query = ""
 
@@ -82,8 +88,8 @@ class Scraper(BaseScraper):
 
     @catch_errors
     def _price(self, product):
-        price = product.find(class_="currentPrice").text
-        price = price.replace("\\u20ac", "").strip()  # remove euro sign.
+        price = product.find(class_="currentPrice").text.strip()
+        price = priceFromText(price)  # remove euro sign.
         price = priceStr2Float(price)
         return price
 
@@ -127,6 +133,7 @@ class Scraper(BaseScraper):
         pass
 
 
+@budget.with_deadline
 def postSearch(card):
     """Get the ean/isbn."""
     url = card.get('details_url') or card.get('url')
@@ -134,7 +141,7 @@ def postSearch(card):
         log.error("postSearch error: url is False ! ({}).".format(url))
         return None
 
-    req = requests.get(url)
+    req = httpclient.get(url)
     soup = BeautifulSoup(req.text, "lxml")
 
     try:
@@ -146,9 +153,15 @@ def postSearch(card):
     except Exception as e:
         log.debug("postSearch: error while getting the isbn of {}: {}".format(url, e))
 
+    cardstore.put(card)
     return card
 
 
+async def apostSearch(card):
+    """Coroutine version of postSearch."""
+    return await httpclient.to_thread(postSearch, card)
+
+
 @annotate(words=clize.Parameter.REQUIRED)
 @kwoargs()
 def main(*words):
@@ -161,7 +174,7 @@ def main(*words):
     scrap = Scraper(*words)
     bklist, errors = scrap.search()
     print((" Nb results: {}".format(len(bklist))))
-    bklist = [postSearch(it) for it in bklist]
+    bklist = enrich(bklist, postSearch)
     list(map(print_card, bklist))
 
 
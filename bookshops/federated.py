@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Search many sources at once.
+
+The query is sent to all the sources concurrently, and we yield the
+results of each source as soon as it answers:
+
+    from bookshops import federated
+
+    for source, cards, stacktraces in federated.search("antigone", deadline=5):
+        ...
+
+The sources that are down (see breaker) are skipped: they are yielded
+first, without results.
+
+Cards of different sources that share an ISBN are merged into one
+record. Its "offers" list holds the price and availability of each
+source:
+
+    {'title': ..., 'isbn': ..., 'data_sources': ['librairiedeparis', 'lelivre.ch'],
+     'offers': [{'data_source': 'librairiedeparis', 'price': 9.5, ...}, ...]}
+
+The merged records are shared: a record yielded for a first source is
+updated in place when a later source answers with the same ISBN.
+"""
+
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+import importlib
+import logging
+import traceback
+
+import six
+
+from bookshops.utils import breaker
+from bookshops.utils import budget
+from bookshops.utils.scraperUtils import canonical_isbn
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Source name -> module defining its Scraper class.
+SOURCES = {
+    'librairiedeparis': 'bookshops.frFR.librairiedeparis.librairiedeparisScraper',
+    'lelivre': 'bookshops.frFR.lelivre.lelivreScraper',
+    'casadellibro': 'bookshops.esES.casadellibro.casadellibroScraper',
+    'buchlentner': 'bookshops.deDE.buchlentner.buchlentnerScraper',
+    'momox': 'bookshops.all.momox.momox',
+    'discogs': 'bookshops.all.discogs.discogsConnector',
+}
+
+#: The fields that differ from one source to another.
+OFFER_FIELDS = ['data_source', 'price', 'price_fmt', 'currency', 'availability', 'details_url']
+
+
+def get_scraper(source):
+    """
+    Return the Scraper class of this source name.
+    """
+    module = importlib.import_module(SOURCES[source])
+    return module.Scraper
+
+
+def source_url(source):
+    """
+    The base url of this source, given by its Scraper: the host of its
+    requests, to know if it is up (see breaker).
+    """
+    scraper = get_scraper(source)
+    # Read the constants without building a search (nor fetching it).
+    constants = scraper.__new__(scraper)
+    constants.set_constants()
+    return constants.SOURCE_URL_BASE
+
+
+def source_state(source):
+    """
+    closed (up), open (down, skipped) or half-open (we are probing it).
+    """
+    return breaker.state(source_url(source))
+
+
+def source_states():
+    """
+    Return: a dict source name -> state, to grey out the sources that are down.
+    """
+    return {source: source_state(source) for source in SOURCES}
+
+
+def _search_source(source, words, deadline=None):
+    """
+    Run the search on one source. Its requests share the deadline.
+
+    Return: a tuple list of cards, stacktraces.
+    """
+    try:
+        scraper = get_scraper(source)
+        if deadline is None:
+            res, stacktraces = scraper(*words).search()
+        else:
+            res, stacktraces = scraper(*words, FETCH=False).search(deadline=deadline)
+        return res or [], stacktraces or []
+    except Exception as e:
+        log.error("federated search: error with source {}: {}".format(source, e))
+        return [], [traceback.format_exc()]
+
+
+def _card_isbn(card):
+    # Discogs calls it "ean".
+    # The ISBN-10 and ISBN-13 of a book are the same key.
+    return canonical_isbn(card.get('isbn') or card.get('ean'))
+
+
+def _offer(card):
+    return {key: card.get(key) for key in OFFER_FIELDS}
+
+
+class Merger(object):
+    """
+    Merge the cards sharing an ISBN.
+    """
+
+    def __init__(self):
+        #: isbn -> merged record
+        self.by_isbn = {}
+        #: all records, in order of arrival.
+        self.records = []
+
+    def add(self, card):
+        """
+        Add a card and return its merged record.
+        """
+        isbn = _card_isbn(card)
+        record = self.by_isbn.get(isbn) if isbn else None
+        if record is None:
+            record = dict(card)
+            record['data_sources'] = [card.get('data_source')]
+            record['offers'] = [_offer(card)]
+            self.records.append(record)
+            if isbn:
+                self.by_isbn[isbn] = record
+            return record
+
+        record['data_sources'].append(card.get('data_source'))
+        record['offers'].append(_offer(card))
+        # Complete what the first sources didn't give.
+        for key, val in card.items():
+            if val and not record.get(key):
+                record[key] = val
+        return record
+
+
+def search(query, sources=None, deadline=None):
+    """
+    Search all the sources concurrently.
+
+    - query: a string or a list of words (or an isbn).
+    - sources: list of source names (see SOURCES). Default: all.
+    - deadline: in seconds. When it is passed, stop and return what we
+      got. It is also the time budget of the requests of each source
+      (see budget).
+
+    Yield a tuple (source name, merged records of this source, stacktraces)
+    for each source, in order of arrival.
+    """
+    if isinstance(query, six.string_types):
+        words = query.split()
+    else:
+        words = list(query)
+    if sources is None:
+        sources = list(SOURCES.keys())
+
+    down = [it for it in sources if source_state(it) == breaker.OPEN]
+    for source in down:
+        log.info("federated search: {} is down, we skip it".format(source))
+        yield source, [], ["{} is down, we don't search it for now.".format(source)]
+    sources = [it for it in sources if it not in down]
+
+    merger = Merger()
+    executor = ThreadPoolExecutor(max_workers=len(sources) or 1)
+    deadline = budget.get(deadline)
+    futures = {executor.submit(_search_source, source, words, deadline): source
+               for source in sources}
+    try:
+        for future in as_completed(futures, timeout=deadline.remaining() if deadline else None):
+            source = futures[future]
+            res, stacktraces = future.result()
+            records = [merger.add(card) for card in res]
+            yield source, records, stacktraces
+    except TimeoutError:
+        late = [futures[it] for it in futures if not it.done()]
+        log.info("federated search: deadline passed, we don't wait for {}".format(late))
+    finally:
+        # Don't wait for the late sources.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def search_all(query, sources=None, deadline=None):
+    """
+    Same as search(), but return everything at once.
+
+    Return: a tuple list of merged records, dict source name -> stacktraces.
+    """
+    merger_records = []
+    seen = set()
+    all_stacktraces = {}
+    for source, records, stacktraces in search(query, sources=sources, deadline=deadline):
+        all_stacktraces[source] = stacktraces
+        for record in records:
+            if id(record) not in seen:
+                seen.add(id(record))
+                merger_records.append(record)
+
+    return merger_records, all_stacktraces
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Group the single ISBN lookups on Dilicom.
+
+Barcode scans arrive one at a time, from many tills. Instead of one
+SOAP request per scan, we collect the ISBNs during a short window (30ms
+by default), or until we have 100 of them, and we send them in one
+bulk_search. Each caller gets its own result back:
+
+    from bookshops.frFR.dilicom import batcher
+
+    bklist, stacktraces = batcher.lookup("9782732486819")
+
+The result has the same form as Scraper.search(): a list with the book
+(or an empty list) and the stacktraces.
+"""
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import threading
+import time
+
+from bookshops.frFR.dilicom.dilicomScraper import BATCH_SIZE
+from bookshops.frFR.dilicom.dilicomScraper import MAX_PARALLEL
+from bookshops.frFR.dilicom.dilicomScraper import Scraper
+from bookshops.utils.scraperUtils import canonical_isbn
+from bookshops.utils.scraperUtils import is_valid_ean
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s',
+                    level=logging.ERROR)
+log = logging.getLogger(__name__)
+
+#: How long we wait for more ISBNs before sending the request (seconds).
+WINDOW = 0.03
+
+
+class Batcher(object):
+    """
+    Collect single ISBN requests and send them to Dilicom by batches.
+    """
+
+    def __init__(self, window=WINDOW, max_batch=BATCH_SIZE, parallel=MAX_PARALLEL):
+        self.window = window
+        self.max_batch = max_batch
+        #: list of tuples (isbn, future)
+        self.pending = []
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=parallel)
+        self.thread = None
+
+    def submit(self, isbn):
+        """
+        Queue this ISBN for the next batch. An invalid ISBN doesn't take a
+        place in the batch: its Future is done at once, with an error.
+
+        Return: a Future, with the result tuple list of books, stacktraces.
+        """
+        future = Future()
+        canon = canonical_isbn(isbn)
+        if not is_valid_ean(canon):
+            future.set_result(([], ["Dilicom: invalid ISBN {}".format(isbn)]))
+            return future
+        isbn = canon
+        with self.condition:
+            self.pending.append((isbn, future))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="dilicom-batcher")
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return future
+
+    def lookup(self, isbn, timeout=None):
+        """
+        Search this ISBN, in a batch with the others.
+
+        Return: a tuple list of books, stacktraces.
+        """
+        return self.submit(isbn).result(timeout=timeout)
+
+    async def alookup(self, isbn):
+        """
+        Coroutine version of lookup.
+        """
+        return await asyncio.wrap_future(self.submit(isbn))
+
+    def _next_batch(self):
+        """
+        Wait for the first pending ISBN, then for the end of the window
+        or for a full batch.
+        """
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            end = time.monotonic() + self.window
+            while len(self.pending) < self.max_batch:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # The request runs on the pool, we collect the next batch meanwhile.
+            self.executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        isbns = []
+        for isbn, _ in batch:
+            if isbn not in isbns:
+                isbns.append(isbn)
+        log.debug("Dilicom batcher: sending {} ISBNs.".format(len(isbns)))
+        scraper = Scraper(*isbns)
+        error = scraper._check_search()
+        if error:
+            for _, future in batch:
+                future.set_result(([], [error]))
+            return
+        try:
+            bk_list, stacktraces = scraper.bulk_search(isbns)
+        except Exception as e:
+            log.error("Dilicom batcher: error searching {}: {}".format(isbns, e))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        by_isbn = {canonical_isbn(it.get('isbn')): it for it in bk_list}
+        # The errors of the whole request (auth, timeout...) concern every caller.
+        batch_errors = [it for it in stacktraces if not any(isbn in it for isbn in isbns)]
+        for isbn, future in batch:
+            card = by_isbn.get(isbn)
+            if card is not None:
+                future.set_result(([card], []))
+            else:
+                # The errors about this ISBN, not the ones of the other callers.
+                errors = [it for it in stacktraces if isbn in it] + batch_errors \
+                    or ["Dilicom: ISBN {} not found".format(isbn)]
+                future.set_result(([], errors))
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """
+    The batcher shared by the whole process.
+    """
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = Batcher()
+        return _batcher
+
+
+def lookup(isbn, timeout=None):
+    return get_batcher().lookup(isbn, timeout=timeout)
+
+
+async def alookup(isbn):
+    return await get_batcher().alookup(isbn)
@@ -4,21 +4,30 @@
 
 
 
-from bs4 import BeautifulSoup
+import asyncio
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import logging
 import logging.config
 import os
-import requests
 import six
 
 import addict
 import clize
+from lxml import etree
+import requests
 import toolz
 
 from sigtools.modifiers import annotate
 from sigtools.modifiers import autokwoargs
 
+from bookshops.utils import archive
+from bookshops.utils import backoff
+from bookshops.utils import budget
+from bookshops.utils import cardstore
+from bookshops.utils import httpclient
+from bookshops.utils import negcache
 from bookshops.utils.decorators import catch_errors
 from bookshops.utils.scraperUtils import is_isbn
 from bookshops.utils.scraperUtils import print_card
@@ -28,6 +37,87 @@ logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s',
                     level=logging.ERROR)
 log = logging.getLogger(__name__)
 
+#: Max number of ISBNs in one SOAP request.
+BATCH_SIZE = 100
+#: Max number of SOAP requests running at the same time.
+MAX_PARALLEL = int(os.getenv('DILICOM_MAX_PARALLEL', 4))
+#: We decode the SOAP response by chunks of this size (bytes).
+CHUNK_SIZE = 16 * 1024
+
+
+def _tee(chunks, copy):
+    """
+    Yield the chunks, and append them to the copy list.
+    """
+    for chunk in chunks:
+        copy.append(chunk)
+        yield chunk
+
+
+def _local_name(tag):
+    """
+    "{http://fel.ws.accelya.com/}elemReponse" -> "elemreponse"
+    """
+    return etree.QName(tag).localname.lower()
+
+
+class ResponseDecoder(object):
+    """
+    Incremental decoder of Dilicom's SOAP response.
+
+    We feed it the chunks of the response as they arrive, and it yields
+    each product (<elemReponse>) as soon as its closing tag is read. A
+    product is a flat dict: lowercase tag name -> text, for example
+    {'ean13': '9782732486819', 'libetd': 'HABITER LE MONDE', 'prix': '00016500', ...}.
+    A tag present with no content has the value "".
+
+    We never build the whole tree: every product is freed once decoded.
+    """
+
+    PRODUCT = 'elemreponse'
+    RESPONSE = 'demandeficheproduitrs'
+
+    def __init__(self):
+        self.parser = etree.XMLPullParser(events=('end',))
+        #: codeExecution of the whole request, known at the end.
+        self.code_execution = None
+
+    def _read_events(self):
+        for _, elt in self.parser.read_events():
+            if not isinstance(elt.tag, str):
+                # comments, processing instructions.
+                continue
+            name = _local_name(elt.tag)
+            if name == self.PRODUCT:
+                product = {}
+                for child in elt.iterdescendants():
+                    if isinstance(child.tag, str):
+                        # Keep the first one, like soup.find().
+                        product.setdefault(_local_name(child.tag), (child.text or "").strip())
+                yield product
+                # Free the memory of this product and the previous ones.
+                elt.clear()
+                while elt.getprevious() is not None:
+                    del elt.getparent()[0]
+            elif name == 'codeexecution':
+                parent = elt.getparent()
+                if parent is not None and _local_name(parent.tag) == self.RESPONSE:
+                    self.code_execution = (elt.text or "").strip()
+
+    def iter_products(self, chunks):
+        """
+        - chunks: iterable of bytes.
+
+        Yield: dicts, one per product.
+        """
+        for chunk in chunks:
+            self.parser.feed(chunk)
+            for product in self._read_events():
+                yield product
+        self.parser.close()
+        for product in self._read_events():
+            yield product
+
 
 class Scraper():
     """
@@ -60,6 +150,11 @@ class Scraper():
             args = [args]
         if args:
             self.isbns = list(filter(is_isbn, args))
+        #: Seconds or Deadline, shared by all the batches (see budget).
+        self.deadline = budget.get(kwargs.get('DEADLINE'))
+        #: True when the search was answered from our caches (cardstore,
+        #: negcache), without any request.
+        self.from_cache = False
 
         # Get the search keywords without isbns
         # unsupported by Dilicom.
@@ -67,24 +162,20 @@ class Scraper():
 
     @catch_errors
     def _details_url(self, product):
-        return self.SOURCE_URL_FICHE_PRODUIT.format(product.find('ean13').text)
+        return self.SOURCE_URL_FICHE_PRODUIT.format(product.get('ean13'))
 
     @catch_errors
     def _title(self, product):
-        title = product.find('libetd') or ""
-        if title:
-            title = title.text
+        title = product.get('libetd') or ""
         return title.title()
 
     @catch_errors
     def _authors(self, product):
         """Return a list of str.
         """
-        auteur = product.find('auteur') or ""
-        if auteur:
-            auteur = auteur.text.title()
+        auteur = product.get('auteur') or ""
         # TODO: multiple authors
-        return [auteur]
+        return [auteur.title()]
 
     @catch_errors
     def _img(self, product):
@@ -96,16 +187,13 @@ class Scraper():
         """
         Return a list of publishers (strings).
         """
-        it = product.find('edit') or ''
-        if it:
-            it = it.text.title()
-        return [it]
+        it = product.get('edit') or ''
+        return [it.title()]
 
     def _price(self, product):
         "The real price, without discounts"
-        price = product.find('prix') or 0
+        price = product.get('prix') or 0  # "00013000"
         if price:
-            price = price.text  # "00013000"
             price = float(price)
             # TODO:
             # - code dispo
@@ -117,8 +205,7 @@ class Scraper():
         """
         Return: str
         """
-        ean = product.find('ean13').text
-        return ean
+        return product.get('ean13')
 
     @catch_errors
     def _description(self, product):
@@ -134,9 +221,9 @@ class Scraper():
         res = []
         # All xml nodes are present, but they can be without content.
         for name in ['epaiss', 'haut', 'larg', 'poids']:
-            prop = product.find(name) or 0
-            if prop and prop.text:
-                prop = int(prop.text)
+            prop = product.get(name) or 0
+            if prop:
+                prop = int(prop)
             res.append(prop)
 
         return tuple(res)
@@ -147,9 +234,8 @@ class Scraper():
         Return a datetime.date object.
         In the scrapers we returned a string, parsed later in Abelujo.
         """
-        date_publication = product.find('dtparu') or ""
+        date_publication = product.get('dtparu') or ""
         if date_publication:
-            date_publication = date_publication.text
             date_publication = datetime.datetime.strptime(date_publication, '%Y%m%d')
         return date_publication
 
@@ -160,9 +246,9 @@ class Scraper():
         cf codes in scraperUtils.
         We don't store this in Abelujo, as it is supposed to change anytime.
         """
-        availability = product.find('codedispo') or 0
+        availability = product.get('codedispo') or 0
         if availability:
-            availability = int(availability.text)
+            availability = int(availability)
         return availability
 
     def _availability_fmt(self, code):
@@ -183,15 +269,10 @@ class Scraper():
         # TODO:
         pass
 
-    def bulk_search(self, isbns):
+    def _envelope(self, isbns):
         """
-        Search for many isbns, 100 max.
-        Do 1 post request.
-        Return:
-        - tuple list of books (dicts), stacktraces
+        The SOAP envelope to ask for these isbns (100 max).
         """
-        bk_list = []
-        stacktraces = []
         envelope_skeleton = """<?xml version='1.0' encoding='utf-8'?>
 <soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/"><soap-env:Body><ns0:demandeFicheProduit xmlns:ns0="http://fel.ws.accelya.com/"><demandeur>{USER}</demandeur><motDePasse>{PASSWORD}</motDePasse>{EANS}<multiple>false</multiple></ns0:demandeFicheProduit></soap-env:Body></soap-env:Envelope>"""
         ean_skeleton = """<ean13s>{EAN}</ean13s>"""
@@ -199,95 +280,236 @@ class Scraper():
         envelope = envelope_skeleton.replace('{USER}', self.DILICOM_USER)\
                                     .replace('{PASSWORD}', self.DILICOM_PASSWORD)
 
-        EANS = ''
-        for isbn in isbns:
-            skel = ean_skeleton.replace('{EAN}', isbn)
-            EANS = EANS + skel
+        EANS = "".join(ean_skeleton.replace('{EAN}', isbn) for isbn in isbns)
 
         envelope = envelope.replace('{EANS}', EANS)
+        return envelope
 
-        session = requests.Session()
-        req = session.post(self.POST_URL, data=envelope, headers=self.HEADERS)
-        if not req.status_code == 200:
-            log.error("POST request to Dilicom responded with a non-success status code: {}".format(req.status_code))
+    def bulk_search(self, isbns, deadline=None):
+        """
+        Search for many isbns, 100 max.
+        Do 1 post request.
 
-        soup = BeautifulSoup(req.text, 'lxml')
-        product_list = soup.find_all('elemreponse')  # tags are lowercase.
-        code_execution = soup.find('demandeficheproduitrs').find('codeexecution').text
-        if code_execution != "OK":
-            logging.warning('The SOAP request {} on Dilicom was not OK: {}'.format(self.query, code_execution))
+        - deadline: seconds or Deadline. When it passes, we return the
+          books we decoded so far.
 
-        # is product found?
-        for product in product_list:
-            code = product.find('codeexecution').text
-            if code != 'OK':
-                log.error("Code execution not OK for Dilicom result: {}".format(product))
-                stacktraces.append("Dilicom error: {}".format(code))
-                continue
+        Return:
+        - tuple list of books (dicts), stacktraces
+        """
+        stacktraces = []
+        bk_list = []
+        with budget.scope(deadline) as current:
+            try:
+                for card in self.iter_bulk_search(isbns, stacktraces):
+                    bk_list.append(card)
+            except requests.exceptions.RequestException as e:
+                if current is None or not current.expired():
+                    raise
+                log.warning("Dilicom: no time left, we return {} books of {}.".format(len(bk_list), len(isbns)))
+                stacktraces.append("Dilicom: no answer in time ({}).".format(e))
+        return bk_list, stacktraces
+
+    async def abulk_search(self, isbns, deadline=None):
+        """
+        Coroutine version of bulk_search.
+        """
+        return await httpclient.to_thread(self.bulk_search, isbns, deadline=deadline)
 
-            isbn = self._isbn(product)
+    def iter_bulk_search(self, isbns, stacktraces):
+        """
+        Same as bulk_search, but yield the books while the response is
+        still being downloaded. The errors are appended to the given
+        stacktraces list.
 
-            diagnostic = product.find('diagnostic')
-            if diagnostic:
-                if diagnostic.text == 'UNKNOWN_EAN':
-                    stacktraces.append("EAN inconnu {}".format(isbn))
-                else:
-                    # All of them should be caught by != OK.
-                    stacktraces.append("Dilicom error: {}".format(diagnostic))
+        We don't ask again for the ISBNs Dilicom recently told us it
+        doesn't know (see negcache), nor for the ones it recently gave
+        us (see cardstore).
+        """
+        unknown = [it for it in isbns if negcache.is_absent(self.SOURCE_NAME, it)]
+        for isbn in unknown:
+            stacktraces.append("EAN inconnu {}".format(isbn))
+        to_fetch = []
+        for isbn in isbns:
+            if isbn in unknown:
                 continue
+            card = cardstore.get(isbn, self.SOURCE_NAME)
+            if card is not None:
+                yield card
+            else:
+                to_fetch.append(isbn)
+        isbns = to_fetch
+        if not isbns:
+            return
+
+        self.from_cache = False
+        req = httpclient.post(self.POST_URL, data=self._envelope(isbns), headers=self.HEADERS,
+                              stream=True, retry=backoff.SOAP)
+        decoder = ResponseDecoder()
+        chunks = req.iter_content(chunk_size=CHUNK_SIZE)
+        body = None
+        if archive.get_archive() is not None:
+            body = []
+            chunks = _tee(chunks, body)
+        try:
+            if not req.status_code == 200:
+                log.error("POST request to Dilicom responded with a non-success status code: {}".format(req.status_code))
+            for product in decoder.iter_products(chunks):
+                card = self._card(product, stacktraces)
+                if card is not None:
+                    yield card
+            if body is not None:
+                archive.store(self.POST_URL, b"".join(body), source=self.SOURCE_NAME, method='POST',
+                              args=isbns, status=req.status_code)
+            if decoder.code_execution != "OK":
+                logging.warning('The SOAP request {} on Dilicom was not OK: {}'.format(self.query, decoder.code_execution))
+                stacktraces.append("Dilicom error: {}".format(decoder.code_execution))
+        except etree.XMLSyntaxError as e:
+            log.error("Dilicom: could not parse the SOAP response: {}".format(e))
+            stacktraces.append("Dilicom error: invalid response ({})".format(e))
+        finally:
+            req.close()
+
+    def _card(self, product, stacktraces):
+        """
+        Build a book (dict) from a product decoded by iter_products.
 
-            b = addict.Dict()
-            authors = self._authors(product)
-            publishers = self._publishers(product)
-            b.authors = authors
-            b.search_terms = self.query
-            b.data_source = self.SOURCE_NAME
-            b.date_publication = self._date_publication(product)
-            b.details_url = self._details_url(product)
-            b.fmt = self._format(product)
-            b.title = self._title(product)
-            b.authors_repr = ", ".join(authors)
-            b.price = self._price(product)
-            b.price_fmt = price_fmt(b.price, self.currency)
-            b.currency = self.currency
-            b.publishers = publishers
-            b.pubs_repr = ", ".join(publishers)
-            # b.card_type = self.TYPE_BOOK
-            b.img = self._img(product)
-            b.summary = self._description(product)
-            b.isbn = isbn
-            b.availability = self._availability(product)
-            b.availability_fmt = self._availability_fmt(b.availability)
-            b.thickness, b.height, b.width, b.weight = self._dimensions(product)
-
-            bk_list.append(b.to_dict())
+        Return: the dict, or None if Dilicom didn't find it (the error
+        is appended to stacktraces).
+        """
+        # is product found?
+        code = product.get('codeexecution')
+        if code != 'OK':
+            log.error("Code execution not OK for Dilicom result: {}".format(product))
+            stacktraces.append("Dilicom error: {}".format(code))
+            return None
+
+        isbn = self._isbn(product)
+
+        if 'diagnostic' in product:
+            diagnostic = product.get('diagnostic')
+            if diagnostic == 'UNKNOWN_EAN':
+                stacktraces.append("EAN inconnu {}".format(isbn))
+                negcache.add(self.SOURCE_NAME, isbn)
+            else:
+                # All of them should be caught by != OK.
+                stacktraces.append("Dilicom error: {}".format(diagnostic))
+            return None
+
+        b = addict.Dict()
+        authors = self._authors(product)
+        publishers = self._publishers(product)
+        b.authors = authors
+        b.search_terms = self.query
+        b.data_source = self.SOURCE_NAME
+        b.date_publication = self._date_publication(product)
+        b.details_url = self._details_url(product)
+        b.fmt = self._format(product)
+        b.title = self._title(product)
+        b.authors_repr = ", ".join(authors)
+        b.price = self._price(product)
+        b.price_fmt = price_fmt(b.price, self.currency)
+        b.currency = self.currency
+        b.publishers = publishers
+        b.pubs_repr = ", ".join(publishers)
+        # b.card_type = self.TYPE_BOOK
+        b.img = self._img(product)
+        b.summary = self._description(product)
+        b.isbn = isbn
+        b.availability = self._availability(product)
+        b.availability_fmt = self._availability_fmt(b.availability)
+        b.thickness, b.height, b.width, b.weight = self._dimensions(product)
+
+        card = b.to_dict()
+        cardstore.put(card)
+        return card
+
+    def _check_search(self):
+        """
+        Return: an error message if we can't search, None otherwise.
+        """
+        if not self.DILICOM_USER or not self.DILICOM_PASSWORD:
+            log.warn("Dilicom: no DILICOM_USER or DILICOM_PASSWORD found. Aborting the search.")
+            return "No user and password found for Dilicom connection."
 
-        return bk_list, stacktraces
+        # Le FEL à la demande ne permet pas de recherche libre!
+        if not self.isbns:
+            log.warn("Dilicom's FEL à la demande only wants ISBNs, and none was given. Return.")
+            return "Please only search ISBNs on Dilicom."
+
+    def iter_search(self, parallel=MAX_PARALLEL, deadline=None):
+        """
+        Searches ISBNs by batches of 100, with at most `parallel`
+        requests at the same time (they share the connection pool of
+        httpclient).
+
+        - deadline: seconds, shared by all the batches (default: the
+          DEADLINE of the constructor). The batches that couldn't be sent
+          in time give no books and an error.
+
+        Yields a tuple list of books, stacktraces for each batch, as
+        soon as it is done (not necessarily in order).
+        """
+        error = self._check_search()
+        if error:
+            yield [], [error]
+            return
+
+        deadline = budget.get(deadline) or self.deadline or budget.current()
+        # Until a batch sends a request.
+        self.from_cache = True
+        isbn_groups = list(toolz.partition_all(BATCH_SIZE, self.isbns))
+        if len(isbn_groups) == 1:
+            yield self.bulk_search(isbn_groups[0], deadline=deadline)
+            return
+
+        log.debug("Searching {} ISBNs in {} batches.".format(len(self.isbns), len(isbn_groups)))
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = [executor.submit(self.bulk_search, isbns, deadline=deadline) for isbns in isbn_groups]
+            for future in as_completed(futures):
+                yield future.result()
 
     def search(self, *args, **kwargs):
         """
         Searches ISBNs, possibly hundreds at once, by batch of 100.
+        The batches are sent concurrently (see iter_search).
+
+        - parallel: max number of concurrent requests (default: MAX_PARALLEL).
+        - deadline: in seconds (see iter_search).
+
         Returns a tuple: list of books, stacktraces.
         """
+        all_results = []
+        all_stacktraces = []
+        for res, stacktraces in self.iter_search(parallel=kwargs.get('parallel', MAX_PARALLEL),
+                                                 deadline=kwargs.get('deadline')):
+            all_results += res
+            all_stacktraces += stacktraces
 
-        if not self.DILICOM_USER or not self.DILICOM_PASSWORD:
-            log.warn("Dilicom: no DILICOM_USER or DILICOM_PASSWORD found. Aborting the search.")
-            return [], ["No user and password found for Dilicom connection."]
+        return all_results, all_stacktraces
 
-        # Le FEL à la demande ne permet pas de recherche libre!
-        if not self.isbns:
-            log.warn("Dilicom's FEL à la demande only wants ISBNs, and none was given. Return.")
-            return [], ["Please only search ISBNs on Dilicom."]
+    async def asearch(self, *args, **kwargs):
+        """
+        Coroutine version of search(). The batches of 100 ISBNs are
+        sent concurrently, `parallel` at most.
+        """
+        error = self._check_search()
+        if error:
+            return [], [error]
+
+        semaphore = asyncio.Semaphore(kwargs.get('parallel', MAX_PARALLEL))
+        deadline = budget.get(kwargs.get('deadline')) or self.deadline or budget.current()
 
-        if len(self.isbns) > 100:
-            log.debug("Searching for more than 100 ISBNs.")
+        async def one_batch(isbns):
+            async with semaphore:
+                return await self.abulk_search(isbns, deadline=deadline)
 
-        isbn_groups = toolz.partition_all(100, self.isbns)
+        isbn_groups = toolz.partition_all(BATCH_SIZE, self.isbns)
+        self.from_cache = True
+        responses = await asyncio.gather(*[one_batch(isbns) for isbns in isbn_groups])
 
         all_results = []
         all_stacktraces = []
-        for isbns in isbn_groups:
-            res, stacktraces = self.bulk_search(isbns)
+        for res, stacktraces in responses:
             all_results += res
             all_stacktraces += stacktraces
 
@@ -5,12 +5,20 @@ import logging
 
 import addict
 import clize
-import requests
 from bs4 import BeautifulSoup
+import requests
 from sigtools.modifiers import annotate
 from sigtools.modifiers import autokwoargs
 
+from bookshops.utils import archive
+from bookshops.utils import backoff
+from bookshops.utils import budget
+from bookshops.utils import cardstore
+from bookshops.utils import httpclient
+from bookshops.utils import inflight
+from bookshops.utils import negcache
 from bookshops.utils import simplecache
+from bookshops.utils.baseScraper import refresher
 
 from bookshops.utils.decorators import catch_errors
 from bookshops.utils.scraperUtils import is_isbn
@@ -80,6 +88,8 @@ class Scraper():
         self.SOURCE_URL_ISBN_SEARCH = self.SOURCE_URL_SEARCH
         #: Optional suffix to the search url (may help to filter types, i.e. don't show e-books).
         self.URL_END = ""
+        #: The text of the page when nothing matched.
+        self.NO_RESULTS_TEXT = "Aucun résultat"
         self.TYPE_BOOK = "book"
         #: Query parameter to search for the ean/isbn
         self.ISBN_QPARAM = ""
@@ -94,35 +104,119 @@ class Scraper():
 
     def __init__(self, *args, **kwargs):
         """
+        FETCH=False: don't fire the POST request now, let search() or
+        asearch() do it.
+
+        NOCACHE=True: don't read nor write the caches (see archive.reparse).
+
+        REFRESH=True: don't read the caches, but update them.
+
+        DEADLINE=5: give up the request after 5 seconds (see budget).
         """
         self.args = args
         self.set_constants()
         self.PARAMS['inputSearch'] = args
 
         self.ARGS = args  # remember for simplecache, access in search() method.
-        self.cached_results = simplecache.get_cache(self.SOURCE_NAME, args)
+        self.nocache = kwargs.get('NOCACHE', False)
+        self.use_cache = not (self.nocache or kwargs.get('REFRESH', False))
+        self.deadline = budget.get(kwargs.get('DEADLINE'))
+        self.timed_out = None
+        self.cached_results = None
+        #: True when the results come from our caches, without any request.
+        self.from_cache = False
+        if self.use_cache:
+            self.cached_results = simplecache.get_cache(self.SOURCE_NAME, args,
+                                                        refresh=refresher(Scraper, args, {}))
         if self.cached_results is not None:
             log.debug("Hit cache.")
+            self.from_cache = True
             return
 
         self.req = None
         self.url = self.SOURCE_URL_SEARCH
         self.soup = None
+        self.fetched = False
         isbns = []
         if args:
             isbns = list(filter(is_isbn, args))
         if len(isbns) > 1:
             logging.info("Searching many isbns at once is not supported with this datasource so far.")
+            self.fetched = True  # nothing to fetch.
             return
         if isbns:
             self.PARAMS['inputSearch'] = isbns[0]
+            if self.use_cache:
+                if negcache.is_absent(self.SOURCE_NAME, isbns[0]):
+                    log.debug("{} is unknown on {}, we already searched it.".format(isbns[0], self.SOURCE_NAME))
+                    self.cached_results = []
+                    self.from_cache = True
+                    return
+                card = cardstore.get(isbns[0], self.SOURCE_NAME)
+                if card is not None:
+                    self.cached_results = [card]
+                    self.from_cache = True
+                    return
         else:
             self.PARAMS['inputSearch'] = " ".join(args)
 
-        self.req = requests.post(self.url, params=self.PARAMS, headers=self.HEADERS)
+        if kwargs.get('FETCH', True):
+            self._fetch()
+
+    def _post(self):
+        # A search form: we can send it again.
+        req = httpclient.post(self.url, params=self.PARAMS, headers=self.HEADERS, retry=backoff.GET)
+        archive.store_response(req, source=self.SOURCE_NAME, args=self.ARGS)
+        return req
+
+    async def _apost(self):
+        req = await httpclient.apost(self.url, params=self.PARAMS, headers=self.HEADERS, retry=backoff.GET)
+        archive.store_response(req, source=self.SOURCE_NAME, args=self.ARGS)
+        return req
+
+    def _inflight_key(self):
+        return inflight.key(self.SOURCE_NAME, self.ARGS)
+
+    def _fetch(self):
+        # Share the request with an identical search in progress (see inflight).
+        with budget.scope(self.deadline):
+            try:
+                req = inflight.do(self._inflight_key(), self._post)
+            except requests.exceptions.Timeout as e:
+                return self._give_up(e)
+        self._parse_response(req)
+
+    async def _afetch(self):
+        with budget.scope(self.deadline):
+            try:
+                req = await inflight.ado(self._inflight_key(), self._apost)
+            except requests.exceptions.Timeout as e:
+                return self._give_up(e)
+        self._parse_response(req)
+
+    def _give_up(self, error):
+        log.warning("{}: no answer in time: {}".format(self.SOURCE_NAME, error))
+        self.timed_out = "{}: no answer in time ({}).".format(self.SOURCE_NAME, error)
+        self.fetched = True
+
+    def _parse_response(self, req):
+        self.req = req
         if self.req.status_code != 200:
             logging.warning("Our search status code is not 'success'.")
         self.soup = BeautifulSoup(self.req.text, 'lxml')
+        self.fetched = True
+        isbn = self.PARAMS['inputSearch']
+        if is_isbn(isbn) and not self.nocache and self.req.status_code == 200 \
+           and not self.req.history and self._no_results():
+            negcache.add(self.SOURCE_NAME, isbn)
+
+    def _no_results(self):
+        """True when the page says that the search has no results (see
+        BaseScraper._no_results).
+        """
+        if self._product_list():
+            return False
+        return self.NO_RESULTS_TEXT.lower() in self.soup.get_text().lower()
 
     def _product_list(self):
         """
@@ -269,6 +363,13 @@ class Scraper():
             assert isinstance(self.cached_results, list)
             return self.cached_results, []
 
+        if kwargs.get('deadline') is not None:
+            self.deadline = budget.get(kwargs['deadline'])
+        if not self.fetched:
+            self._fetch()
+        if self.timed_out:
+            return [], [self.timed_out]
+
         product_list = self._product_list()
         # nbr_results = self._nbr_results()
         for product in product_list:
@@ -299,10 +400,20 @@ class Scraper():
 
             bk_list.append(b.to_dict())
 
-        simplecache.cache_results(self.SOURCE_NAME, self.ARGS, bk_list)
+        if not self.nocache:
+            simplecache.cache_results(self.SOURCE_NAME, self.ARGS, bk_list)
+            cardstore.put_many(bk_list)
         return bk_list, stacktraces
 
+    async def asearch(self, *args, **kwargs):
+        """Coroutine version of search(), to use with FETCH=False.
+        """
+        if self.cached_results is None and not self.fetched:
+            await self._afetch()
+        return self.search(*args, **kwargs)
+
 
+@budget.with_deadline
 def postSearch(card, isbn=None):
     """Get a card (dictionnary) with 'details_url'.
 
@@ -320,6 +431,12 @@ def postSearch(card, isbn=None):
     return card
 
 
+async def apostSearch(card, isbn=None):
+    """Coroutine version of postSearch.
+    """
+    return await httpclient.to_thread(postSearch, card, isbn=isbn)
+
+
 @annotate(words=clize.Parameter.REQUIRED, review='r')
 @autokwoargs()
 def main(review=False, *words):
@@ -9,11 +9,14 @@ from termcolor import colored
 
 import addict
 import clize
-import requests
 from bs4 import BeautifulSoup
 from sigtools.modifiers import annotate
 from sigtools.modifiers import autokwoargs
 
+from bookshops.utils import budget
+from bookshops.utils import cardstore
+from bookshops.utils import httpclient
+from bookshops.utils import prefetch
 from bookshops.utils import simplecache
 
 from bookshops.utils.baseScraper import BaseScraper
@@ -59,6 +62,10 @@ class Scraper(BaseScraper):
         #: Number of results to display
         self.NBR_RESULTS_QPARAM = "NOMBRE"
         self.NBR_RESULTS = 12
+        #: The text of the page when nothing matched.
+        self.NO_RESULTS_TEXT = "Aucun résultat"
+        #: pagination() gives the next pages.
+        self.PAGINATED = True
 
     def __init__(self, *args, **kwargs):
         """
@@ -69,11 +76,11 @@ class Scraper(BaseScraper):
     def pagination(self):
         """Format the url part to grab the right page.
 
+        Every page, the first one too, gives its size: the offsets
+        are counted with it.
+
         Return: a str, the necessary url part to add at the end.
         """
-        if self.page == 1 or self.page == "1" or self.page == "1":
-            return ""
-
         page_qparam = ""
         if type(self.page) in [type("u"), type("str")]:
             self.page = int(self.page)
@@ -108,7 +115,7 @@ class Scraper(BaseScraper):
                 print('Error matching nbr_result')
             else:
                 nbr = int(res.strip())
-                self.NBR_RESULTS = nbr
+                # NBR_RESULTS is the page size, don't overwrite it.
                 logging.info('Nb of results: {}'.format(nbr))
                 return nbr
         except Exception as e:
@@ -261,8 +268,12 @@ class Scraper(BaseScraper):
             log.debug("search: hit cache.")
             # print("-- cache hit for ".format(self.ARGS))
             assert isinstance(self.cached_results, list)
+            prefetch.prefetch_next(self, self.cached_results)
             return self.cached_results, []
 
+        self._fetch_if_needed(kwargs.get('deadline'))
+        if self.timed_out:
+            return [], [self.timed_out]
         bk_list = []
         stacktraces = []
 
@@ -294,10 +305,14 @@ class Scraper(BaseScraper):
 
             bk_list.append(b.to_dict())
 
-        simplecache.cache_results(self.SOURCE_NAME, self.ARGS, bk_list)
+        if not self.nocache:
+            simplecache.cache_results(self.SOURCE_NAME, self.ARGS, bk_list, kwargs=self.KWARGS)
+            cardstore.put_many(bk_list)
+        prefetch.prefetch_next(self, bk_list)
         return bk_list, stacktraces
 
 
+@budget.with_deadline
 def postSearch(card, isbn=None):
     """Get a card (dictionnary) with 'details_url'.
 
@@ -315,6 +330,12 @@ def postSearch(card, isbn=None):
     return card
 
 
+async def apostSearch(card, isbn=None):
+    """Coroutine version of postSearch.
+    """
+    return await httpclient.to_thread(postSearch, card, isbn=isbn)
+
+
 def _scrape_review(link):
     """
     - link: url to get a review from.
@@ -367,7 +388,7 @@ def reviews(card):
     urltosearch = url.replace('{{ search }}', '{}'.format(rmPunctuation(card['title'])))
     logging.info("request of reviews for {}...".format(urltosearch))
     with Timer("request on framabee", silent=silent):   # False: print output.
-        req = requests.get(urltosearch)
+        req = httpclient.get(urltosearch)
     if not req.status_code == 200:
         logging.info("status code for request on {}: {}".format(card['title'], req.status_code))
         return None
@@ -422,7 +443,7 @@ def main(review=False, *words):
         return
     scrap = Scraper(*words)
     bklist, errors = scrap.search()
-    print((" Nb results: {}/{}".format(len(bklist), scrap.NBR_RESULTS)))
+    print((" Nb results: {}/{}".format(len(bklist), scrap._nbr_results())))
     bklist = [postSearch(it) for it in bklist]
 
     # Get reviews:
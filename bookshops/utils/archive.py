@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Archive of the raw pages we fetched.
+
+When a website changes its markup and we fix our selectors, we can
+parse the archived pages again instead of fetching them again. They are
+also a realistic corpus to benchmark the parsers offline.
+
+Disabled by default. Enable it with an environment variable:
+
+    export BOOKSHOPS_ARCHIVE_DIR=~/.cache/bookshops-archive
+
+The bodies are gzipped and stored by their sha256 (the same page
+fetched twice is stored once), in objects/ab/abcdef….gz. An index in
+SQLite gives the pages by source, url and fetch time. When the bodies
+take more than MAX_SIZE bytes on disk, the oldest pages are deleted.
+
+Parse the archived pages of a source again:
+
+    from bookshops.utils import archive
+    from bookshops.frFR.librairiedeparis.librairiedeparisScraper import Scraper
+
+    for page in archive.get_archive().pages(source="librairiedeparis"):
+        bklist, errors = archive.reparse(Scraper, page)
+
+For Dilicom, decode the SOAP response with ResponseDecoder().iter_products([page.body]).
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from contextlib import contextmanager
+
+import requests
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Max size of the compressed bodies on disk, in bytes.
+MAX_SIZE = int(os.getenv('BOOKSHOPS_ARCHIVE_MAX_SIZE', 500 * 1000 * 1000))
+
+#: When we evict, we go down to this ratio of MAX_SIZE.
+EVICT_TO = 0.9
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS pages (
+        id INTEGER PRIMARY KEY,
+        source TEXT,
+        url TEXT NOT NULL,
+        method TEXT NOT NULL,
+        args TEXT,
+        status INTEGER,
+        encoding TEXT,
+        fetched_at REAL NOT NULL,
+        digest TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS pages_url ON pages (url, fetched_at)",
+    "CREATE INDEX IF NOT EXISTS pages_source ON pages (source, fetched_at)",
+    """CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL
+    )""",
+]
+
+
+class Page(object):
+    """
+    An archived page. The body is read from disk when asked.
+    """
+
+    def __init__(self, archive, row):
+        self.archive = archive
+        (self.id, self.source, self.url, self.method, args, self.status,
+         self.encoding, self.fetched_at, self.digest) = row
+        #: the arguments of the scraper that fetched it.
+        self.args = json.loads(args) if args else []
+
+    @property
+    def body(self):
+        with gzip.open(self.archive._path(self.digest), 'rb') as f:
+            return f.read()
+
+    def response(self):
+        """
+        Return: a requests.Response, as if we had just fetched the page.
+        """
+        res = requests.Response()
+        res._content = self.body
+        res.status_code = self.status
+        res.url = self.url
+        res.encoding = self.encoding
+        return res
+
+    def __repr__(self):
+        return "<Page {} {} {}>".format(self.source, self.url, self.fetched_at)
+
+
+class Archive(object):
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.exists(os.path.join(self.directory, 'objects')):
+            os.makedirs(os.path.join(self.directory, 'objects'))
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        """
+        A connection to the index, committed and closed at the end.
+        """
+        with closing(sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=5)) as conn:
+            with conn:
+                yield conn
+
+    def _path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest + '.gz')
+
+    def _write_blob(self, digest, body):
+        """
+        Write the compressed body, if we don't have it yet.
+
+        Return: its size on disk.
+        """
+        path = self._path(digest)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write aside and rename: a reader never sees a partial file.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(gzip.compress(body))
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def store(self, url, body, source=None, method='GET', args=None, status=200, encoding=None):
+        """
+        Archive this body (bytes).
+
+        Return: its digest.
+        """
+        if isinstance(body, str):
+            body = body.encode(encoding or 'utf8')
+        digest = hashlib.sha256(body).hexdigest()
+        # The blob and its index row, under the lock of evict: it can't
+        # delete the blob before the row references it.
+        with self.lock, self._connect() as conn:
+            stored_size = self._write_blob(digest, body)
+            conn.execute("INSERT OR IGNORE INTO blobs (digest, size, stored_size) VALUES (?, ?, ?)",
+                         (digest, len(body), stored_size))
+            conn.execute("INSERT INTO pages (source, url, method, args, status, encoding, fetched_at, digest)"
+                         " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (source, url, method, json.dumps(list(args or [])), status, encoding,
+                          time.time(), digest))
+        self.evict()
+        return digest
+
+    def size(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()[0]
+
+    def evict(self):
+        """
+        Delete the oldest pages while we are above the size budget.
+
+        Return: the number of bodies deleted.
+        """
+        if self.size() <= self.max_size:
+            return 0
+        deleted = 0
+        with self.lock, self._connect() as conn:
+            target = self.max_size * EVICT_TO
+            while conn.execute("SELECT COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()[0] > target:
+                conn.execute("DELETE FROM pages WHERE id IN"
+                             " (SELECT id FROM pages ORDER BY fetched_at LIMIT 100)")
+                orphans = [row[0] for row in conn.execute(
+                    "SELECT digest FROM blobs WHERE digest NOT IN (SELECT digest FROM pages)")]
+                if not orphans and not conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]:
+                    break
+                for digest in orphans:
+                    conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    try:
+                        os.remove(self._path(digest))
+                    except OSError:
+                        pass
+                deleted += len(orphans)
+        log.debug("archive: deleted {} old pages.".format(deleted))
+        return deleted
+
+    def pages(self, source=None, url=None, since=None):
+        """
+        The archived pages, oldest first, filtered by source, url, or
+        fetch time (timestamp).
+
+        Return: a list of Page.
+        """
+        query = "SELECT id, source, url, method, args, status, encoding, fetched_at, digest FROM pages"
+        clauses = []
+        params = []
+        if source:
+            clauses.append("source = ?")
+            params.append(source)
+        if url:
+            clauses.append("url = ?")
+            params.append(url)
+        if since:
+            clauses.append("fetched_at >= ?")
+            params.append(since)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY fetched_at"
+        with self._connect() as conn:
+            return [Page(self, row) for row in conn.execute(query, params)]
+
+    def stats(self):
+        with self._connect() as conn:
+            pages = conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs, size, stored_size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()
+        return {
+            'pages': pages,
+            'bodies': blobs,
+            'size': size,
+            'stored_size': stored_size,
+        }
+
+
+ARCHIVE = None
+
+
+def enable(directory, max_size=MAX_SIZE):
+    """
+    Archive the pages in this directory. None to stop archiving.
+    """
+    global ARCHIVE
+    ARCHIVE = Archive(directory, max_size=max_size) if directory else None
+    return ARCHIVE
+
+
+def get_archive():
+    return ARCHIVE
+
+
+if os.getenv('BOOKSHOPS_ARCHIVE_DIR'):
+    try:
+        enable(os.getenv('BOOKSHOPS_ARCHIVE_DIR'))
+    except Exception as e:
+        log.error("Could not open the archive {}: {}".format(os.getenv('BOOKSHOPS_ARCHIVE_DIR'), e))
+
+
+def store(url, body, **kwargs):
+    """
+    Archive this body, if the archive is enabled. Never fails.
+    """
+    if ARCHIVE is None or body is None:
+        return
+    try:
+        return ARCHIVE.store(url, body, **kwargs)
+    except Exception as e:
+        log.error("archive: could not store {}: {}".format(url, e))
+
+
+def store_response(req, source=None, args=None):
+    """
+    Archive the body of this requests.Response.
+    """
+    if ARCHIVE is None or req is None:
+        return
+    return store(req.url, req.content, source=source, method=req.request.method if getattr(req, 'request', None) else 'GET',
+                 args=args, status=req.status_code, encoding=req.encoding)
+
+
+def reparse(scraper_class, page):
+    """
+    Run the extraction of this scraper (BaseScraper, lelivre) on an
+    archived page. The caches are neither read nor written.
+
+    Return: the tuple list of books, stacktraces of search().
+    """
+    scraper = scraper_class(*page.args, FETCH=False, NOCACHE=True)
+    scraper._parse_response(page.response())
+    return scraper.search()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Retry the requests that failed for a transient reason.
+
+httpclient sends a request again after a connection error (reset,
+refused, timeout) or a 429, 500, 502, 503, 504 answer. Between two
+attempts we wait a random time between 0 and base * 2^attempt seconds
+(exponential backoff with full jitter), so that the clients that failed
+together don't come back together. When the site gives a Retry-After,
+we wait at least that long, and so do the other requests to this host
+(see ratelimit.pause). Every attempt waits for its token of the rate
+limiter and is recorded by the circuit breaker.
+
+We never retry when the deadline of the search (see budget) would pass
+before the next attempt.
+
+The policies:
+
+- GET: the searches and the details pages, 3 attempts.
+- SOAP: the Dilicom POST, 2 attempts, only when we know the request
+  was not processed (connection not established, 429, 503).
+- NO_RETRY: the other POST requests.
+
+Give another policy to a request with:
+
+    httpclient.get(url, retry=backoff.Policy(attempts=5, base=1))
+
+    backoff.stats()
+    {'retries': 12, 'gave_up': 1}
+"""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from bookshops.utils import breaker
+from bookshops.utils import budget
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: The answers worth another try.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#: The answers that mean the request was not processed.
+SLOW_DOWN_STATUSES = (429, 503)
+
+#: We don't wait longer than this for a Retry-After (seconds).
+MAX_RETRY_AFTER = 30
+
+
+class Policy(object):
+    """
+    How many times, and how, we retry a request.
+
+    - attempts: total number of attempts, the first one included.
+    - base, cap: the backoff before the retry n is random, between 0
+      and min(cap, base * 2^n) seconds.
+    - statuses: the answers we retry.
+    - idempotent: False if sending the request twice could be harmful:
+      we only retry when it surely didn't reach the site.
+    """
+
+    def __init__(self, attempts=3, base=0.5, cap=8, statuses=RETRY_STATUSES,
+                 idempotent=True, max_retry_after=MAX_RETRY_AFTER):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.statuses = statuses
+        self.idempotent = idempotent
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def retry_error(self, error):
+        if isinstance(error, (breaker.CircuitOpenError, budget.DeadlineExceeded)):
+            return False
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            # We could not connect: the site didn't get the request.
+            return True
+        if not self.idempotent:
+            return False
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def retry_response(self, response):
+        return response.status_code in self.statuses
+
+    def __repr__(self):
+        return "<Policy {} attempts, base {}s>".format(self.attempts, self.base)
+
+
+#: The searches and details pages.
+GET = Policy(attempts=3, base=0.5, cap=8)
+
+#: The Dilicom SOAP request.
+SOAP = Policy(attempts=2, base=1, cap=10, statuses=SLOW_DOWN_STATUSES, idempotent=False)
+
+NO_RETRY = Policy(attempts=1)
+
+_lock = threading.Lock()
+STATS = {
+    'retries': 0,
+    'gave_up': 0,
+}
+
+
+def policy_for(method):
+    """
+    The default policy of this HTTP method.
+    """
+    return GET if method in ('GET', 'HEAD') else NO_RETRY
+
+
+def retry_after(response):
+    """
+    The Retry-After header of this response, in seconds (it can be a
+    number of seconds or a date), or None.
+    """
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def _count(counter):
+    with _lock:
+        STATS[counter] += 1
+
+
+def next_delay(policy, attempt, error=None, response=None):
+    """
+    Should we send the request again, after this error or this answer?
+
+    - attempt: 0 after the first attempt.
+
+    Return: the time to wait before the next attempt (seconds), or None
+    to stop here.
+    """
+    if policy.attempts <= 1:
+        return None
+    if error is not None and not policy.retry_error(error):
+        return None
+    if response is not None and not policy.retry_response(response):
+        return None
+    wait = policy.backoff(attempt)
+    after = retry_after(response)
+    if after is not None:
+        wait = max(wait, after)
+    deadline = budget.current()
+    if attempt + 1 >= policy.attempts \
+       or (after is not None and after > policy.max_retry_after) \
+       or (deadline is not None and deadline.remaining() <= wait):
+        _count('gave_up')
+        return None
+    _count('retries')
+    return wait
+
+
+def stats():
+    with _lock:
+        return dict(STATS)
@@ -21,13 +21,21 @@
 Base scraper to build new ones.
 """
 
+import functools
 import logging
-import requests
 from bs4 import BeautifulSoup
+import requests
 
 from bookshops.utils.scraperUtils import is_isbn
 from bookshops.utils.scraperUtils import price_fmt
 from bookshops.utils.decorators import catch_errors
+from bookshops.utils import archive
+from bookshops.utils import budget
+from bookshops.utils import cardstore
+from bookshops.utils import httpclient
+from bookshops.utils import inflight
+from bookshops.utils import negcache
+from bookshops.utils import prefetch
 from bookshops.utils import simplecache
 
 logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
@@ -80,6 +88,11 @@ class BaseScraper(object):
     currency = '€'
     query = ""
     METHOD = 'GET'
+    #: Does pagination() give the next pages (PAGE=2, 3…)?
+    PAGINATED = False
+    #: The text of the page when the search has no results. Without it,
+    #: we don't remember the unknown isbns (see negcache).
+    NO_RESULTS_TEXT = None
 
     def set_constants(self):
         """Call before __init__.
@@ -119,12 +132,39 @@ class BaseScraper(object):
         keywords arguments (key/values pairs, values being lists).
 
         Keys can be: label (for title), author_names,publisher, isbn etc.
+
+        FETCH=False: only build the url, don't fire the request. It
+        will be done by search() or, without blocking, by asearch().
+
+        NOCACHE=True: don't read nor write the caches (see archive.reparse).
+
+        REFRESH=True: don't read the caches, but update them (see
+        simplecache.SOFT_TTL).
+
+        DEADLINE=5: give up the requests after 5 seconds (see budget).
         """
 
         self.ARGS = args  # remember for simplecache, access in search() method.
-        self.cached_results = simplecache.get_cache(self.SOURCE_NAME, args)
+        self.KWARGS = dict(kwargs)
+        self.page = kwargs.get('PAGE') or 1
+        self.soup = None
+        #: The isbn, when we search for one.
+        self.isbn_query = None
+        self.nocache = kwargs.pop('NOCACHE', False)
+        self.use_cache = not (self.nocache or kwargs.pop('REFRESH', False))
+        self.deadline = budget.get(kwargs.pop('DEADLINE', None))
+        #: The error message when we ran out of time.
+        self.timed_out = None
+        self.cached_results = None
+        #: True when the results come from our caches, without any request.
+        self.from_cache = False
+        if self.use_cache:
+            self.cached_results = simplecache.get_cache(self.SOURCE_NAME, args,
+                                                        refresh=refresher(type(self), args, kwargs),
+                                                        kwargs=kwargs)
         if self.cached_results is not None:
             log.debug("Hit cache.")
+            self.from_cache = True
             return
 
         self.USER_AGENT = "Abelujo"
@@ -139,7 +179,9 @@ class BaseScraper(object):
         # product page.
         self.ISBN_SEARCH_REDIRECTED_TO_PRODUCT_PAGE = False
 
-        self.page = 1
+        self.req = None
+        self.fetched = False
+        fetch = kwargs.pop('FETCH', True)
         isbns = []
         if not args and not kwargs:
             print('Error: give args to the query')
@@ -179,6 +221,7 @@ class BaseScraper(object):
 
             # If a isbn is given, search for it
             if isbns:
+                self.isbn_query = isbns[0]
                 # Some sites use query parameters to set the isbn,
                 # others treat it like a normal one (casa del libro).
                 if self.ISBN_QPARAM not in ["", ""]:
@@ -206,13 +249,97 @@ class BaseScraper(object):
                 self.url += self.URL_END + self.pagination()
 
         log.debug('search url: %s' % self.url)
-        self.req = requests.get(self.url, headers=self.HEADERS)
+        if self.isbn_query and self.use_cache:
+            if negcache.is_absent(self.SOURCE_NAME, self.isbn_query):
+                log.debug("{} is unknown on {}, we already searched it.".format(self.isbn_query, self.SOURCE_NAME))
+                self.cached_results = []
+                self.from_cache = True
+                return
+            card = cardstore.get(self.isbn_query, self.SOURCE_NAME)
+            if card is not None:
+                self.cached_results = [card]
+                self.from_cache = True
+                return
+
+        if fetch:
+            self._fetch()
+
+    def _get(self):
+        req = httpclient.get(self.url, headers=self.HEADERS)
+        archive.store_response(req, source=self.SOURCE_NAME, args=self.ARGS)
+        return req
+
+    async def _aget(self):
+        req = await httpclient.aget(self.url, headers=self.HEADERS)
+        archive.store_response(req, source=self.SOURCE_NAME, args=self.ARGS)
+        return req
+
+    def _inflight_key(self):
+        return inflight.key(self.SOURCE_NAME, self.ARGS, self.KWARGS)
+
+    def _fetch(self):
+        """Fire the request and parse the page.
+
+        If the same search is being fetched by someone else, we wait
+        for its response instead (see inflight).
+        """
+        with budget.scope(self.deadline):
+            try:
+                req = inflight.do(self._inflight_key(), self._get)
+            except requests.exceptions.Timeout as e:
+                return self._give_up(e)
+        self._parse_response(req)
+
+    async def _afetch(self):
+        with budget.scope(self.deadline):
+            try:
+                req = await inflight.ado(self._inflight_key(), self._aget)
+            except requests.exceptions.Timeout as e:
+                return self._give_up(e)
+        self._parse_response(req)
+
+    def _give_up(self, error):
+        """
+        No answer in time: search() returns no results and this error.
+        """
+        log.warning("{}: no answer in time for {}: {}".format(self.SOURCE_NAME, self.url, error))
+        self.timed_out = "{}: no answer in time ({}).".format(self.SOURCE_NAME, error)
+        self.fetched = True
+
+    def _fetch_if_needed(self, deadline=None):
+        """To call at the beginning of search(), when the instance was
+        built with FETCH=False.
+
+        - deadline: seconds, replaces the DEADLINE of the constructor.
+        """
+        if deadline is not None:
+            self.deadline = budget.get(deadline)
+        if not self.fetched:
+            self._fetch()
+
+    def _parse_response(self, req):
+        self.req = req
         if self.req.history and self.req.history[0].status_code == 302:
             log.info("First request: we got redirected")
             self.ISBN_SEARCH_REDIRECTED_TO_PRODUCT_PAGE = True
             self.url_product_page = self.req.url
 
         self.soup = BeautifulSoup(self.req.content, "lxml")
+        self.fetched = True
+        if self.isbn_query and not self.nocache and self.req.status_code == 200 \
+           and not self.req.history and self._no_results():
+            negcache.add(self.SOURCE_NAME, self.isbn_query)
+
+    def _no_results(self):
+        """True when the page says that the search has no results: it
+        has the NO_RESULTS_TEXT of the scraper.
+
+        Without this marker we never say so: an empty product list may
+        be a change of markup.
+        """
+        if not self.NO_RESULTS_TEXT or self._product_list():
+            return False
+        return self.NO_RESULTS_TEXT.lower() in self.soup.get_text().lower()
 
     def pagination(self):
         """Format the url part to grab the right page.
@@ -222,6 +349,26 @@ class BaseScraper(object):
         page_qparam = ""
         return page_qparam
 
+    def _nbr_results(self):
+        """The total number of results of the search, if the page tells it.
+        """
+        return None
+
+    def has_next_page(self, results):
+        """
+        Is there a page after this one?
+
+        - results: the cards of this page.
+        """
+        if not self.PAGINATED or self.isbn_query or not results:
+            return False
+        if self.soup is not None:
+            total = self._nbr_results()
+            if total:
+                return int(self.page) * self.NBR_RESULTS < total
+        # From the cache: we don't know the total. A full page may have a next one.
+        return len(results) >= self.NBR_RESULTS
+
     def _product_list(self):
         """The css class that every block of book has in common.
 
@@ -293,12 +440,18 @@ class BaseScraper(object):
     def search(self, *args, **kwargs):
         """Searches books.
 
+        - deadline: in seconds (see budget).
+
         Returns: a couple list of books / stacktraces.
         """
         if self.cached_results is not None:
             log.debug("search: hit cache.")
-            return self.cached_results
+            prefetch.prefetch_next(self, self.cached_results)
+            return self.cached_results, []
 
+        self._fetch_if_needed(kwargs.get('deadline'))
+        if self.timed_out:
+            return [], [self.timed_out]
         bk_list = []
         stacktraces = []
         product_list = self._product_list()
@@ -325,7 +478,7 @@ class BaseScraper(object):
             b["authors"] = authors
             b["authors_repr"] = authors_repr
             b["price"] = self._price(product)
-            b["price_fmt"] = price_fmt(b.price, self.currency)
+            b["price_fmt"] = price_fmt(b["price"], self.currency)
             b["currency"] = self.currency
 
             b["description"] = self._description(product)
@@ -337,11 +490,77 @@ class BaseScraper(object):
             b["card_type"] = self.TYPE_BOOK
             bk_list.append(b)
 
-        simplecache.cache_results(self.SOURCE_NAME, self.ARGS, bk_list)
+        if not self.nocache:
+            simplecache.cache_results(self.SOURCE_NAME, self.ARGS, bk_list, kwargs=self.KWARGS)
+            cardstore.put_many(bk_list)
+        prefetch.prefetch_next(self, bk_list)
 
         return (bk_list, stacktraces)
 
+    def for_page(self, page):
+        """
+        Return: a scraper for this page of the same search (not fetched yet).
+        """
+        kwargs = dict(self.KWARGS)
+        kwargs['PAGE'] = page
+        kwargs['FETCH'] = False
+        return type(self)(*self.ARGS, **kwargs)
+
+    def next_page(self):
+        return self.for_page(int(self.page) + 1)
+
+    def iter_results(self):
+        """
+        Yield the books one by one, across all the pages of the search.
+
+        The next page is fetched only when the consumer gets there, and
+        we keep one page in memory at a time. We stop at the last page
+        (see has_next_page). Sources without pagination give their
+        first page.
+
+        for card in Scraper("ed:agone", FETCH=False).iter_results():
+            ...
+        """
+        scraper = self
+        while True:
+            bk_list, stacktraces = scraper.search()
+            if stacktraces:
+                log.warning("iter_results: errors on page {}: {}".format(scraper.page, stacktraces))
+            for card in bk_list:
+                yield card
+            if not scraper.has_next_page(bk_list):
+                return
+            scraper = scraper.next_page()
+
+    async def asearch(self, *args, **kwargs):
+        """Coroutine version of search(): the request doesn't block the
+        event loop. Build the scraper with FETCH=False, so than the
+        constructor doesn't fire it:
+
+        scrap = Scraper("antigone", FETCH=False)
+        bklist, errors = await scrap.asearch()
+        """
+        if self.cached_results is None and not self.fetched:
+            await self._afetch()
+        return self.search(*args, **kwargs)
+
+
+def refresh_search(scraper_class, args, kwargs):
+    """Search again and update the caches.
+    """
+    scraper_class(*args, REFRESH=True, **kwargs).search()
+
 
+def refresher(scraper_class, args, kwargs):
+    """
+    Return: a function that runs this search again, for the
+    stale-while-revalidate mode of simplecache.
+    """
+    kwargs = {key: val for key, val in kwargs.items() if key != 'FETCH'}
+    return functools.partial(refresh_search, scraper_class, args, kwargs)
+
+
+@budget.with_deadline
 def postSearch(card):
     """Complementary informations to fetch on a details' page.
 
@@ -352,6 +571,12 @@ def postSearch(card):
     return card
 
 
+async def apostSearch(card):
+    """Coroutine version of postSearch.
+    """
+    return await httpclient.to_thread(postSearch, card)
+
+
 def reviews(card_dict):
     """Get reviews of that card on good websites.
 
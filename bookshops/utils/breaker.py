@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Circuit breaker: stop sending requests to a website that is down.
+
+Every request of httpclient is recorded in the breaker of its host. A
+request fails when it raises (connection refused, reset, timeout), when
+the site answers a 5xx, or when it takes more than SLOW_CALL seconds.
+
+- closed: the requests go through.
+- open: when at least FAILURE_RATE of the last requests (MIN_CALLS of
+  them at least, in the last WINDOW seconds) failed. The requests fail
+  at once with CircuitOpenError, without touching the network.
+- half-open: OPEN_DURATION seconds later, we let PROBES requests go
+  through. If they succeed, the circuit is closed again, otherwise it
+  is open for another OPEN_DURATION.
+
+The state of each host, to grey out a source:
+
+    from bookshops.utils import breaker
+
+    breaker.state("http://www.casadellibro.com")
+    'open'
+    breaker.stats()
+    {'http://www.casadellibro.com': {'state': 'open', 'calls': 8, 'failures': 8, 'retry_in': 21.5}}
+"""
+
+from collections import deque
+import logging
+import threading
+import time
+
+import requests
+
+from bookshops.utils.scraperUtils import host_of
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+#: Open the circuit when this ratio of the recent requests failed.
+FAILURE_RATE = 0.5
+
+#: ... and when we have at least this many recent requests.
+MIN_CALLS = 5
+
+#: The recent requests are the ones of the last N seconds.
+WINDOW = 60
+
+#: A request slower than this (seconds) counts as a failure.
+SLOW_CALL = 10
+
+#: How long the circuit stays open before we probe the site again.
+OPEN_DURATION = 30
+
+#: Number of probe requests at once in the half-open state.
+PROBES = 1
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    The site is considered down, the request was not sent.
+    """
+
+
+class Breaker(object):
+    """
+    The circuit breaker of one host. Thread-safe.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.state = CLOSED
+        #: (time, failed) of the recent requests.
+        self.calls = deque()
+        self.opened_at = None
+        self.probes = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _trim(self, now):
+        while self.calls and self.calls[0][0] < now - WINDOW:
+            self.calls.popleft()
+
+    def _open(self, now):
+        if self.state != OPEN:
+            log.warning("breaker: {} seems down, we stop sending it requests for {}s".format(
+                self.name, OPEN_DURATION))
+        self.state = OPEN
+        self.opened_at = now
+        self.probes = 0
+
+    def allow(self):
+        """
+        Can we send a request? In the half-open state, a True reserves a
+        probe: the caller must record() its outcome.
+        """
+        with self.lock:
+            now = time.time()
+            if self.state == OPEN and now - self.opened_at >= OPEN_DURATION:
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self.probes < PROBES:
+                self.probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, failed):
+        with self.lock:
+            now = time.time()
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    log.info("breaker: {} is back".format(self.name))
+                    self.state = CLOSED
+                    self.calls.clear()
+                return
+            if self.state == OPEN:
+                # A request sent before the circuit opened.
+                return
+            self.calls.append((now, failed))
+            self._trim(now)
+            failures = sum(1 for _, it in self.calls if it)
+            if len(self.calls) >= MIN_CALLS and failures >= FAILURE_RATE * len(self.calls):
+                self._open(now)
+
+    def cancel(self):
+        """
+        The request allowed by allow() was not sent, or its outcome
+        says nothing of the site (our deadline was too short).
+        """
+        with self.lock:
+            if self.state == HALF_OPEN and self.probes:
+                self.probes -= 1
+
+    def current_state(self):
+        with self.lock:
+            if self.state == OPEN and time.time() - self.opened_at >= OPEN_DURATION:
+                return HALF_OPEN
+            return self.state
+
+    def to_dict(self):
+        state = self.current_state()
+        with self.lock:
+            self._trim(time.time())
+            res = {
+                'state': state,
+                'calls': len(self.calls),
+                'failures': sum(1 for _, it in self.calls if it),
+                'rejected': self.rejected,
+            }
+            if state == OPEN:
+                res['retry_in'] = round(self.opened_at + OPEN_DURATION - time.time(), 1)
+            return res
+
+
+#: host -> Breaker
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    host = host_of(url)
+    with _breakers_lock:
+        breaker = BREAKERS.get(host)
+        if breaker is None:
+            breaker = BREAKERS[host] = Breaker(host)
+        return breaker
+
+
+def before(url):
+    """
+    Raise CircuitOpenError if the host of this url is down.
+    """
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        raise CircuitOpenError("{} is down, the request was not sent (circuit open).".format(breaker.name))
+    return breaker
+
+
+def is_failure(response=None, elapsed=0):
+    if response is None:
+        return True
+    return response.status_code >= 500 or elapsed > SLOW_CALL
+
+
+def state(url):
+    """
+    closed, open or half-open.
+    """
+    return get_breaker(url).current_state()
+
+
+def is_available(url):
+    return state(url) != OPEN
+
+
+def reset():
+    with _breakers_lock:
+        BREAKERS.clear()
+
+
+def stats():
+    with _breakers_lock:
+        breakers = list(BREAKERS.items())
+    return {host: breaker.to_dict() for host, breaker in breakers}
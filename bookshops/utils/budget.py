@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time budgets: a search must not hang a worker forever.
+
+Every request of httpclient has a connect and a read timeout:
+CONNECT_TIMEOUT and READ_TIMEOUT by default. When a search is given a
+deadline (in seconds), all its requests share it: the search page, the
+details pages, the Dilicom batches. Each one gets the time that
+remains, and when it is spent the search returns what it got.
+
+    Scraper("antigone", DEADLINE=5).search()
+    Scraper("antigone", FETCH=False).search(deadline=5)
+    postSearch(card, deadline=2)
+    dilicomScraper.Scraper(*isbns).search(deadline=10)
+
+In the code, a deadline is given to the requests of the current thread
+(or coroutine) with:
+
+    with budget.scope(5):
+        req = httpclient.get(url)
+"""
+
+from contextlib import contextmanager
+import contextvars
+from functools import wraps
+import logging
+import os
+import time
+
+import requests
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Max time to open a connection (seconds).
+CONNECT_TIMEOUT = float(os.getenv('BOOKSHOPS_CONNECT_TIMEOUT', 5))
+
+#: Max time between two bytes of the response (seconds).
+READ_TIMEOUT = float(os.getenv('BOOKSHOPS_READ_TIMEOUT', 30))
+
+#: The deadline of the current thread or asyncio task.
+_current = contextvars.ContextVar('bookshops_deadline', default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    The deadline passed before we could send the request.
+    """
+
+
+class Deadline(object):
+    """
+    A point in time, shared by all the requests of a search.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.end = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.end - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded("the deadline of {}s has passed.".format(self.seconds))
+
+    def __repr__(self):
+        return "<Deadline {:.2f}s left>".format(self.remaining())
+
+
+def get(deadline):
+    """
+    Return: a Deadline from seconds, the same Deadline, or None.
+    """
+    if deadline is None or isinstance(deadline, Deadline):
+        return deadline
+    return Deadline(float(deadline))
+
+
+def current():
+    """
+    The deadline of the current thread or task, or None.
+    """
+    return _current.get()
+
+
+@contextmanager
+def scope(deadline):
+    """
+    Give this deadline (seconds or Deadline) to the requests of the
+    current thread or task. Inside another scope, the earliest deadline
+    wins.
+    """
+    deadline = get(deadline)
+    previous = current()
+    if deadline is None or (previous is not None and previous.end <= deadline.end):
+        deadline = previous
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def timeout():
+    """
+    The (connect, read) timeout of the next request.
+
+    Raise DeadlineExceeded if its deadline has passed.
+    """
+    deadline = current()
+    if deadline is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    deadline.check()
+    remaining = deadline.remaining()
+    return (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining))
+
+
+def with_deadline(post_search):
+    """
+    Decorator of the postSearch functions: they accept a deadline
+    keyword argument, given to the requests they make. When it passes,
+    the card is returned as it is.
+
+    postSearch(card, deadline=2)
+    """
+
+    @wraps(post_search)
+    def wrapper(card, *args, **kwargs):
+        with scope(kwargs.pop('deadline', None)):
+            try:
+                return post_search(card, *args, **kwargs)
+            except requests.exceptions.Timeout as e:
+                log.warning("postSearch: no answer in time for {}: {}".format(card.get('details_url'), e))
+                return card
+
+    return wrapper
+
+
+def in_scope(fn, deadline):
+    """
+    Return: fn, that runs with this deadline, in another thread.
+    """
+    if deadline is None:
+        return fn
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with scope(deadline):
+            return fn(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The books we already saw, by ISBN.
+
+simplecache remembers the results of a search by its arguments: a
+keyword search on "victor hugo" doesn't help when we later scan the
+barcode of one of its books. Here, every card with an ISBN returned by
+a search, a bulk_search or a postSearch is stored by its ISBN-13 and
+its source. An ISBN search on the same source answers with the stored
+card, without any request, as long as it is fresher than MAX_AGE (or
+the source's own limit in SOURCE_MAX_AGE).
+
+postSearch adds fields to a card (the description, the isbn…): they
+are merged in the stored card.
+
+    cardstore.get("9782732486819", "librairiedeparis")
+"""
+
+import logging
+import threading
+import time
+
+from bookshops.utils.scraperUtils import canonical_isbn
+from bookshops.utils.simplecache import Cache
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Max number of ISBNs we remember.
+MAX_ENTRIES = 20000
+
+#: A stored card answers the ISBN searches during MAX_AGE seconds.
+MAX_AGE = 24 * 3600
+
+#: Sources with another freshness. Dilicom gives the current
+#: availability at the distributor: don't keep it long.
+SOURCE_MAX_AGE = {
+    "dilicom": 15 * 60,
+}
+
+
+class CardStore(object):
+    """
+    isbn-13 -> {source name: (card, time stored)}
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.cache = Cache(max_entries=max_entries,
+                           ttl=max(list(SOURCE_MAX_AGE.values()) + [max_age]))
+        self.stored = 0
+        self.lock = threading.Lock()
+
+    def _max_age(self, source_name):
+        return SOURCE_MAX_AGE.get(source_name, self.max_age)
+
+    def put(self, card):
+        """
+        Store this card (a dict with an isbn and a data_source), or
+        complete the one we have.
+        """
+        if not card:
+            return
+        isbn = canonical_isbn(card.get('isbn'))
+        source_name = card.get('data_source')
+        if not isbn or not source_name:
+            return
+        with self.lock:
+            records = self.cache.peek(isbn) or {}
+            old = records.get(source_name)
+            merged = dict(old[0]) if old else {}
+            merged.update((key, val) for key, val in card.items()
+                          if val not in (None, "", [], {}) or key not in merged)
+            records = dict(records)
+            records[source_name] = (merged, time.time())
+            self.cache.set(isbn, records)
+            self.stored += 1
+
+    def put_many(self, cards):
+        for card in cards:
+            self.put(card)
+
+    def get(self, isbn, source_name):
+        """
+        Return: a copy of the card of this source, if it is fresh
+        enough, or None.
+        """
+        isbn = canonical_isbn(isbn)
+        if not isbn:
+            return None
+        with self.lock:
+            records = self.cache.get(isbn)
+        if not records or source_name not in records:
+            return None
+        card, stored_at = records[source_name]
+        if time.time() - stored_at > self._max_age(source_name):
+            return None
+        log.debug("cardstore: {} found for {}.".format(isbn, source_name))
+        return dict(card)
+
+    def get_any(self, isbn):
+        """
+        Return: the cards of all the sources for this ISBN, fresh
+        enough (dict source name -> card).
+        """
+        isbn = canonical_isbn(isbn)
+        with self.lock:
+            records = self.cache.get(isbn) if isbn else None
+        now = time.time()
+        return {source_name: dict(card)
+                for source_name, (card, stored_at) in (records or {}).items()
+                if now - stored_at <= self._max_age(source_name)}
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        res = self.cache.stats()
+        res['stored'] = self.stored
+        return res
+
+
+STORE = CardStore()
+
+
+def put(card):
+    STORE.put(card)
+
+
+def put_many(cards):
+    STORE.put_many(cards)
+
+
+def get(isbn, source_name):
+    return STORE.get(isbn, source_name)
+
+
+def get_any(isbn):
+    return STORE.get_any(isbn)
+
+
+def stats():
+    return STORE.stats()
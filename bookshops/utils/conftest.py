@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The fake website of the tests: it answers the requests of httpclient
+(requests.Session.request) without the network.
+
+    def test_foo(site):
+        site.answer = lambda method, url, **kwargs: site.response(site.page("librairiedeparis_search.html"))
+        ...
+        assert site.sent[0]['url'] == ...
+"""
+
+import io
+import os
+import threading
+
+import pytest
+import requests
+
+from . import httpclient
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class FakeSite(object):
+    """
+    A Session.request that answers with answer(method, url, **kwargs):
+    a Response, a status code, or an exception to raise. It records the
+    requests in `sent`, with the thread and the deadline they ran with.
+    """
+
+    def __init__(self):
+        self.answer = lambda method, url, **kwargs: 200
+        self.sent = []
+
+    def __call__(self, method, url, **kwargs):
+        self.sent.append(dict(kwargs, method=method, url=url,
+                              thread=threading.current_thread(),
+                              deadline=httpclient.budget.current()))
+        res = self.answer(method, url, **kwargs)
+        if isinstance(res, Exception):
+            raise res
+        if isinstance(res, int):
+            res = self.response(status=res)
+        if res.url is None:
+            res.url = url
+        return res
+
+    def answer_in_turn(self, *answers, **headers):
+        """
+        Answer these status codes (with these headers), or raise these
+        exceptions, one per request.
+        """
+        todo = list(answers)
+
+        def answer(method, url, **kwargs):
+            it = todo.pop(0)
+            if isinstance(it, Exception):
+                return it
+            return self.response(status=it, headers=headers)
+
+        self.answer = answer
+
+    @staticmethod
+    def response(body=b"", status=200, url=None, headers=None, history=()):
+        """
+        A requests.Response with this body (bytes or str).
+
+        - history: the status codes of the redirections before it.
+        """
+        res = requests.Response()
+        res.status_code = status
+        res.url = url
+        res._content = body.encode('utf8') if isinstance(body, str) else body
+        res.raw = io.BytesIO()
+        res.headers.update(headers or {})
+        res.history = [FakeSite.response(status=it, url=url) for it in history]
+        return res
+
+    @staticmethod
+    def page(name):
+        """
+        The content of this file of fixtures/ (bytes).
+        """
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            return f.read()
+
+
+@pytest.fixture
+def site(monkeypatch):
+    site = FakeSite()
+    monkeypatch.setattr(requests.Session, 'request', site)
+    return site
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Get all the results of a search, for example a whole publisher's
+catalogue.
+
+We read the number of results on the first page, then we fetch all the
+other pages concurrently (PER_HOST at once on the same website, and
+under its rate limit). The books are given as soon as their page
+arrives, without duplicates:
+
+    from bookshops.utils.crawl import crawl_publisher
+    from bookshops.frFR.librairiedeparis.librairiedeparisScraper import Scraper
+
+    for card in crawl_publisher(Scraper, "agone"):
+        print(card['title'])
+"""
+
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+
+from bookshops.utils import prefetch
+from bookshops.utils.enrich import PER_HOST
+from bookshops.utils.enrich import host_semaphore
+from bookshops.utils.scraperUtils import canonical_isbn
+from bookshops.utils.scraperUtils import host_of
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+
+def _card_key(card):
+    return canonical_isbn(card.get('isbn')) or card.get('details_url') or card.get('title')
+
+
+def _new_cards(cards, seen):
+    for card in cards:
+        key = _card_key(card)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        yield card
+
+
+def _search_page(scraper, page, per_host):
+    with prefetch.suspended(), host_semaphore(host_of(scraper.url), per_host):
+        bk_list, stacktraces = scraper.for_page(page).search()
+    if stacktraces:
+        log.warning("crawl: errors on page {}: {}".format(page, stacktraces))
+    return bk_list
+
+
+def crawl(scraper, per_host=PER_HOST):
+    """
+    Yield all the books of this search (a scraper, built with its first
+    page), in no particular order.
+    """
+    seen = set()
+    with prefetch.suspended():
+        bk_list, stacktraces = scraper.search()
+    for card in _new_cards(bk_list, seen):
+        yield card
+
+    if not scraper.has_next_page(bk_list):
+        return
+    total = scraper._nbr_results() if scraper.soup is not None else None
+    if not total:
+        # First page from the cache: we don't know the number of pages.
+        for card in _new_cards(scraper.next_page().iter_results(), seen):
+            yield card
+        return
+
+    last_page = int(math.ceil(total / float(scraper.NBR_RESULTS)))
+    log.debug("crawl: {} results, {} pages to fetch.".format(total, last_page))
+    executor = ThreadPoolExecutor(max_workers=per_host)
+    try:
+        futures = {executor.submit(_search_page, scraper, page, per_host): page
+                   for page in range(int(scraper.page) + 1, last_page + 1)}
+        for future in as_completed(futures):
+            try:
+                bk_list = future.result()
+            except Exception as e:
+                log.error("crawl: could not get page {}: {}".format(futures[future], e))
+                continue
+            for card in _new_cards(bk_list, seen):
+                yield card
+    finally:
+        # The consumer may stop before the end.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def crawl_publisher(scraper_class, publisher, per_host=PER_HOST):
+    """
+    Yield all the books of this publisher (the "ed:" advanced search).
+    """
+    return crawl(scraper_class("ed:{}".format(publisher)), per_host=per_host)
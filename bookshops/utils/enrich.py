@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Complete many cards with their details page (isbn, description…).
+
+Some websites don't give the isbn in their search results, we must
+call postSearch on each card, so one more request per card. We do
+these requests concurrently, with a limited number of requests at the
+same time on each host:
+
+    from bookshops.utils.enrich import enrich
+
+    bklist = enrich(bklist, postSearch)
+
+or, from a coroutine:
+
+    bklist = await aenrich(bklist, apostSearch)
+
+The limit per host (PER_HOST, or the per_host argument) is for the
+whole process: all the enrich() and aenrich() calls running at the same
+time share it. The calls with another per_host have their own limit.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import functools
+import logging
+import threading
+
+from bookshops.utils import budget
+from bookshops.utils.scraperUtils import host_of
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Max number of postSearch running at the same time.
+MAX_WORKERS = 16
+#: Max number of concurrent requests on the same host.
+PER_HOST = 4
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _card_host(card):
+    url = card.get('details_url') or card.get('url') or ""
+    return host_of(url)
+
+
+def host_semaphore(host, per_host=PER_HOST):
+    """
+    The semaphore limiting the concurrent requests on this host to
+    per_host. It is shared by all the enrich() and aenrich() calls of
+    the process with the same per_host.
+    """
+    key = (host, per_host)
+    with _host_semaphores_lock:
+        sem = _host_semaphores.get(key)
+        if sem is None:
+            sem = threading.BoundedSemaphore(per_host)
+            _host_semaphores[key] = sem
+        return sem
+
+
+def _release_if_acquired(sem, acquire):
+    if not acquire.cancelled() and acquire.exception() is None and acquire.result():
+        sem.release()
+
+
+@asynccontextmanager
+async def _ahold(sem, deadline=None):
+    """
+    Hold this threading semaphore. We wait for it on a thread of the
+    loop's executor, in turn with the enrich() threads, without blocking
+    the event loop.
+
+    Raise budget.DeadlineExceeded if the deadline passes first.
+    """
+    loop = asyncio.get_running_loop()
+    timeout = deadline.remaining() if deadline is not None else None
+    acquire = loop.run_in_executor(None, functools.partial(sem.acquire, timeout=timeout))
+    try:
+        acquired = await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        # The thread may still get it: give it back then.
+        acquire.add_done_callback(functools.partial(_release_if_acquired, sem))
+        raise
+    if not acquired:
+        raise budget.DeadlineExceeded("the host was busy until the deadline.")
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+def _post_search_one(card, post_search, per_host, deadline=None):
+    if deadline is not None and deadline.expired():
+        # No time left: the card stays as it is.
+        return card
+    try:
+        with budget.scope(deadline), host_semaphore(_card_host(card), per_host):
+            res = post_search(card)
+    except Exception as e:
+        log.error("Error completing the card {}: {}".format(card.get('details_url'), e))
+        return card
+    # postSearch can return None when it can't do its job.
+    return res if res is not None else card
+
+
+def enrich(cards, post_search, max_workers=MAX_WORKERS, per_host=PER_HOST, deadline=None):
+    """
+    Call post_search on every card, concurrently, on threads.
+
+    - cards: list of dicts.
+    - post_search: the postSearch function of the cards' source.
+    - deadline: in seconds (see budget). The cards we didn't have the
+      time to complete are returned untouched.
+
+    Return: the list of completed cards, in the same order. A card
+    whose postSearch failed is returned untouched.
+    """
+    if not cards:
+        return []
+    deadline = budget.get(deadline) or budget.current()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(cards))) as executor:
+        return list(executor.map(lambda card: _post_search_one(card, post_search, per_host, deadline),
+                                 cards))
+
+
+async def aenrich(cards, apost_search, per_host=PER_HOST, deadline=None):
+    """
+    Coroutine version of enrich, with a coroutine (apostSearch). It
+    shares the limits per host of enrich().
+    """
+    deadline = budget.get(deadline) or budget.current()
+
+    async def one(card):
+        if deadline is not None and deadline.expired():
+            return card
+        try:
+            async with _ahold(host_semaphore(_card_host(card), per_host), deadline):
+                res = await apost_search(card)
+        except Exception as e:
+            log.error("Error completing the card {}: {}".format(card.get('details_url'), e))
+            return card
+        return res if res is not None else card
+
+    # The tasks of gather() get the deadline from this scope.
+    with budget.scope(deadline):
+        return list(await asyncio.gather(*[one(card) for card in cards]))
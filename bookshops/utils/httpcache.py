@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+HTTP cache of the GET responses, with revalidation.
+
+This is below simplecache (which stores the parsed results): we keep
+the pages along with their validators (ETag, Last-Modified). When we
+fetch the same url again, httpclient sends a conditional request. If
+the website answers "304 Not Modified", we reuse the stored page and
+skip the download. If the page has a Cache-Control max-age, we don't
+even ask before it expires.
+
+A page with a max-age but without validators is stored too: we serve
+it until it expires, then we download it again in full. Pages with
+neither are not stored, so we never serve stale data.
+
+Counters:
+
+    httpcache.stats()
+    {'hits': 2, 'revalidated': 10, 'misses': 25, 'entries': 30, 'size': 3400000}
+"""
+
+from collections import OrderedDict
+import copy
+import logging
+import re
+import threading
+import time
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Total size of the stored pages, in bytes.
+MAX_SIZE = 50 * 1000 * 1000
+
+#: Set to False to disable the cache.
+ENABLED = True
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class Entry(object):
+
+    def __init__(self, response):
+        self.response = response
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.size = len(response.content or b"")
+        self.set_expiry(response)
+
+    def set_expiry(self, response):
+        """
+        The page is fresh until its max-age. Without max-age (or with
+        no-cache), we revalidate it every time.
+        """
+        self.expires = 0
+        cache_control = response.headers.get('Cache-Control', '')
+        match = MAX_AGE_RE.search(cache_control)
+        if match and 'no-cache' not in cache_control:
+            self.expires = time.time() + int(match.group(1))
+
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    def validators(self):
+        """
+        Return: the headers of a conditional request.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def get_response(self):
+        # The callers may change the encoding etc, give them a copy.
+        return copy.copy(self.response)
+
+
+class HttpCache(object):
+    """
+    LRU store url -> Entry, bounded by the total size of the pages.
+    """
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+            return entry
+
+    def hit(self, entry):
+        """
+        The entry is fresh, use it without any request.
+        """
+        with self.lock:
+            self.hits += 1
+        return entry.get_response()
+
+    def update(self, url, entry, response):
+        """
+        We got a response for this url, that was possibly a conditional
+        request for this entry.
+
+        Return: the response to give to the caller.
+        """
+        if response.status_code == 304 and entry is not None:
+            with self.lock:
+                self.revalidated += 1
+            entry.set_expiry(response)
+            log.debug("httpcache: {} not modified.".format(url))
+            return entry.get_response()
+
+        with self.lock:
+            self.misses += 1
+        self.store(url, response)
+        return response
+
+    def store(self, url, response):
+        """
+        Keep this 200 response if we can revalidate it (ETag,
+        Last-Modified) or if it is fresh for a while (max-age).
+        """
+        cache_control = response.headers.get('Cache-Control', '')
+        if response.status_code != 200 or 'no-store' in cache_control:
+            return
+        entry = Entry(response)
+        if not (entry.etag or entry.last_modified or entry.expires):
+            return
+        if entry.size > self.max_size / 10:
+            return
+        with self.lock:
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.size -= old.size
+            self.entries[url] = entry
+            self.size += entry.size
+            while self.size > self.max_size and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'size': self.size,
+            }
+
+
+CACHE = HttpCache()
+
+
+def stats():
+    return CACHE.stats()
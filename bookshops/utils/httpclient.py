@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shared HTTP transport for all the scrapers.
+
+We keep one requests.Session per host for the whole process. A
+session holds a pool of keep-alive connections, so the successive
+searches and details pages on the same website don't pay the TCP and
+TLS handshakes again.
+
+Usage:
+
+    from bookshops.utils import httpclient
+
+    req = httpclient.get(url, headers=self.HEADERS)
+    req = httpclient.post(url, data=envelope)
+
+The pool size can be set with the BOOKSHOPS_POOL_SIZE environment
+variable, or with configure(). The requests of each host are throttled
+by the ratelimit module. When a host keeps failing, its requests fail
+at once with breaker.CircuitOpenError (see breaker). Every request has
+a connect and a read timeout, shortened to fit the deadline of the
+current search (see budget). The transient errors (connection reset,
+5xx, 429) of the GET requests are retried (see backoff).
+
+Asyncio
+-------
+
+aget(), apost() and to_thread() are the coroutine counterparts. This
+is not a native async client: the same blocking requests run on a
+bounded pool of worker threads (BOOKSHOPS_ASYNC_WORKERS), through the
+same connection pools, rate limits and breakers. The event loop is not
+blocked, but we can't have more requests in flight than worker threads:
+
+    req = await httpclient.aget(url, headers=self.HEADERS)
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bookshops.utils import backoff
+from bookshops.utils import breaker
+from bookshops.utils import budget
+from bookshops.utils import httpcache
+from bookshops.utils import ratelimit
+from bookshops.utils.scraperUtils import host_of
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: Number of connections we keep alive for each host.
+POOL_SIZE = int(os.getenv('BOOKSHOPS_POOL_SIZE', 10))
+
+#: Headers sent with every request. The scrapers can override them
+#: with the headers argument.
+DEFAULT_HEADERS = {
+    'user-agent': "Abelujo",
+}
+
+#: Number of threads that run the requests of the asyncio API.
+ASYNC_WORKERS = int(os.getenv('BOOKSHOPS_ASYNC_WORKERS', 32))
+
+#: host -> requests.Session
+SESSIONS = {}
+_sessions_lock = threading.Lock()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _new_session():
+    session = requests.Session()
+    # pool_block=False: if more threads than POOL_SIZE hit the same host,
+    # the extra connections are opened and discarded, not queued.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+
+def get_session(url):
+    """
+    Return the session (and its connection pool) of this url's host.
+    Create it the first time. Thread-safe.
+    """
+    host = host_of(url)
+    session = SESSIONS.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = SESSIONS.get(host)
+            if session is None:
+                log.debug("new connection pool for {}".format(host))
+                session = _new_session()
+                SESSIONS[host] = session
+    return session
+
+
+def configure(pool_size=None, headers=None):
+    """
+    Change the pool size and/or update the default headers.
+
+    The existing sessions are closed, the next requests will use new
+    ones with the new settings.
+    """
+    global POOL_SIZE
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if headers:
+        DEFAULT_HEADERS.update(headers)
+    close()
+
+
+def close():
+    """
+    Close all the sessions and their connections.
+    """
+    with _sessions_lock:
+        for session in SESSIONS.values():
+            session.close()
+        SESSIONS.clear()
+
+
+def _cut_short(error, timeout):
+    """
+    Did this timeout fire because the deadline shortened it?
+
+    - timeout: the (connect, read) timeout of budget.timeout().
+    """
+    connect, read = timeout
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return connect < budget.CONNECT_TIMEOUT
+    return read < budget.READ_TIMEOUT
+
+
+def _send(session, method, url, kwargs):
+    """
+    One attempt: wait for the rate limit and send the request, unless
+    the host is down (see breaker). The timeout fits the deadline (see
+    budget).
+    """
+    host_breaker = breaker.before(url)
+    deadline = budget.current()
+    try:
+        # Don't wait for the rate limit past our deadline.
+        ratelimit.acquire(url, max_wait=deadline.remaining() if deadline else None)
+        timeout = kwargs.get('timeout') or budget.timeout()
+    except budget.DeadlineExceeded:
+        host_breaker.cancel()
+        raise
+    start = time.time()
+    try:
+        response = session.request(method, url, **dict(kwargs, timeout=timeout))
+    except requests.exceptions.Timeout as e:
+        if not kwargs.get('timeout') and _cut_short(e, timeout):
+            # Our deadline was too short, not the site too slow.
+            host_breaker.cancel()
+        else:
+            host_breaker.record(failed=True)
+        raise
+    except requests.exceptions.RequestException:
+        host_breaker.record(failed=True)
+        raise
+    host_breaker.record(failed=breaker.is_failure(response, time.time() - start))
+    return response
+
+
+def request(method, url, retry=None, **kwargs):
+    """
+    Send the request through the connection pool of its host, once
+    its rate limit allows it (see ratelimit), unless the host is down
+    (see breaker).
+
+    The transient errors are retried (see backoff). retry: a
+    backoff.Policy, by default backoff.GET for the GET requests and no
+    retry for the others.
+
+    The GET requests go through the httpcache: we revalidate the pages
+    we already have.
+
+    Accepts the same arguments as requests.request. The given headers
+    are merged with the default ones.
+
+    Return: a requests.Response.
+    """
+    policy = retry or backoff.policy_for(method)
+    session = get_session(url)
+    cacheable = httpcache.ENABLED and method == 'GET' and not kwargs.get('params') \
+        and not kwargs.get('stream')
+    entry = None
+    if cacheable:
+        entry = httpcache.CACHE.lookup(url)
+        if entry is not None:
+            if entry.is_fresh():
+                return httpcache.CACHE.hit(entry)
+            headers = dict(kwargs.get('headers') or {})
+            headers.update(entry.validators())
+            kwargs['headers'] = headers
+
+    attempt = 0
+    while True:
+        try:
+            response = _send(session, method, url, kwargs)
+        except requests.exceptions.RequestException as e:
+            wait = backoff.next_delay(policy, attempt, error=e)
+            if wait is None:
+                raise
+            log.info("{} {} failed ({}), retrying in {:.2f}s".format(method, url, e, wait))
+        else:
+            after = backoff.retry_after(response)
+            if after is not None and response.status_code in backoff.SLOW_DOWN_STATUSES:
+                # The other requests to this host wait too.
+                ratelimit.pause(url, min(after, policy.max_retry_after))
+            wait = backoff.next_delay(policy, attempt, response=response)
+            if wait is None:
+                break
+            log.info("{} {} answered {}, retrying in {:.2f}s".format(method, url, response.status_code, wait))
+            response.close()
+        time.sleep(wait)
+        attempt += 1
+
+    if cacheable:
+        response = httpcache.CACHE.update(url, entry, response)
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def get_executor():
+    """
+    The thread pool of the asyncio API, created on first use.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS)
+    return _executor
+
+
+async def to_thread(fn, *args, **kwargs):
+    """
+    Run a blocking function (a request, a postSearch…) on our thread
+    pool and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    # The worker thread sees the context of the caller (its deadline).
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(),
+                                      functools.partial(context.run, fn, *args, **kwargs))
+
+
+async def arequest(method, url, **kwargs):
+    return await to_thread(request, method, url, **kwargs)
+
+
+async def aget(url, **kwargs):
+    return await arequest('GET', url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    return await arequest('POST', url, **kwargs)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Share one request between identical concurrent searches.
+
+When two users search the same ISBN at the same time, both miss the
+cache. The first one (the leader) fires the request, the second one
+waits for its result instead of firing another one. The searches are
+identified by their normalized query (see scraperUtils.canonical_query):
+"Antigone sophocle" and "sophocle antigone" share one request.
+
+    req = inflight.do(inflight.key("librairiedeparis", args, kwargs), httpclient.get, url)
+
+Works between threads and between coroutines (ado), and a coroutine
+can wait for a request fired by a thread, and the other way around.
+
+A follower doesn't wait longer than its own deadline (see budget). If
+the leader gives up because its deadline passed, the followers that
+still have time try again, one of them as the new leader.
+
+    inflight.stats()
+    {'leaders': 40, 'coalesced': 12, 'in_flight': 1}
+"""
+
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError
+import asyncio
+import logging
+import threading
+
+import requests
+
+from bookshops.utils import budget
+from bookshops.utils.scraperUtils import canonical_query
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+
+def key(source_name, args, kwargs=None):
+    """
+    The key of a search: its source and its normalized query.
+    """
+    return (source_name, canonical_query(args, kwargs))
+
+
+def _for_followers(error):
+    """
+    The error of the leader, as the followers get it. A timeout because
+    the leader's own deadline passed says nothing of the request: the
+    followers get a DeadlineExceeded, and try again if they have time.
+    """
+    deadline = budget.current()
+    if isinstance(error, requests.exceptions.Timeout) and deadline is not None and deadline.expired():
+        return budget.DeadlineExceeded("the deadline of the leader passed ({}).".format(error))
+    return error
+
+
+def _remaining():
+    """
+    How long a follower can wait (seconds), or None.
+    """
+    deadline = budget.current()
+    return deadline.remaining() if deadline is not None else None
+
+
+def _retry(key, error):
+    """
+    Should the follower try again, after this error of the leader?
+    """
+    if not isinstance(error, budget.DeadlineExceeded):
+        return False
+    deadline = budget.current()
+    if deadline is not None and deadline.expired():
+        return False
+    log.debug("inflight: the leader of {} ran out of time, we try again".format(key))
+    return True
+
+
+def _late(key):
+    return budget.DeadlineExceeded("no answer in time from the request in progress {}.".format(key))
+
+
+class Group(object):
+    """
+    key -> Future of the call in progress.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def _join(self, key):
+        """
+        Return: a tuple (future, is_leader). The leader must run the
+        call and resolve the future.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                log.debug("inflight: waiting for the request in progress {}".format(key))
+                return future, False
+            future = self.calls[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _done(self, key, future, result=None, exception=None):
+        with self.lock:
+            self.calls.pop(key, None)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs), unless a call with the same key is in
+        progress: then wait for its result, until our deadline.
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result(timeout=_remaining())
+            except TimeoutError:
+                raise _late(key)
+            except Exception as e:
+                if not _retry(key, e):
+                    raise
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._done(key, future, exception=_for_followers(e))
+            raise
+        self._done(key, future, result=result)
+        return result
+
+    async def ado(self, key, coro_fn, *args, **kwargs):
+        """
+        Coroutine version of do: await coro_fn(*args, **kwargs).
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield: a follower that gives up doesn't cancel the leader's call.
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                              timeout=_remaining())
+            except asyncio.TimeoutError:
+                raise _late(key)
+            except Exception as e:
+                if not _retry(key, e):
+                    raise
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except BaseException as e:
+            # Also when cancelled: the others must not wait forever.
+            self._done(key, future, exception=_for_followers(e))
+            raise
+        self._done(key, future, result=result)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.calls),
+            }
+
+
+GROUP = Group()
+
+
+def do(key, fn, *args, **kwargs):
+    return GROUP.do(key, fn, *args, **kwargs)
+
+
+async def ado(key, coro_fn, *args, **kwargs):
+    return await GROUP.ado(key, coro_fn, *args, **kwargs)
+
+
+def stats():
+    return GROUP.stats()
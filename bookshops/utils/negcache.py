@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Remember the ISBNs a source doesn't know.
+
+When Dilicom answers UNKNOWN_EAN, or when a website says it has nothing
+for an ISBN, we note it here for NEGATIVE_TTL seconds. A new scan of
+the same barcode on the same source then returns at once, without a
+request.
+
+Each source keeps at most CAPACITY ISBNs: when it is full, the expired
+ones are dropped, then the oldest. We count the hits, the entries found
+expired and the entries dropped to make room:
+
+    negcache.stats()
+    {'dilicom': {'entries': 12, 'hits': 30, 'expirations': 1, 'evictions': 0}}
+"""
+
+import logging
+import threading
+import time
+
+from bookshops.utils.scraperUtils import canonical_isbn
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: How long we remember a miss (seconds).
+NEGATIVE_TTL = 6 * 3600
+
+#: Max number of ISBNs remembered for each source.
+CAPACITY = 50000
+
+
+class SourceMisses(object):
+    """
+    The ISBNs unknown to one source.
+    """
+
+    def __init__(self, ttl, capacity):
+        self.ttl = ttl
+        self.capacity = capacity
+        #: isbn -> expiry timestamp, oldest first.
+        self.entries = {}
+        self.hits = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def add(self, isbn):
+        self.entries.pop(isbn, None)
+        self.entries[isbn] = time.time() + self.ttl
+        if len(self.entries) > self.capacity:
+            self._shrink()
+
+    def _shrink(self):
+        """
+        Drop the expired entries, and the oldest ones if we are still
+        above the capacity.
+        """
+        now = time.time()
+        expired = [isbn for isbn, expires in self.entries.items() if expires <= now]
+        for isbn in expired:
+            del self.entries[isbn]
+        self.expirations += len(expired)
+        while len(self.entries) > self.capacity:
+            del self.entries[next(iter(self.entries))]
+            self.evictions += 1
+
+    def is_absent(self, isbn):
+        expires = self.entries.get(isbn)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            del self.entries[isbn]
+            self.expirations += 1
+            return False
+        self.hits += 1
+        return True
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'expirations': self.expirations,
+            'evictions': self.evictions,
+        }
+
+
+class NegativeCache(object):
+
+    def __init__(self, ttl=NEGATIVE_TTL, capacity=CAPACITY):
+        self.ttl = ttl
+        self.capacity = capacity
+        #: source name -> SourceMisses
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def _source(self, source_name):
+        misses = self.sources.get(source_name)
+        if misses is None:
+            misses = self.sources[source_name] = SourceMisses(self.ttl, self.capacity)
+        return misses
+
+    def add(self, source_name, isbn):
+        """
+        Remember this source doesn't know this isbn.
+        """
+        isbn = canonical_isbn(isbn)
+        if not isbn:
+            return
+        log.debug("negcache: {} unknown on {}".format(isbn, source_name))
+        with self.lock:
+            self._source(source_name).add(isbn)
+
+    def is_absent(self, source_name, isbn):
+        """
+        Return True if we know this source doesn't have this isbn.
+        """
+        isbn = canonical_isbn(isbn)
+        if not isbn:
+            return False
+        with self.lock:
+            misses = self.sources.get(source_name)
+            return misses is not None and misses.is_absent(isbn)
+
+    def clear(self):
+        with self.lock:
+            self.sources.clear()
+
+    def stats(self):
+        with self.lock:
+            return {name: it.stats() for name, it in self.sources.items()}
+
+
+CACHE = NegativeCache()
+
+
+def add(source_name, isbn):
+    CACHE.add(source_name, isbn)
+
+
+def is_absent(source_name, isbn):
+    return CACHE.is_absent(source_name, isbn)
+
+
+def stats():
+    return CACHE.stats()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fetch the next page of a search in advance.
+
+When a user looks at page N of a search (a publisher's list…), we
+fetch page N+1 in the background and put it in the cache: the next
+click is instant. We stop at the last page (_nbr_results of the
+scraper), and a source has at most MAX_PER_SOURCE speculative requests
+at once.
+
+Disabled by default. Enable it with:
+
+    export BOOKSHOPS_PREFETCH=1
+
+or prefetch.ENABLED = True.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import os
+import threading
+
+from bookshops.utils.scraperUtils import canonical_query
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+ENABLED = bool(os.getenv('BOOKSHOPS_PREFETCH'))
+
+#: Max number of prefetches running or waiting, per source.
+MAX_PER_SOURCE = 2
+
+#: Number of threads fetching the next pages.
+WORKERS = 4
+
+
+class Prefetcher(object):
+
+    def __init__(self, max_per_source=MAX_PER_SOURCE, workers=WORKERS):
+        self.max_per_source = max_per_source
+        self.workers = workers
+        self.executor = None
+        #: (source name, canonical query of the page) being fetched
+        self.keys = set()
+        #: source name -> number of prefetches
+        self.pending = {}
+        self.prefetched = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+        # A prefetched page must not prefetch the next one, and so on.
+        self.local = threading.local()
+
+    def prefetch_next(self, scraper, results):
+        """
+        Fetch the page after this scraper's one, in the background.
+
+        - results: the cards of the current page.
+
+        Return: True if we will fetch it.
+        """
+        if getattr(self.local, 'active', False) or scraper.nocache \
+           or not scraper.has_next_page(results):
+            return False
+        source_name = scraper.SOURCE_NAME
+        kwargs = {name: val for name, val in scraper.KWARGS.items() if name != 'FETCH'}
+        kwargs['PAGE'] = int(scraper.page) + 1
+        # The key of the cache: equivalent queries share their next page.
+        key = (source_name, canonical_query(scraper.ARGS, kwargs))
+        with self.lock:
+            if key in self.keys:
+                return False
+            if self.pending.get(source_name, 0) >= self.max_per_source:
+                self.skipped += 1
+                return False
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="prefetch")
+            self.keys.add(key)
+            self.pending[source_name] = self.pending.get(source_name, 0) + 1
+            self.prefetched += 1
+        self.executor.submit(self._run, key, type(scraper), scraper.ARGS, kwargs)
+        return True
+
+    def _run(self, key, scraper_class, args, kwargs):
+        self.local.active = True
+        try:
+            log.debug("prefetch: page {} of {} on {}".format(kwargs['PAGE'], args, key[0]))
+            # The search puts the results in the cache.
+            scraper_class(*args, **kwargs).search()
+        except Exception as e:
+            log.error("prefetch: could not fetch page {} of {}: {}".format(kwargs['PAGE'], args, e))
+        finally:
+            self.local.active = False
+            with self.lock:
+                self.keys.discard(key)
+                self.pending[key[0]] -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'prefetched': self.prefetched,
+                'skipped': self.skipped,
+                'running': len(self.keys),
+            }
+
+
+PREFETCHER = Prefetcher()
+
+
+def prefetch_next(scraper, results):
+    """
+    If prefetching is enabled, fetch the next page of this search in
+    the background.
+    """
+    if not ENABLED:
+        return False
+    try:
+        return PREFETCHER.prefetch_next(scraper, results)
+    except Exception as e:
+        log.error("prefetch: {}".format(e))
+        return False
+
+
+@contextmanager
+def suspended():
+    """
+    Don't prefetch in this thread, in this block (we fetch all the
+    pages anyway).
+    """
+    previous = getattr(PREFETCHER.local, 'active', False)
+    PREFETCHER.local.active = True
+    try:
+        yield
+    finally:
+        PREFETCHER.local.active = previous
+
+
+def stats():
+    return PREFETCHER.stats()
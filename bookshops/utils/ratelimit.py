@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Be polite with the websites: limit the number of requests per second
+on each host.
+
+Every request of httpclient waits for a token of its host's bucket. A
+bucket gives `rate` tokens per second and holds at most `burst` of
+them. Set the limit of a source with its SOURCE_URL_BASE:
+
+    from bookshops.utils import ratelimit
+
+    ratelimit.set_limit("http://www.buchlentner.de", rate=2, burst=4)
+
+A request with a deadline (see budget) doesn't wait longer than what
+remains of it: it fails at once with budget.DeadlineExceeded, and
+leaves its turn to the others.
+
+We record how long the requests waited in the queue of each host:
+
+    ratelimit.stats()
+    {'http://www.buchlentner.de': {'requests': 42, 'total_wait': 3.2, 'max_wait': 0.5, 'avg_wait': 0.07}}
+"""
+
+import logging
+import threading
+import time
+
+from bookshops.utils import budget
+from bookshops.utils.scraperUtils import host_of
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: (requests per second, burst) of the hosts without their own limit.
+DEFAULT_LIMIT = (10, 20)
+
+#: SOURCE_URL_BASE -> (requests per second, burst).
+#: buchlentner answers 403 when we go too fast, the Discogs API
+#: allows 25 requests per minute without authentication.
+LIMITS = {
+    "http://www.buchlentner.de": (2, 4),
+    "http://api.discogs.com": (0.4, 5),
+    "http://discogs.com": (1, 2),
+}
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket.
+
+    When the bucket is empty, acquire() reserves the next token and
+    sleeps until it is available, so the waiting requests are served in
+    order.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """
+        Take a token.
+
+        - max_wait: if we would have to wait longer (seconds), don't take
+          it and raise budget.DeadlineExceeded.
+
+        Return: the time to wait before using it (seconds).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            wait = max(0, (1 - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                raise budget.DeadlineExceeded("we must wait {:.2f}s for the rate limit, {:.2f}s remain."
+                                              .format(wait, max_wait))
+            self.tokens -= 1
+            return wait
+
+    def pause(self, seconds):
+        """
+        The next request must wait at least this long (the site asked us
+        to slow down).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def acquire(self, max_wait=None):
+        """
+        Wait for a token (see reserve).
+
+        Return: the time we waited (seconds).
+        """
+        wait = self.reserve(max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class HostStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def add(self, wait):
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'total_wait': self.total_wait,
+            'max_wait': self.max_wait,
+            'avg_wait': self.total_wait / self.requests if self.requests else 0.0,
+        }
+
+
+#: host -> TokenBucket
+BUCKETS = {}
+#: host -> HostStats
+STATS = {}
+_lock = threading.Lock()
+
+
+def set_limit(url, rate, burst=1):
+    """
+    Set the limit of this host (a SOURCE_URL_BASE, or any url of the website).
+
+    - rate: requests per second. None to remove the limit.
+    - burst: number of requests we can send at once after a pause.
+    """
+    host = host_of(url)
+    with _lock:
+        LIMITS[host] = (rate, burst)
+        BUCKETS.pop(host, None)
+
+
+def get_bucket(host):
+    """
+    Return the bucket of this host (None if it has no limit).
+    """
+    with _lock:
+        if host not in BUCKETS:
+            rate, burst = LIMITS.get(host, DEFAULT_LIMIT)
+            BUCKETS[host] = TokenBucket(rate, burst) if rate else None
+        return BUCKETS[host]
+
+
+def acquire(url, max_wait=None):
+    """
+    Wait until we can send a request to this url's host.
+
+    - max_wait: raise budget.DeadlineExceeded, without waiting, if we
+      would wait longer (seconds).
+
+    Return: the time we waited (seconds).
+    """
+    host = host_of(url)
+    bucket = get_bucket(host)
+    wait = bucket.acquire(max_wait) if bucket else 0
+    with _lock:
+        STATS.setdefault(host, HostStats()).add(wait)
+    if wait:
+        log.debug("ratelimit: waited {:.2f}s for {}".format(wait, host))
+    return wait
+
+
+def pause(url, seconds):
+    """
+    Don't send the next request to this url's host before `seconds`
+    (a 429 or 503 with Retry-After, see retry).
+    """
+    bucket = get_bucket(host_of(url))
+    if bucket:
+        bucket.pause(seconds)
+
+
+def stats():
+    """
+    The queue-wait time of each host.
+
+    Return: dict host -> dict with requests, total_wait, max_wait, avg_wait.
+    """
+    with _lock:
+        return {host: it.to_dict() for host, it in STATS.items()}
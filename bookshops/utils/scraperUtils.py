@@ -21,13 +21,19 @@ import logging
 import re
 import string as string_mod
 import time
+import unicodedata
 import six
+from six.moves.urllib.parse import urlsplit
 
 import addict
+import isbnlib
 from termcolor import colored
 
 log = logging.getLogger(__name__)
 
+#: Keyword arguments of the scrapers that don't change the results.
+CONTROL_KWARGS = ('FETCH', 'NOCACHE', 'REFRESH', 'DEADLINE')
+
 CODES_DISPO = {
     6: "Arrêt de commercialisation",
     1: "Disponible",  # ?
@@ -98,12 +104,41 @@ def isbn_cleanup(isbn):
     res = isbn
     if isbn:
         # note: punctuation is just punctuation, not all fancy characters like « or @
-        punctuation = set(string.punctuation)
+        punctuation = set(string_mod.punctuation)
         res = "".join([it for it in isbn if it not in punctuation])
 
     return res
 
 
+def canonical_isbn(isbn):
+    """
+    Return the canonical ISBN-13 (or EAN) of this isbn: only digits,
+    ISBN-10 converted to ISBN-13.
+
+    "2-07-036002-4" -> "9782070360024"
+
+    Return: a str, or None if it doesn't look like an isbn.
+    """
+    if not isbn:
+        return None
+    canon = isbnlib.canonical(isbn)
+    if len(canon) == 10:
+        canon = isbnlib.to_isbn13(canon)
+    if len(canon) == 13 and canon.isdigit():
+        return canon
+    return None
+
+
+def is_valid_ean(ean):
+    """
+    True if this EAN-13 (only digits) has the right check digit.
+    """
+    if not ean or len(ean) != 13 or not ean.isdigit():
+        return False
+    total = sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(ean))
+    return total % 10 == 0
+
+
 def is_isbn(it):
     """Return True is the given string is an ean or an isbn, i.e:
 
@@ -125,6 +160,17 @@ def is_isbn(it):
     return res
 
 
+def host_of(url):
+    """
+    Return the scheme and network location of this url. It is our key
+    to the connection pools, rate limits etc of a website.
+
+    Exemple: "http://www.librairie-de-paris.fr/listeliv.php?…" -> "http://www.librairie-de-paris.fr"
+    """
+    parts = urlsplit(url)
+    return "{}://{}".format(parts.scheme, parts.netloc.lower())
+
+
 def rmPunctuation(it):
     """
     Remove all punctuation from the string.
@@ -140,6 +186,59 @@ def rmPunctuation(it):
     return st
 
 
+def strip_accents(text):
+    """
+    "Misérables" -> "Miserables"
+    """
+    return "".join(c for c in unicodedata.normalize('NFKD', text)
+                   if not unicodedata.combining(c))
+
+
+def canonical_query(args, kwargs=None):
+    """
+    The key of a search, the same for the variants of a query that give
+    the same results: the words are case-folded, without accents nor
+    punctuation, and sorted. The ISBNs are converted to ISBN-13.
+
+    ("Antigone", "sophocle"), ("sophocle  antigone ",) -> "antigone sophocle"
+    ("2-07-036002-4",) -> "9782070360024"
+
+    It is only a key (for the caches): the url we send is still built
+    from the original query.
+
+    - kwargs: the other parameters of the search (PAGE etc).
+
+    Return: a str.
+    """
+    words = []
+    for arg in args:
+        for word in "{}".format(arg).split():
+            isbn = canonical_isbn(word)
+            if isbn:
+                words.append(isbn)
+                continue
+            word = strip_accents(word).casefold()
+            if word.startswith('ed:'):
+                # advanced search, keep the keyword.
+                word = 'ed:' + rmPunctuation(word[3:])
+            else:
+                word = rmPunctuation(word)
+            if word:
+                words.append(word)
+    key = " ".join(sorted(words))
+
+    params = []
+    for name, val in sorted((kwargs or {}).items()):
+        if name in CONTROL_KWARGS or val in (None, "", []):
+            continue
+        if name == 'PAGE' and "{}".format(val) == "1":
+            continue
+        params.append("{}={}".format(name, val))
+    if params:
+        key += "|" + "&".join(params)
+    return key
+
+
 def print_card(card, details=False):
     """Pretty output for the console.
     """
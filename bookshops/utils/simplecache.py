@@ -19,70 +19,405 @@
 
 """
 Simple caching mechanism.
-Without dependencies.
 
-Not saved to disk, cleared each day.
-"""
+Not saved to disk. The search results expire after TTL seconds (one
+day). The cache is bounded: when it is full (MAX_ENTRIES, or MAX_BYTES
+if set), we evict the least recently used results.
+
+With admission=True, a new entry must have been asked for more often
+than the entry it would evict, otherwise it is not stored. This keeps
+the popular searches from being pushed out by a burst of one-time
+searches.
+
+The key of a search is scraperUtils.canonical_query(): "Antigone
+sophocle" and "sophocle antigone" share their results.
+
+The counters can be read at runtime:
+
+    simplecache.stats()
+    {'entries': 120, 'size': 0, 'hits': 300, 'misses': 140,
+     'evictions': 20, 'expirations': 3, 'rejections': 0}
 
+Stale-while-revalidate: with SOFT_TTL (or the BOOKSHOPS_CACHE_SOFT_TTL
+environment variable, in seconds), results older than SOFT_TTL are
+still returned at once, and the scraper runs again in the background to
+update them. After TTL they are discarded. The refreshes are
+deduplicated, run on REFRESH_WORKERS threads, and a source has at most
+REFRESH_PER_SOURCE of them waiting: a burst of stale hits can't flood
+a website.
 
-import datetime
+To keep the results across restarts and share them between processes,
+set the BOOKSHOPS_CACHE_DB environment variable to a file path (or call
+set_backend()). The memory cache stays in front of the SQLite one (see
+sqlitecache.py).
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
+import os
+import pickle
+import threading
+import time
+
+from bookshops.utils.scraperUtils import canonical_query
 
 logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
-CACHED_CONTENT = {
-    'source_name': {
-        'args': {
-            'datetime': 'datetime object',
-            'day': 'day (int)',
-            'results': ['bklist'],
-        }
-    },
-}
+#: Time to live of the results, in seconds.
+TTL = 24 * 3600
+
+#: After SOFT_TTL seconds, the results are refreshed in the background
+#: (None: never).
+SOFT_TTL = int(os.getenv('BOOKSHOPS_CACHE_SOFT_TTL', 0)) or None
+
+#: Number of threads refreshing the stale results.
+REFRESH_WORKERS = 2
+
+#: Max number of refreshes waiting for each source.
+REFRESH_PER_SOURCE = 2
+
+#: Max number of cached searches.
+MAX_ENTRIES = 1000
+
+#: Max total size of the cached results, in bytes (None: no limit).
+MAX_BYTES = None
+
+
+class FrequencySketch(object):
+    """
+    Approximate count of how often each key was asked for (a count-min
+    sketch), in constant memory.
+
+    The counts are halved regularly, so that the old popularity fades
+    out.
+    """
+
+    DEPTH = 4
 
+    def __init__(self, width=4096):
+        self.width = width
+        self.rows = [[0] * width for _ in range(self.DEPTH)]
+        self.additions = 0
+        self.reset_at = width * 10
 
-def _stringify_args(args):
-    return "{}".format(args)
+    def _indexes(self, key):
+        digest = hashlib.md5(key.encode('utf8')).digest()
+        return [int.from_bytes(digest[i * 4:(i + 1) * 4], 'little') % self.width
+                for i in range(self.DEPTH)]
 
+    def add(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += 1
+        self.additions += 1
+        if self.additions >= self.reset_at:
+            self.rows = [[count // 2 for count in row] for row in self.rows]
+            self.additions //= 2
 
-def get_cache(source_name, args):
-    stringified_args = _stringify_args(args)
-    now = datetime.datetime.now()
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+def _size_of(value):
     try:
-        CACHED_CONTENT.setdefault(source_name, {})
-        res = CACHED_CONTENT[source_name].setdefault(stringified_args, {})
-        if res:
-            if res.get('day') <= now.day:
-                log.debug("Hit cache.")
-                # print("-- cache hit for {}".format(args))
-                return res.get('results')
-            else:
-                try:
-                    del res
-                    del CACHED_CONTENT[source_name][stringified_args]
-                    return
-                except Exception as e:
-                    log.error("Could not delete the cache: {}".format(e))
+        return len(pickle.dumps(value, protocol=2))
+    except Exception:
+        return len(repr(value))
+
+
+class Entry(object):
+
+    def __init__(self, value, expires, size, stale_at=None):
+        self.value = value
+        self.expires = expires
+        self.size = size
+        #: after this time, the value should be refreshed.
+        self.stale_at = stale_at
+
+    def is_stale(self):
+        return self.stale_at is not None and self.stale_at <= time.time()
+
+
+class Cache(object):
+    """
+    In-memory LRU cache with expiry, bounded by a number of entries
+    and/or a byte budget. Thread-safe.
+
+    Keys are strings.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL, admission=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.admission = admission
+        self.sketch = FrequencySketch() if admission else None
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+        self.stale_hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value, or None if it isn't cached or has expired.
+        """
+        return self.get_stale(key)[0]
+
+    def get_stale(self, key):
+        """
+        Return a tuple value (or None), is it stale?
+        """
+        with self.lock:
+            if self.sketch:
+                self.sketch.add(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            if entry.expires <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None, False
+            self.entries.move_to_end(key)
+            self.hits += 1
+            stale = entry.is_stale()
+            if stale:
+                self.stale_hits += 1
+            return entry.value, stale
+
+    def peek(self, key):
+        """
+        Return the value if it is still valid, without counting a hit
+        or a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires <= time.time():
+                return None
+            return entry.value
+
+    def set(self, key, value, ttl=None, soft_ttl=None, expires=None, stale_at=None):
+        """
+        Store the value for ttl seconds (default: the cache's TTL). It
+        is stale after soft_ttl seconds.
+
+        - expires, stale_at: the same as timestamps, to keep the ones of
+          an entry read elsewhere (the disk cache).
+
+        Return: True if it was stored (it may be refused by the
+        admission policy).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        size = _size_of(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            elif self.admission and self._is_full(size) and self.entries:
+                victim = next(iter(self.entries))
+                if self.sketch.estimate(key) < self.sketch.estimate(victim):
+                    self.rejections += 1
+                    return False
+            now = time.time()
+            if expires is None:
+                expires = now + ttl
+                stale_at = now + soft_ttl if soft_ttl else None
+            self.entries[key] = Entry(value, expires, size, stale_at=stale_at)
+            self.size += size
+            while self.entries and self._is_over():
+                victim = next(iter(self.entries))
+                self._remove(victim)
+                self.evictions += 1
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+    def _is_full(self, new_size):
+        """
+        Would adding an entry of this size need an eviction?
+        """
+        if self.max_entries and len(self.entries) + 1 > self.max_entries:
+            return True
+        return bool(self.max_bytes) and self.size + new_size > self.max_bytes
+
+    def _is_over(self):
+        if self.max_entries and len(self.entries) > self.max_entries:
+            return True
+        return bool(self.max_bytes) and self.size > self.max_bytes
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'rejections': self.rejections,
+                'stale_hits': self.stale_hits,
+            }
+
+
+CACHE = Cache()
+
+#: The on-disk cache, shared by the processes (None: memory only).
+DISK = None
+
+
+def set_backend(path):
+    """
+    Also store the results in this SQLite file. None to stop using it.
+    """
+    global DISK
+    if path is None:
+        DISK = None
+        return
+    from bookshops.utils.sqlitecache import SqliteCache
+    DISK = SqliteCache(path, ttl=TTL)
+
+
+if os.getenv('BOOKSHOPS_CACHE_DB'):
+    try:
+        set_backend(os.getenv('BOOKSHOPS_CACHE_DB'))
     except Exception as e:
-        log.error("Could not save cache: {}".format(e))
+        log.error("Could not open the cache database {}: {}".format(os.getenv('BOOKSHOPS_CACHE_DB'), e))
+
+
+def _key(source_name, args, kwargs=None):
+    return "{}:{}".format(source_name, canonical_query(args, kwargs))
+
+
+class Refresher(object):
+    """
+    Run the refreshes of the stale results in the background, once per
+    key, and a few per source at most.
+    """
+
+    def __init__(self, workers=REFRESH_WORKERS, per_source=REFRESH_PER_SOURCE):
+        self.workers = workers
+        self.per_source = per_source
+        self.executor = None
+        #: keys being refreshed
+        self.keys = set()
+        #: source name -> number of refreshes waiting or running
+        self.pending = {}
+        self.refreshes = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def submit(self, source_name, key, refresh):
+        """
+        Call refresh() in the background, unless it is already planned
+        or the source has too many refreshes waiting.
+
+        Return: True if it was planned.
+        """
+        with self.lock:
+            if key in self.keys:
+                return False
+            if self.pending.get(source_name, 0) >= self.per_source:
+                self.skipped += 1
+                return False
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="simplecache-refresh")
+            self.keys.add(key)
+            self.pending[source_name] = self.pending.get(source_name, 0) + 1
+            self.refreshes += 1
+        self.executor.submit(self._run, source_name, key, refresh)
+        return True
+
+    def _run(self, source_name, key, refresh):
+        try:
+            log.debug("Refreshing stale results of {}.".format(key))
+            refresh()
+        except Exception as e:
+            log.error("Could not refresh the results of {}: {}".format(key, e))
+        finally:
+            with self.lock:
+                self.keys.discard(key)
+                self.pending[source_name] -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'refreshes': self.refreshes,
+                'refreshes_skipped': self.skipped,
+                'refreshing': len(self.keys),
+            }
+
+
+REFRESHER = Refresher()
+
+
+def get_cache(source_name, args, refresh=None, kwargs=None):
+    """
+    Return the cached results of this search, or None.
+
+    - refresh: function to run the search again, in the background,
+      when the results are stale (see SOFT_TTL). Without it, stale
+      results are not returned.
+    - kwargs: the keyword arguments of the search (PAGE…).
+    """
+    key = _key(source_name, args, kwargs)
+    try:
+        res, stale = CACHE.get_stale(key)
+        if res is None and DISK is not None:
+            res, expires, stale_at = DISK.lookup(key)
+            stale = stale_at is not None and stale_at <= time.time()
+            if res is not None and not stale:
+                # It expires in memory when it expires on disk.
+                CACHE.set(key, res, expires=expires, stale_at=stale_at)
+        if res is not None and stale:
+            if refresh is None:
+                return None
+            REFRESHER.submit(source_name, key, refresh)
+        if res is not None:
+            log.debug("Hit cache.")
+        return res
+    except Exception as e:
+        log.error("Could not read the cache: {}".format(e))
         return
 
 
-def cache_results(source_name, args, results):
+def cache_results(source_name, args, results, kwargs=None):
+    key = _key(source_name, args, kwargs)
     try:
-        stringified_args = _stringify_args(args)
-        now = datetime.datetime.now()
-        global CACHED_CONTENT
-        CACHED_CONTENT.setdefault(source_name, {})
-        CACHED_CONTENT[source_name].setdefault(stringified_args, {})
-        CACHED_CONTENT[source_name][stringified_args] = {
-            'day': now.day,
-            'datetime': now,
-            'results': results,
-        }
+        CACHE.set(key, results, soft_ttl=SOFT_TTL)
+        if DISK is not None:
+            DISK.set(key, results, soft_ttl=SOFT_TTL)
         log.debug("Saved cache.")
         return True
     except Exception as e:
         log.error("Failed to cache results for {} with args {}: {}".
                   format(source_name, args, e))
+
+
+def stats():
+    res = CACHE.stats()
+    res.update(REFRESHER.stats())
+    if DISK is not None:
+        res['disk'] = DISK.stats()
+    return res
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 - 2020 The Abelujo Developers
+# See the COPYRIGHT file at the top-level directory of this distribution
+
+# Abelujo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Abelujo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Abelujo.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+On-disk cache in a SQLite database.
+
+The search results survive a restart and are shared by all the
+processes using the same file (the gunicorn workers, the command line
+tools). Enable it with an environment variable:
+
+    export BOOKSHOPS_CACHE_DB=~/.cache/bookshops.sqlite
+
+or in the code:
+
+    from bookshops.utils import simplecache
+    simplecache.set_backend("/var/cache/bookshops.sqlite")
+
+The database is in WAL mode: the readers don't block the writer. The
+expired rows are deleted by a background thread every
+COMPACT_INTERVAL seconds.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s', level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+#: How long a process waits for the lock of another one (milliseconds).
+BUSY_TIMEOUT = 5000
+
+#: Delete the expired rows every N seconds.
+COMPACT_INTERVAL = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    stale_at REAL
+)
+"""
+
+
+class SqliteCache(object):
+    """
+    A key -> value store with expiry, in a SQLite file. Thread and
+    process safe. The values are pickled.
+
+    Same interface as simplecache.Cache.
+    """
+
+    def __init__(self, path, ttl, compact_interval=COMPACT_INTERVAL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.compact_interval = compact_interval
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        # One connection per thread (and per process, after a fork).
+        self.local = threading.local()
+        self.compactor = None
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(cache)")]
+        if 'stale_at' not in columns:
+            # Database created before the stale-while-revalidate mode.
+            conn.execute("ALTER TABLE cache ADD COLUMN stale_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT / 1000.0)
+            conn.execute("PRAGMA busy_timeout={}".format(BUSY_TIMEOUT))
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+            self._start_compactor()
+        return conn
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """
+        Return the value, or None if it isn't cached or has expired.
+        """
+        return self.get_stale(key)[0]
+
+    def get_stale(self, key):
+        """
+        Return a tuple value (or None), is it stale?
+        """
+        value, _, stale_at = self.lookup(key)
+        return value, stale_at is not None and stale_at <= time.time()
+
+    def lookup(self, key):
+        """
+        Return a tuple value, expiry and stale timestamps (or None, None,
+        None).
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at, stale_at FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            log.error("sqlitecache: could not read {}: {}".format(key, e))
+            self._count('errors')
+            return None, None, None
+        if row is None:
+            self._count('misses')
+            return None, None, None
+        self._count('hits')
+        return pickle.loads(row[0]), row[1], row[2]
+
+    def set(self, key, value, ttl=None, soft_ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at, stale_at) VALUES (?, ?, ?, ?)",
+                             (key, sqlite3.Binary(data), now + ttl, now + soft_ttl if soft_ttl else None))
+        except sqlite3.Error as e:
+            log.error("sqlitecache: could not write {}: {}".format(key, e))
+            self._count('errors')
+            return False
+        return True
+
+    def delete(self, key):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cache")
+
+    def compact(self):
+        """
+        Delete the expired rows and give the WAL file back to the system.
+
+        Return: the number of deleted rows.
+        """
+        conn = self._connection()
+        with conn:
+            deleted = conn.execute("DELETE FROM cache WHERE expires_at <= ?",
+                                   (time.time(),)).rowcount
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            log.debug("sqlitecache: deleted {} expired entries.".format(deleted))
+        return deleted
+
+    def _start_compactor(self):
+        if not self.compact_interval:
+            return
+        with self.lock:
+            if self.compactor is not None and self.compactor[0] == os.getpid():
+                return
+            thread = threading.Thread(target=self._compact_loop, name="sqlitecache-compactor")
+            thread.daemon = True
+            self.compactor = (os.getpid(), thread)
+        thread.start()
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                # Another process may be compacting, we'll retry later.
+                log.debug("sqlitecache: compaction failed: {}".format(e))
+
+    def stats(self):
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        with self.lock:
+            return {
+                'path': self.path,
+                'entries': entries,
+                'size': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+            }
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from . import archive as archive_module
+from .archive import Archive
+
+
+def test_store_and_read(tmpdir):
+    archive = Archive(str(tmpdir))
+    body = b"<html>" + b"<p>Les Mis\xc3\xa9rables</p>" * 100 + b"</html>"
+    digest = archive.store("http://example.com/?q=hugo", body, source='example', args=["hugo"],
+                           encoding='utf8')
+    # The same body is stored once.
+    assert archive.store("http://example.com/?q=hugo", body, source='example') == digest
+    stats = archive.stats()
+    assert stats['pages'] == 2
+    assert stats['bodies'] == 1
+    assert stats['stored_size'] < stats['size']
+
+    page = archive.pages(source='example')[0]
+    assert page.args == ["hugo"]
+    assert page.response().text.count("Misérables") == 100
+
+
+def test_eviction(tmpdir):
+    archive = Archive(str(tmpdir), max_size=2000)
+    for n in range(20):
+        archive.store("http://example.com/{}".format(n), os.urandom(300), source='example')
+    assert archive.size() <= 2000
+    assert archive.pages()[-1].url == "http://example.com/19"
+    assert len(archive.pages()) < 20
+
+
+def test_connections_are_closed(tmpdir, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(archive_module.sqlite3, 'connect', tracking_connect)
+    archive = Archive(str(tmpdir), max_size=1000)
+    for n in range(5):
+        archive.store("http://example.com/{}".format(n), os.urandom(300), source='example')
+    archive.pages()
+    archive.stats()
+    assert len(opened) > 5
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_concurrent_store_and_evict(tmpdir):
+    archive = Archive(str(tmpdir), max_size=3000)
+    # A few bodies, stored again and again while the others evict them.
+    bodies = [os.urandom(400) for _ in range(4)]
+
+    def store(n):
+        for i in range(30):
+            archive.store("http://example.com/{}/{}".format(n, i), bodies[(n + i) % len(bodies)],
+                          source='example')
+
+    threads = [threading.Thread(target=store, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every archived page has its body.
+    for page in archive.pages():
+        assert len(page.body) == 400
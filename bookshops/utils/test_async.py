@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import asyncio
+import threading
+
+from . import httpclient
+from ..frFR.librairiedeparis import librairiedeparisScraper
+
+budget = httpclient.budget
+
+
+def serve_search_page(site):
+    """
+    Answer the saved search page of librairiedeparis.
+    """
+    page = site.page("librairiedeparis_search.html")
+    site.answer = lambda method, url, **kwargs: site.response(page)
+
+
+def test_to_thread_context(site):
+    serve_search_page(site)
+
+    async def main():
+        with budget.scope(5) as deadline:
+            res = await httpclient.aget("http://async.example/search?q=antigone")
+        return deadline, res
+
+    deadline, res = asyncio.run(main())
+    assert res.status_code == 200
+    # The request ran on a worker thread, with the deadline of the coroutine.
+    assert site.sent[0]['thread'] is not threading.current_thread()
+    assert site.sent[0]['deadline'] is deadline
+    assert site.sent[0]['timeout'][1] <= 5
+
+
+def test_asearch_as_search(site):
+    serve_search_page(site)
+    expected, errors = librairiedeparisScraper.Scraper("antigone", NOCACHE=True).search()
+    scraper = librairiedeparisScraper.Scraper("antigone", FETCH=False, NOCACHE=True)
+    res, aerrors = asyncio.run(scraper.asearch())
+    assert [it['isbn'] for it in expected] == ["9782070360024", "9782710381419", "9782070712489"]
+    assert res == expected
+    assert aerrors == errors == []
+    assert len(site.sent) == 2
+    assert site.sent[0]['url'] == site.sent[1]['url']
+    # asearch didn't block the event loop's thread.
+    assert site.sent[1]['thread'] is not threading.current_thread()
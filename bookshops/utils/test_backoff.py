@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from unittest import mock
+
+import pytest
+import requests
+
+from . import httpclient
+
+backoff = httpclient.backoff
+
+
+def test_retry_get(site, monkeypatch):
+    waits = []
+    monkeypatch.setattr(httpclient.time, 'sleep', waits.append)
+    site.answer_in_turn(requests.exceptions.ConnectionError("reset"), 503, 200)
+    res = httpclient.get("http://retry.example/search?q=1")
+    assert res.status_code == 200
+    assert len(site.sent) == 3
+    # Full jitter: between 0 and base, then between 0 and 2 * base.
+    assert 0 <= waits[0] <= backoff.GET.base
+    assert 0 <= waits[1] <= 2 * backoff.GET.base
+
+
+def test_retry_after(site, monkeypatch):
+    waits = []
+    monkeypatch.setattr(httpclient.time, 'sleep', waits.append)
+    site.answer_in_turn(429, 429, 429, **{'Retry-After': '3'})
+    with mock.patch.object(httpclient.ratelimit, 'pause') as pause:
+        res = httpclient.get("http://slowdown.example/search?q=1")
+    # We gave up after GET.attempts, and return the last answer.
+    assert res.status_code == 429
+    assert len(site.sent) == backoff.GET.attempts
+    assert waits == [3, 3]
+    pause.assert_called_with("http://slowdown.example/search?q=1", 3)
+
+
+def test_soap_policy(site, monkeypatch):
+    monkeypatch.setattr(httpclient.time, 'sleep', lambda seconds: None)
+    url = "http://soap.example/v2/DemandeFicheProduit"
+    # The connection was reset: the request may have been processed.
+    site.answer_in_turn(requests.exceptions.ConnectionError("reset"), 200)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        httpclient.post(url, retry=backoff.SOAP)
+    assert len(site.sent) == 1
+    # We could not connect: it was not.
+    site.answer_in_turn(requests.exceptions.ConnectTimeout("timeout"), 200)
+    assert httpclient.post(url, retry=backoff.SOAP).status_code == 200
+    # The other POST requests are not retried.
+    site.answer_in_turn(503, 200)
+    assert httpclient.post(url).status_code == 503
+
+
+def test_no_retry_after_deadline(site, monkeypatch):
+    monkeypatch.setattr(httpclient.time, 'sleep', lambda seconds: None)
+    site.answer_in_turn(503, 200, **{'Retry-After': '5'})
+    with httpclient.budget.scope(2):
+        res = httpclient.get("http://deadline.example/search?q=1")
+    assert res.status_code == 503
+    assert len(site.sent) == 1
+    httpclient.breaker.reset()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from . import baseScraper
+from .baseScraper import BaseScraper
+
+
+class PagedScraper(BaseScraper):
+    """
+    5 results, 2 by page. We don't fetch anything.
+    """
+    PAGINATED = True
+
+    def __init__(self, *args, **kwargs):
+        self.SOURCE_NAME = "paged"
+        self.SOURCE_URL_SEARCH = "http://example.com/?q="
+        self.URL_END = ""
+        self.SOURCE_URL_ADVANCED_SEARCH = "http://example.com/?ed="
+        self.ISBN_QPARAM = ""
+        self.PUBLISHER_QPARAM = "ed"
+        self.NBR_RESULTS = 2
+        super(PagedScraper, self).__init__(*args, **kwargs)
+
+    def _fetch(self):
+        self.fetched = True
+        self.soup = object()
+
+    def _nbr_results(self):
+        return 5
+
+    def search(self, *args, **kwargs):
+        self._fetch_if_needed()
+        first = (int(self.page) - 1) * self.NBR_RESULTS
+        return [{'n': n} for n in range(first, min(first + self.NBR_RESULTS, 5))], []
+
+
+def test_iter_results():
+    results = PagedScraper("agone", FETCH=False).iter_results()
+    assert next(results) == {'n': 0}
+    assert [it['n'] for it in results] == [1, 2, 3, 4]
+
+
+def test_crawl():
+    from .crawl import crawl
+
+    scraper = PagedScraper("ed:agone")
+    assert sorted(it['n'] for it in crawl(scraper)) == [0, 1, 2, 3, 4]
+
+
+class IsbnScraper(BaseScraper):
+    """
+    An isbn search, on the page we give to _parse_response.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.SOURCE_NAME = "isbns"
+        self.SOURCE_URL_SEARCH = "http://example.com/?q="
+        self.SOURCE_URL_ISBN_SEARCH = self.SOURCE_URL_SEARCH
+        self.URL_END = ""
+        self.ISBN_QPARAM = ""
+        self.NO_RESULTS_TEXT = "Aucun résultat"
+        super(IsbnScraper, self).__init__(*args, **kwargs)
+
+    def _product_list(self):
+        return self.soup.find_all(class_='product')
+
+
+def test_negcache_on_no_results_marker(site, monkeypatch):
+    monkeypatch.setattr(baseScraper.negcache, 'CACHE', baseScraper.negcache.NegativeCache())
+
+    def parse(body, history=()):
+        res = site.response(body, url="http://example.com/?q=9782070360024", history=history)
+        IsbnScraper("9782070360024", FETCH=False)._parse_response(res)
+        return baseScraper.negcache.is_absent("isbns", "9782070360024")
+
+    # A new markup, a redirection: we don't know if it has results.
+    assert not parse("<html><div class='new-product'>Antigone</div></html>")
+    assert not parse("<html><p>Aucun résultat</p></html>", history=[301])
+    assert not parse("<html><div class='product'>Antigone</div></html>")
+    # The site says so.
+    assert parse("<html><p>Aucun résultat pour votre recherche.</p></html>")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+import requests
+
+from ..frFR.dilicom import batcher
+
+UNKNOWN = "9780262510875"
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """
+    Replace the SOAP request: Dilicom knows all the ISBNs but UNKNOWN.
+
+    Return: the list of the batches sent.
+    """
+    monkeypatch.setenv('DILICOM_USER', 'user')
+    monkeypatch.setenv('DILICOM_PASSWORD', 'password')
+    batches = []
+    lock = threading.Lock()
+
+    def fake_bulk_search(self, isbns, deadline=None):
+        with lock:
+            batches.append(list(isbns))
+        cards = [{'isbn': it, 'title': it} for it in isbns if it != UNKNOWN]
+        return cards, ["EAN inconnu {}".format(UNKNOWN)] if UNKNOWN in isbns else []
+
+    monkeypatch.setattr(batcher.Scraper, 'bulk_search', fake_bulk_search)
+    return batches
+
+
+def test_window(sent):
+    it = batcher.Batcher(window=0.1)
+    futures = [it.submit("978-2-7324-8681-9"), it.submit("2-07-036002-4"),
+               it.submit("9782732486819"), it.submit(UNKNOWN), it.submit("9782000000000")]
+    res = [future.result(timeout=2) for future in futures]
+    # The ISBNs of the window in one request, in the canonical form.
+    assert sent == [["9782732486819", "9782070360024", UNKNOWN]]
+    assert res[0][0][0]['isbn'] == "9782732486819"
+    assert res[1][0][0]['isbn'] == "9782070360024"
+    assert res[2] == res[0]
+    assert res[3] == ([], ["EAN inconnu {}".format(UNKNOWN)])
+    # Not a valid ISBN: not sent.
+    assert res[4][0] == []
+
+
+def test_not_found_errors(monkeypatch, sent):
+    def fake_bulk_search(self, isbns, deadline=None):
+        return [], ["EAN inconnu 9782732486819"]
+
+    monkeypatch.setattr(batcher.Scraper, 'bulk_search', fake_bulk_search)
+    it = batcher.Batcher(window=0.05)
+    first, second = it.submit("9782732486819"), it.submit("9782070360024")
+    assert first.result(timeout=2) == ([], ["EAN inconnu 9782732486819"])
+    # We don't get the errors of the other caller.
+    bk_list, errors = second.result(timeout=2)
+    assert bk_list == []
+    assert len(errors) == 1 and "9782070360024" in errors[0]
+
+
+def test_batch_errors(monkeypatch, sent):
+    def timed_out(self, isbns, deadline=None):
+        return [{'isbn': "9782732486819", 'title': "found"}], \
+            ["EAN inconnu 9782070360024", "Dilicom: no answer in time (timeout)."]
+
+    monkeypatch.setattr(batcher.Scraper, 'bulk_search', timed_out)
+    it = batcher.Batcher(window=0.05)
+    futures = [it.submit(isbn) for isbn in ["9782732486819", "9782070360024", UNKNOWN]]
+    res = [future.result(timeout=2) for future in futures]
+    assert res[0][1] == []
+    # Every caller without a card is told that the request didn't finish,
+    # not that its ISBN is unknown.
+    assert res[1] == ([], ["EAN inconnu 9782070360024", "Dilicom: no answer in time (timeout)."])
+    assert res[2] == ([], ["Dilicom: no answer in time (timeout)."])
+
+
+def ean(number):
+    """
+    A valid ISBN-13 ending with this number.
+    """
+    digits = "978207{:06}".format(number)
+    check = -sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10
+    return digits + str(check)
+
+
+def test_max_batch(sent):
+    # A full batch is sent at once, without waiting for the window.
+    it = batcher.Batcher(window=10, max_batch=3)
+    start = time.monotonic()
+    futures = [it.submit(ean(i)) for i in range(6)]
+    for future in futures:
+        assert future.result(timeout=2)[0]
+    assert time.monotonic() - start < 2
+    assert sent == [[ean(0), ean(1), ean(2)], [ean(3), ean(4), ean(5)]]
+
+
+def test_concurrent_callers(sent):
+    it = batcher.Batcher(window=0.2)
+    isbns = ["9782732486819", "9782070360024", "978-2-07-036002-4", "2-7324-8681-7"]
+    with ThreadPoolExecutor(max_workers=len(isbns)) as executor:
+        res = list(executor.map(it.lookup, isbns))
+    assert len(sent) == 1
+    assert [bk_list[0]['isbn'] for bk_list, _ in res] == \
+        ["9782732486819", "9782070360024", "9782070360024", "9782732486819"]
+
+
+def test_batch_fails(monkeypatch, sent):
+    def refused(self, isbns, deadline=None):
+        raise requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(batcher.Scraper, 'bulk_search', refused)
+    it = batcher.Batcher(window=0.05)
+    futures = [it.submit("9782732486819"), it.submit("9782070360024")]
+    for future in futures:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            future.result(timeout=2)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import pytest
+import requests
+
+from . import httpclient
+
+breaker = httpclient.breaker
+
+
+def test_breaker(monkeypatch):
+    monkeypatch.setattr(breaker, 'OPEN_DURATION', 0)
+    it = breaker.Breaker("http://down.example")
+    for _ in range(breaker.MIN_CALLS - 1):
+        assert it.allow()
+        it.record(failed=True)
+    assert it.current_state() == breaker.CLOSED
+    it.record(failed=True)
+    assert it.state == breaker.OPEN
+
+    # OPEN_DURATION passed: one probe goes through.
+    assert it.allow()
+    assert it.state == breaker.HALF_OPEN
+    assert not it.allow()
+    it.record(failed=True)
+    assert it.state == breaker.OPEN
+    assert it.allow()
+    it.record(failed=False)
+    assert it.state == breaker.CLOSED
+
+
+def test_fail_fast(site):
+    site.answer = lambda method, url, **kwargs: requests.exceptions.ConnectionError("connection refused")
+    url = "http://www.casadellibro.com/busqueda-generica?busqueda=foo"
+    breaker.reset()
+    for _ in range(breaker.MIN_CALLS):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            httpclient.get(url, retry=httpclient.backoff.NO_RETRY)
+    with pytest.raises(breaker.CircuitOpenError):
+        httpclient.get(url, retry=httpclient.backoff.NO_RETRY)
+    assert len(site.sent) == breaker.MIN_CALLS
+    assert breaker.state(url) == breaker.OPEN
+    assert breaker.stats()['http://www.casadellibro.com']['rejected'] == 1
+    breaker.reset()
+
+
+def test_timeouts_under_deadline(site):
+    site.answer = lambda method, url, **kwargs: requests.exceptions.ReadTimeout("read timeout")
+    url = "http://slow.example/search?q=foo"
+    breaker.reset()
+    # The deadline cut the timeout short: not the fault of the host.
+    with httpclient.budget.scope(1):
+        with pytest.raises(requests.exceptions.Timeout):
+            httpclient.get(url, retry=httpclient.backoff.NO_RETRY)
+    assert breaker.stats()['http://slow.example']['calls'] == 0
+    # A generous deadline: the host had its full timeout.
+    with httpclient.budget.scope(httpclient.budget.READ_TIMEOUT + 60):
+        for _ in range(breaker.MIN_CALLS):
+            with pytest.raises(requests.exceptions.Timeout):
+                httpclient.get(url, retry=httpclient.backoff.NO_RETRY)
+    assert breaker.state(url) == breaker.OPEN
+    breaker.reset()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import time
+
+import pytest
+
+from . import httpclient
+from .enrich import enrich
+
+budget = httpclient.budget
+
+
+def test_scope():
+    assert budget.current() is None
+    assert budget.timeout() == (budget.CONNECT_TIMEOUT, budget.READ_TIMEOUT)
+    with budget.scope(2) as outer:
+        # The earliest deadline wins.
+        with budget.scope(60) as inner:
+            assert inner is outer
+        with budget.scope(1) as inner:
+            assert inner is not outer
+            assert budget.timeout()[1] <= 1
+        assert budget.current() is outer
+    assert budget.current() is None
+
+
+def test_request_timeouts(site):
+    url = "http://www.momox-shop.fr/films-C09/?fcIsSearch=1&searchparam=foo"
+    httpclient.get(url)
+    with budget.scope(2):
+        httpclient.get(url)
+    with budget.scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(budget.DeadlineExceeded):
+            httpclient.get(url)
+
+    timeouts = [it['timeout'] for it in site.sent]
+    assert timeouts[0] == (budget.CONNECT_TIMEOUT, budget.READ_TIMEOUT)
+    assert timeouts[1][1] <= 2
+    assert len(timeouts) == 2
+
+
+def test_enrich_deadline():
+    @budget.with_deadline
+    def slow_post_search(card):
+        time.sleep(0.2)
+        return dict(card, isbn="9782732486819")
+
+    cards = [{'title': i, 'details_url': "http://example.com/{}".format(i)} for i in range(4)]
+    res = enrich(cards, slow_post_search, max_workers=1, deadline=0.3)
+    assert [it.get('isbn') for it in res] == ["9782732486819", "9782732486819", None, None]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import json
+
+from .. import bulkimport
+
+SEARCHED = []
+
+
+def fake_search_websites(isbn, sources=None):
+    SEARCHED.append(isbn)
+    if isbn.endswith('9'):
+        return [bulkimport._record(isbn, {'isbn': isbn, 'title': 'found'}, 'fake')]
+    return [bulkimport._record(isbn)]
+
+
+def test_read_isbns(tmp_path):
+    path = tmp_path / "invoice.csv"
+    path.write_text("ean;title;quantity\n"
+                    "9782732486819;Le livre;2\n"
+                    "978-2-7324-8681-9;Le livre, encore;1\n"
+                    "2-07-036002-4;Folio;1\n"
+                    "pas un isbn;rien;1\n")
+    isbns, duplicates, invalid = bulkimport.read_isbns(str(path))
+    assert isbns == ['9782732486819', '9782070360024']
+    assert duplicates == 1
+    assert invalid == ['ean', 'pas un isbn']
+
+
+def test_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulkimport, 'search_websites', fake_search_websites)
+    path = tmp_path / "isbns.txt"
+    path.write_text("9782732486819 9782070360024\n9780262510875\n")
+    output = tmp_path / "isbns.ndjson"
+    # A previous run, interrupted in the middle of a line.
+    output.write_text(json.dumps(bulkimport._record('9782732486819')) + "\n" + '{"isbn": "97820')
+
+    stats = bulkimport.bulk_import(str(path), str(output), use_dilicom=False, progress=False)
+    assert sorted(SEARCHED) == ['9780262510875', '9782070360024']
+    assert stats.already_done == 1
+    assert stats.done == 2
+    assert stats.found == 0
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(it['isbn'] for it in records) == ['9780262510875', '9782070360024', '9782732486819']
+    checkpoint = json.loads((tmp_path / "isbns.ndjson.checkpoint").read_text())
+    assert checkpoint['done'] == 2
+
+
+def test_read_one_column_csv(tmp_path):
+    path = tmp_path / "isbns.csv"
+    path.write_text("9782732486819\n2-07-036002-4\n9782732486819\n")
+    isbns, duplicates, invalid = bulkimport.read_isbns(str(path))
+    assert isbns == ['9782732486819', '9782070360024']
+    assert duplicates == 1
+    assert invalid == []
+
+
+def test_dilicom(tmp_path, monkeypatch):
+    product = {
+        'codeexecution': 'OK',
+        'ean13': '9782732486819',
+        'libetd': 'HABITER LE MONDE',
+        'auteur': 'PAQUOT THIERRY',
+        'edit': 'LA MARTINIERE',
+        'prix': '00016500',
+        'dtparu': '20190103',
+        'codedispo': '1',
+        'epaiss': '', 'haut': '240', 'larg': '', 'poids': '',
+    }
+
+    def fake_bulk_search(self, isbns, deadline=None):
+        return [self._card(product, [])], ["EAN inconnu 9782070360024"]
+
+    monkeypatch.setattr(bulkimport.dilicomScraper.Scraper, 'bulk_search', fake_bulk_search)
+    path = tmp_path / "isbns.txt"
+    path.write_text("9782732486819\n9782070360024\n")
+    output = tmp_path / "isbns.ndjson"
+
+    stats = bulkimport.bulk_import(str(path), str(output), use_dilicom=True, sources=[], progress=False)
+    assert stats.done == 2
+    assert stats.found == 1
+    records = {it['isbn']: it for it in map(json.loads, output.read_text().splitlines())}
+    found = records['9782732486819']
+    assert found['source'] == 'dilicom'
+    assert found['card']['date_publication'] == '2019-01-03T00:00:00'
+    assert found['card']['title'] == 'Habiter Le Monde'
+    assert records['9782070360024']['status'] == bulkimport.NOT_FOUND
+    assert records['9782070360024']['errors'] == ["EAN inconnu 9782070360024"]
+
+    # Unknown on Dilicom: searched on the websites.
+    searched = []
+
+    def fake_search_websites(isbn, sources=None):
+        searched.append(isbn)
+        return [bulkimport._record(isbn, {'isbn': isbn, 'title': 'found'}, 'fake')]
+
+    monkeypatch.setattr(bulkimport, 'search_websites', fake_search_websites)
+    output = tmp_path / "fallback.ndjson"
+    stats = bulkimport.bulk_import(str(path), str(output), use_dilicom=True, progress=False)
+    assert searched == ['9782070360024']
+    assert stats.found == 2
+    records = {it['isbn']: it for it in map(json.loads, output.read_text().splitlines())}
+    assert records['9782070360024']['source'] == 'fake'
+
+
+def test_errors_are_retried(tmp_path, monkeypatch):
+    def failing_bulk_search(self, isbns, deadline=None):
+        return [], ["Dilicom: no answer in time (read timeout)."]
+
+    monkeypatch.setattr(bulkimport.dilicomScraper.Scraper, 'bulk_search', failing_bulk_search)
+    path = tmp_path / "isbns.txt"
+    path.write_text("9782732486819\n9782070360024\n")
+    output = tmp_path / "isbns.ndjson"
+
+    stats = bulkimport.bulk_import(str(path), str(output), use_dilicom=True, progress=False)
+    assert stats.errors == 2
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    # Not "not found", and not searched on the websites.
+    assert [it['status'] for it in records] == [bulkimport.ERROR, bulkimport.ERROR]
+    assert records[0]['errors'] == ["Dilicom: no answer in time (read timeout)."]
+
+    # The next run searches them again.
+    assert bulkimport.read_done(str(output)) == set()
+    monkeypatch.setattr(bulkimport, 'search_websites', fake_search_websites)
+    stats = bulkimport.bulk_import(str(path), str(output), use_dilicom=False, progress=False)
+    assert stats.already_done == 0
+    assert stats.done == 2
+    assert bulkimport.read_done(str(output)) == {'9782732486819', '9782070360024'}
+
+
+def test_search_websites_errors(monkeypatch):
+    class Down(object):
+        def __init__(self, isbn):
+            pass
+
+        def search(self):
+            raise bulkimport.federated.breaker.CircuitOpenError("http://down.example is down")
+
+    class Unknown(Down):
+        def search(self):
+            return [], []
+
+    monkeypatch.setattr(bulkimport.federated, 'get_scraper', {'down': Down, 'unknown': Unknown}.get)
+    record, = bulkimport.search_websites('9782070360024', sources=['unknown'])
+    assert record['status'] == bulkimport.NOT_FOUND
+    record, = bulkimport.search_websites('9782070360024', sources=['down', 'unknown'])
+    assert record['status'] == bulkimport.ERROR
+    assert "down" in record['errors'][0]
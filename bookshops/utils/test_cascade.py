@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import time
+
+from .. import cascade
+
+#: source -> (delay, cards)
+ANSWERS = {
+    'slow': (0.5, [{'title': 'slow', 'price': 10}]),
+    'fast': (0, [{'title': 'fast', 'price': 10}]),
+    'incomplete': (0, [{'title': 'no price'}]),
+    'nothing': (0, []),
+}
+
+
+def fake_scraper(source):
+    class Scraper(object):
+        def __init__(self, *args):
+            pass
+
+        def search(self):
+            delay, cards = ANSWERS[source]
+            time.sleep(delay)
+            return cards, []
+    return Scraper
+
+
+def test_latencies():
+    latencies = cascade.Latencies()
+    assert latencies.p90('fast') is None
+    assert latencies.delay('fast') == cascade.DEFAULT_DELAY
+    for i in range(1, 11):
+        latencies.add('fast', i / 10.0)
+    assert latencies.p90('fast') == 1.0
+    for i in range(100):
+        latencies.add('fast', 0.2)
+    assert latencies.p90('fast') == 0.2
+
+
+def test_cascade(monkeypatch):
+    monkeypatch.setattr(cascade, 'get_scraper', fake_scraper)
+    monkeypatch.setattr(cascade, 'DEFAULT_DELAY', 0.05)
+    resolver = cascade.Cascade(sources=['slow', 'fast'])
+
+    # The first source is slow: we ask the second one too.
+    start = time.time()
+    card, stacktraces = resolver.resolve("9782732486819")
+    assert card['title'] == 'fast'
+    assert time.time() - start < 0.4
+    # The sources that fail are skipped, incomplete cards are a last resort.
+    card, _ = resolver.resolve("9782732486819", sources=['nothing', 'incomplete'])
+    assert card['title'] == 'no price'
+    card, _ = resolver.resolve("9782732486819", sources=['nothing', 'incomplete', 'fast'])
+    assert card['title'] == 'fast'
+
+    stats = resolver.stats()
+    assert stats['hedged'] == 1
+    assert stats['resolved'] == 3
+    assert stats['wins'] == {'fast': 2, 'incomplete': 1}
+
+
+def test_cache_hits_are_not_latencies(monkeypatch):
+    #: source -> (delay, served from cache)
+    answers = {'dilicom': (0.2, False), 'fast': (0, False)}
+
+    def scraper(source):
+        class Scraper(object):
+            def __init__(self, *args):
+                self.from_cache = False
+
+            def search(self):
+                delay, self.from_cache = answers[source]
+                time.sleep(delay)
+                return [{'title': source, 'price': 10}], []
+        return Scraper
+
+    monkeypatch.setattr(cascade, 'get_scraper', scraper)
+    resolver = cascade.Cascade(sources=['dilicom', 'fast'])
+    for _ in range(cascade.MIN_SAMPLES):
+        resolver.latencies.add('dilicom', 0.4)
+
+    # Many instant answers from the cardstore: they don't lower the p90…
+    answers['dilicom'] = (0, True)
+    for _ in range(20):
+        assert resolver.resolve("9782732486819")[0]['title'] == 'dilicom'
+    assert resolver.latencies.p90('dilicom') == 0.4
+
+    # … so a real request of 0.2s is not hedged.
+    answers['dilicom'] = (0.2, False)
+    card, _ = resolver.resolve("9782732486819")
+    assert card['title'] == 'dilicom'
+    assert resolver.stats()['hedged'] == 0
+
+    # A request slower than the p90 is.
+    answers['dilicom'] = (0.6, False)
+    card, _ = resolver.resolve("9782732486819")
+    assert card['title'] == 'fast'
+    assert resolver.stats()['hedged'] == 1
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import datetime
+import os
+import re
+import threading
+import time
+
+import pytest
+import requests
+
+from ..frFR.dilicom import dilicomScraper
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+def chunked(body, size=7):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class FakeResponse(requests.Response):
+    """
+    A response that gives its body by small chunks.
+    """
+
+    def __init__(self, body, status_code=200):
+        super(FakeResponse, self).__init__()
+        self.body = body
+        self.status_code = status_code
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        return iter(chunked(self.body))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    monkeypatch.setenv('DILICOM_USER', 'user')
+    monkeypatch.setenv('DILICOM_PASSWORD', 'password')
+    # Don't answer from the cards and misses of the other tests.
+    monkeypatch.setattr(dilicomScraper.cardstore, 'STORE', dilicomScraper.cardstore.CardStore())
+    monkeypatch.setattr(dilicomScraper.negcache, 'CACHE', dilicomScraper.negcache.NegativeCache())
+
+
+@pytest.fixture
+def scraper(credentials):
+    return dilicomScraper.Scraper("9782732486819", "9782070360024", "9780262510875")
+
+
+def test_decoder():
+    decoder = dilicomScraper.ResponseDecoder()
+    products = list(decoder.iter_products(chunked(fixture("dilicom_response.xml"))))
+    assert decoder.code_execution == "OK"
+    assert [it['ean13'] for it in products] == ["9782732486819", "9782070360024", "9780262510875"]
+    assert products[0]['libetd'] == "HABITER LE MONDE"
+    assert products[0]['prix'] == "00016500"
+    # Empty tags.
+    assert products[1]['edit'] == ""
+    assert products[1]['larg'] == ""
+    assert products[1]['dtparu'] == ""
+    assert products[2]['diagnostic'] == "UNKNOWN_EAN"
+
+
+def test_bulk_search(scraper, monkeypatch):
+    monkeypatch.setattr(dilicomScraper.httpclient, 'post',
+                        lambda *args, **kwargs: FakeResponse(fixture("dilicom_response.xml")))
+    bk_list, stacktraces = scraper.bulk_search(scraper.isbns)
+    assert [it['isbn'] for it in bk_list] == ["9782732486819", "9782070360024"]
+    first, second = bk_list
+    assert first['title'] == "Habiter Le Monde"
+    assert first['price'] == 16.5
+    assert first['date_publication'] == datetime.datetime(2018, 3, 15)
+    assert (first['thickness'], first['height'], first['width'], first['weight']) == (15, 320, 250, 692)
+    assert second['publishers'] == [""]
+    assert second['date_publication'] == ""
+    assert (second['thickness'], second['height'], second['width'], second['weight']) == (0, 178, 0, 0)
+    assert second['availability'] == 6
+    assert stacktraces == ["EAN inconnu 9780262510875"]
+    assert dilicomScraper.negcache.is_absent("dilicom", "9780262510875")
+
+
+def test_response_error(scraper, monkeypatch):
+    monkeypatch.setattr(dilicomScraper.httpclient, 'post',
+                        lambda *args, **kwargs: FakeResponse(fixture("dilicom_error.xml")))
+    bk_list, stacktraces = scraper.bulk_search(scraper.isbns)
+    assert bk_list == []
+    assert stacktraces == ["Dilicom error: ERREUR_AUTHENTIFICATION"]
+
+
+def test_invalid_response(scraper, monkeypatch):
+    body = fixture("dilicom_response.xml")
+    cut = body.index(b"</elemReponse>") + 50
+    monkeypatch.setattr(dilicomScraper.httpclient, 'post',
+                        lambda *args, **kwargs: FakeResponse(body[:cut] + b"</oops>"))
+    bk_list, stacktraces = scraper.bulk_search(scraper.isbns)
+    # The products decoded before the error are kept.
+    assert [it['isbn'] for it in bk_list] == ["9782732486819"]
+    assert stacktraces[-1].startswith("Dilicom error: invalid response")
+
+
+def response_for(envelope):
+    """
+    A Dilicom response that knows all the EANs of this envelope.
+    """
+    products = "".join("<elemReponse><codeExecution>OK</codeExecution><ean13>{}</ean13>"
+                       "<libetd>TITLE</libetd><prix>00010000</prix></elemReponse>".format(it)
+                       for it in re.findall(r"<ean13s>(\d+)</ean13s>", envelope))
+    return FakeResponse("<demandeFicheProduitRS><codeExecution>OK</codeExecution>{}"
+                        "</demandeFicheProduitRS>".format(products).encode('utf8'))
+
+
+class SlowDilicom(object):
+    """
+    A fake httpclient.post that takes `delays[first EAN]` seconds to
+    answer (default: `delay`), honours the deadline like httpclient, and
+    counts the requests running at the same time.
+    """
+
+    def __init__(self, delay, delays=None):
+        self.delay = delay
+        self.delays = delays or {}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url, data=None, **kwargs):
+        timeout = dilicomScraper.budget.timeout()
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            delay = self.delays.get(re.search(r"<ean13s>(\d+)</ean13s>", data).group(1), self.delay)
+            if delay > timeout[1]:
+                time.sleep(timeout[1])
+                raise requests.exceptions.ReadTimeout("read timeout")
+            time.sleep(delay)
+            return response_for(data)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def isbns(count):
+    return ["97820700{:05}".format(i) for i in range(count)]
+
+
+def test_parallel_batches(credentials, monkeypatch):
+    monkeypatch.setattr(dilicomScraper, 'BATCH_SIZE', 2)
+    # The first batch is slow: the others are yielded before it.
+    post = SlowDilicom(0.02, {isbns(1)[0]: 0.5})
+    monkeypatch.setattr(dilicomScraper.httpclient, 'post', post)
+    scraper = dilicomScraper.Scraper(*isbns(12))
+
+    batches = [[it['isbn'] for it in bk_list] for bk_list, _ in scraper.iter_search(parallel=2)]
+    assert post.max_running == 2
+    assert len(batches) == 6
+    assert batches[-1] == isbns(2)
+    assert sorted(sum(batches, [])) == isbns(12)
+
+
+def test_batches_deadline(credentials, monkeypatch):
+    monkeypatch.setattr(dilicomScraper, 'BATCH_SIZE', 2)
+    post = SlowDilicom(0.2)
+    monkeypatch.setattr(dilicomScraper.httpclient, 'post', post)
+    scraper = dilicomScraper.Scraper(*isbns(6))
+
+    start = time.monotonic()
+    bk_list, stacktraces = scraper.search(parallel=1, deadline=0.3)
+    assert time.monotonic() - start < 0.5
+    # The first batch was in time, the second timed out, the third was not sent.
+    assert [it['isbn'] for it in bk_list] == isbns(2)
+    assert len(stacktraces) == 2
+    assert all("no answer in time" in it for it in stacktraces)
+
+
+def test_from_cache(scraper, monkeypatch):
+    monkeypatch.setattr(dilicomScraper.httpclient, 'post',
+                        lambda *args, **kwargs: FakeResponse(fixture("dilicom_response.xml")))
+    scraper.search()
+    assert not scraper.from_cache
+    # Now known by the cardstore and the negcache.
+    again = dilicomScraper.Scraper(*scraper.isbns)
+    bk_list, _ = again.search()
+    assert len(bk_list) == 2
+    assert again.from_cache
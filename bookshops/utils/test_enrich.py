@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import asyncio
+import threading
+import time
+
+from .enrich import enrich
+
+
+def test_enrich_keeps_order_and_limits_hosts():
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def post_search(card):
+        with lock:
+            running.append(card)
+            max_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(card)
+        if card['n'] == 3:
+            raise Exception("details page is down")
+        return dict(card, isbn=str(card['n']))
+
+    cards = [{'n': n, 'details_url': 'http://www.buchlentner.de/product/{}'.format(n)}
+             for n in range(10)]
+    res = enrich(cards, post_search, per_host=2)
+    assert [it['n'] for it in res] == list(range(10))
+    assert res[0]['isbn'] == '0'
+    # A failed postSearch gives back the card as is.
+    assert 'isbn' not in res[3]
+    assert max(max_running) <= 2
+
+
+def test_limit_shared_by_enrich_and_aenrich():
+    from .enrich import aenrich
+    from .enrich import host_semaphore
+
+    assert host_semaphore("http://www.casadellibro.com", 2) is host_semaphore("http://www.casadellibro.com", 2)
+    assert host_semaphore("http://www.casadellibro.com", 2) is not host_semaphore("http://www.casadellibro.com", 3)
+
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def start(card):
+        with lock:
+            running.append(card)
+            max_running.append(len(running))
+
+    def end(card):
+        with lock:
+            running.remove(card)
+
+    def post_search(card):
+        start(card)
+        time.sleep(0.02)
+        end(card)
+        return card
+
+    async def apost_search(card):
+        start(card)
+        await asyncio.sleep(0.02)
+        end(card)
+        return card
+
+    cards = [{'n': n, 'details_url': 'http://www.casadellibro.com/libro/{}'.format(n)} for n in range(8)]
+    thread = threading.Thread(target=enrich, args=(cards, post_search), kwargs={'per_host': 2})
+    thread.start()
+    res = asyncio.run(aenrich(cards, apost_search, per_host=2))
+    thread.join()
+    assert res == cards
+    # The thread and the coroutines together: 2 at most.
+    assert max(max_running) == 2
+
+
+def test_aenrich_waits_within_deadline():
+    from .enrich import _ahold
+    from .enrich import aenrich
+    from .enrich import host_semaphore
+
+    sem = host_semaphore("http://busy.example", 1)
+    called = []
+
+    async def apost_search(card):
+        called.append(card)
+        return dict(card, isbn="9782732486819")
+
+    async def cancelled_waiter():
+        async def wait():
+            async with _ahold(sem):
+                pass
+
+        task = asyncio.ensure_future(wait())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        # The host is free again: the thread of the cancelled waiter
+        # gets the semaphore, and gives it back.
+        sem.release()
+        await asyncio.sleep(0.1)
+
+    cards = [{'details_url': "http://busy.example/product/1"}]
+    sem.acquire()
+    start = time.monotonic()
+    res = asyncio.run(aenrich(cards, apost_search, per_host=1, deadline=0.2))
+    # The host stayed busy: the card is untouched.
+    assert time.monotonic() - start < 0.5
+    assert res == cards
+    assert called == []
+
+    asyncio.run(cancelled_waiter())
+    assert sem.acquire(blocking=False)
+    sem.release()
+    assert asyncio.run(aenrich(cards, apost_search, per_host=1))[0]['isbn'] == "9782732486819"
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import time
+
+import pytest
+
+from .. import federated
+from .scraperUtils import host_of
+
+breaker = federated.breaker
+
+
+def fake_scraper(name, cards=(), delay=0, error=None):
+    """
+    A Scraper class of the source `name` that answers these cards after
+    `delay` seconds, or raises this error.
+    """
+
+    class Scraper(object):
+        deadlines = []
+
+        def set_constants(self):
+            self.SOURCE_URL_BASE = "http://{}.example".format(name)
+
+        def __init__(self, *args, **kwargs):
+            self.set_constants()
+
+        def search(self, deadline=None):
+            Scraper.deadlines.append(deadline)
+            time.sleep(delay)
+            if error:
+                raise error
+            return [dict(card, data_source=name) for card in cards], []
+
+    return Scraper
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    scrapers = {
+        'paris': fake_scraper('paris', [{'title': "L'étranger", 'isbn': "2-07-036002-4", 'price': 7.1}]),
+        'geneve': fake_scraper('geneve', [{'title': "L'étranger", 'isbn': "9782070360024", 'price': 9.0,
+                                           'publishers': ["Folio"]},
+                                          {'title': "La peste", 'isbn': "9782070360420", 'price': 8.0}]),
+        'broken': fake_scraper('broken', error=ValueError("the site changed")),
+        'slow': fake_scraper('slow', [{'title': "Caligula", 'isbn': "9782070360642"}], delay=1),
+    }
+    monkeypatch.setattr(federated, 'SOURCES', {name: "fake" for name in scrapers})
+    monkeypatch.setattr(federated, 'get_scraper', scrapers.get)
+    breaker.reset()
+    yield scrapers
+    breaker.reset()
+
+
+def test_merge_by_isbn(sources):
+    records, stacktraces = federated.search_all("camus", sources=['paris', 'geneve'])
+    assert [it['title'] for it in records] == ["L'étranger", "La peste"]
+    merged = records[0]
+    assert sorted(merged['data_sources']) == ['geneve', 'paris']
+    assert sorted(it['price'] for it in merged['offers']) == [7.1, 9.0]
+    # Completed by the other source.
+    assert merged['publishers'] == ["Folio"]
+    assert stacktraces == {'paris': [], 'geneve': []}
+
+
+def test_source_errors(sources):
+    records, stacktraces = federated.search_all("camus", sources=['paris', 'broken'])
+    assert [it['title'] for it in records] == ["L'étranger"]
+    assert stacktraces['paris'] == []
+    assert "the site changed" in stacktraces['broken'][0]
+
+
+def test_source_down(sources):
+    down = breaker.get_breaker(federated.source_url('broken'))
+    for _ in range(breaker.MIN_CALLS):
+        down.record(failed=True)
+    assert federated.source_states()['broken'] == breaker.OPEN
+    res = list(federated.search("camus", sources=['broken', 'paris']))
+    assert res[0][0] == 'broken'
+    assert res[0][1] == []
+    assert "down" in res[0][2][0]
+    # It was not searched.
+    assert sources['broken'].deadlines == []
+
+
+def test_deadline(sources):
+    start = time.monotonic()
+    records, stacktraces = federated.search_all("camus", sources=['slow', 'paris'], deadline=0.2)
+    assert time.monotonic() - start < 0.5
+    # We didn't wait for the slow source.
+    assert list(stacktraces) == ['paris']
+    assert [it['title'] for it in records] == ["L'étranger"]
+    # Each source got the deadline for its own requests.
+    deadline = sources['paris'].deadlines[0]
+    assert deadline is sources['slow'].deadlines[0]
+    assert deadline.seconds == 0.2
+
+
+
+#: host -> the saved search page it answers.
+PAGES = {
+    'http://www.librairie-de-paris.fr': "librairiedeparis_search.html",
+    'https://www.lelivre.ch': "lelivre_search.html",
+    'http://www.casadellibro.com': "casadellibro_search.html",
+    'http://www.buchlentner.de': "buchlentner_search.html",
+    'https://www.momox-shop.fr': "momox_search.html",
+    'http://api.discogs.com': "discogs_search.json",
+}
+
+
+@pytest.mark.parametrize('source', sorted(federated.SOURCES))
+def test_each_source(source, site):
+    site.answer = lambda method, url, **kwargs: site.response(site.page(PAGES[host_of(url)]))
+    breaker.reset()
+    # Words that no other test searched: we don't read the caches.
+    records, stacktraces = federated.search_all(["canned", source], sources=[source], deadline=5)
+    assert stacktraces == {source: []}
+    assert records
+    assert all(it['title'] for it in records)
+    assert federated.source_states()[source] == breaker.CLOSED
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from . import httpclient
+
+
+def test_host_of():
+    assert 'http://www.librairie-de-paris.fr' == httpclient.host_of("http://www.librairie-de-paris.fr/listeliv.php?MOTS=antigone")
+    assert 'https://www.lelivre.ch' == httpclient.host_of("https://www.LeLivre.ch/Results")
+
+
+def test_one_session_per_host():
+    one = httpclient.get_session("http://www.casadellibro.com/busqueda-generica?busqueda=foo")
+    two = httpclient.get_session("http://www.casadellibro.com/libro-foo/123")
+    other = httpclient.get_session("https://www.lelivre.ch/Results")
+    assert one is two
+    assert one is not other
+    httpclient.close()
+    assert not httpclient.SESSIONS
+
+
+def test_revalidation_cache(site):
+    def answer(method, url, **kwargs):
+        if kwargs['headers'].get('If-None-Match') == '"v1"':
+            return 304
+        return site.response(b"<html>product page</html>", headers={'ETag': '"v1"'})
+
+    site.answer = answer
+    url = "http://www.buchlentner.de/product/1741967"
+    first = httpclient.get(url, headers={'user-agent': 'Abelujo'})
+    second = httpclient.get(url, headers={'user-agent': 'Abelujo'})
+
+    assert site.sent[1]['headers']['If-None-Match'] == '"v1"'
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert httpclient.httpcache.stats()['revalidated'] >= 1
+    httpclient.httpcache.CACHE.clear()
+
+
+def test_max_age_without_validators(site):
+    site.answer = lambda method, url, **kwargs: \
+        site.response(b"<html>search page</html>", headers={'Cache-Control': 'max-age=60'})
+    url = "http://www.buchlentner.de/search?q=1"
+    httpclient.get(url)
+    # Fresh: no request.
+    assert httpclient.get(url).content == b"<html>search page</html>"
+    assert len(site.sent) == 1
+    # Expired: we can't revalidate it, we download it again.
+    httpclient.httpcache.CACHE.lookup(url).expires = 0
+    httpclient.get(url)
+    assert len(site.sent) == 2
+    assert 'If-None-Match' not in site.sent[1]['headers']
+    assert 'If-Modified-Since' not in site.sent[1]['headers']
+    # Neither validators nor max-age: not stored.
+    site.answer = lambda method, url, **kwargs: site.response(b"<html>no cache</html>")
+    httpclient.get(url + "2")
+    assert httpclient.httpcache.CACHE.lookup(url + "2") is None
+    httpclient.httpcache.CACHE.clear()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+from . import inflight
+from .inflight import Group
+
+budget = inflight.budget
+
+
+def test_coalesce():
+    group = Group()
+    calls = []
+    lock = threading.Lock()
+
+    def fetch(isbn):
+        with lock:
+            calls.append(isbn)
+        time.sleep(0.1)
+        return "page of {}".format(isbn)
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(group.do, ('source', "9782732486819"), fetch, "9782732486819")
+                   for _ in range(5)]
+        results = [it.result() for it in futures]
+
+    assert calls == ["9782732486819"]
+    assert results == ["page of 9782732486819"] * 5
+    assert group.stats() == {'leaders': 1, 'coalesced': 4, 'in_flight': 0}
+    # Done: the next call fires again.
+    group.do(('source', "9782732486819"), fetch, "9782732486819")
+    assert len(calls) == 2
+
+
+def test_key():
+    assert inflight.key("source", ("Antigone", "sophocle")) == inflight.key("source", ("sophocle  antigone",))
+    assert inflight.key("source", ("2-07-036002-4",)) == inflight.key("source", ("9782070360024",))
+    assert inflight.key("source", ("hugo",), {'PAGE': 2}) != inflight.key("source", ("hugo",))
+
+
+def slow_fetch(calls, delay=0.3):
+    """
+    A request that takes `delay` seconds, or times out with our deadline.
+    """
+    def fetch():
+        calls.append(budget.current())
+        timeout = budget.timeout()[1]
+        if timeout < delay:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout("read timeout")
+        time.sleep(delay)
+        return "page"
+    return fetch
+
+
+def test_follower_deadline():
+    group = Group()
+    calls = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(group.do, "key", slow_fetch(calls))
+        time.sleep(0.05)
+        start = time.monotonic()
+        with budget.scope(0.1):
+            with pytest.raises(budget.DeadlineExceeded):
+                group.do("key", slow_fetch(calls))
+        # We didn't wait for the leader.
+        assert time.monotonic() - start < 0.2
+        assert leader.result() == "page"
+    assert len(calls) == 1
+
+
+def test_leader_deadline():
+    group = Group()
+    calls = []
+
+    def short_leader():
+        with budget.scope(0.1):
+            return group.do("key", slow_fetch(calls))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(short_leader)
+        time.sleep(0.05)
+        # The leader runs out of time, the follower has more: it fetches again.
+        with budget.scope(2):
+            assert group.do("key", slow_fetch(calls)) == "page"
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            leader.result()
+    assert len(calls) == 2
+    assert group.stats()['leaders'] == 2
+
+
+def test_async_follower_deadline():
+    group = Group()
+    calls = []
+
+    async def follower():
+        with budget.scope(0.1):
+            with pytest.raises(budget.DeadlineExceeded):
+                await group.ado("key", asyncio.sleep, 0)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(group.do, "key", slow_fetch(calls))
+        time.sleep(0.05)
+        asyncio.run(follower())
+        # Giving up didn't cancel the leader's call.
+        assert leader.result() == "page"
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from ..frFR.librairiedeparis import librairiedeparisScraper
+
+
+def test_next_page(site):
+    # The saved search page says "1 à 12 sur 30".
+    page = site.page("librairiedeparis_search.html")
+    site.answer = lambda method, url, **kwargs: site.response(page)
+    scraper = librairiedeparisScraper.Scraper("antigone", NOCACHE=True)
+    bk_list, _ = scraper.search()
+    assert scraper._nbr_results() == 30
+    assert scraper.has_next_page(bk_list)
+
+    second = scraper.next_page()
+    second.search()
+    third = second.next_page()
+    bk_list, _ = third.search()
+    assert not third.has_next_page(bk_list)
+
+    urls = [it['url'] for it in site.sent]
+    # The same page size on every page.
+    assert urls[0].endswith("&NOMBRE=12&DEBUT=0")
+    assert urls[1].endswith("&NOMBRE=12&DEBUT=12")
+    assert urls[2].endswith("&NOMBRE=12&DEBUT=24")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+from .negcache import NegativeCache
+
+
+def test_negative_cache():
+    cache = NegativeCache(ttl=60)
+    assert not cache.is_absent('dilicom', '9782732486819')
+    cache.add('dilicom', '978-2-7324-8681-9')
+    assert cache.is_absent('dilicom', '9782732486819')
+    # Not for the other sources.
+    assert not cache.is_absent('librairiedeparis', '9782732486819')
+    assert cache.stats()['dilicom']['hits'] == 1
+
+    expired = NegativeCache(ttl=-1)
+    expired.add('dilicom', '9782732486819')
+    assert not expired.is_absent('dilicom', '9782732486819')
+    assert expired.stats()['dilicom'] == {'entries': 0, 'hits': 0, 'expirations': 1, 'evictions': 0}
+
+
+def test_capacity():
+    cache = NegativeCache(ttl=60, capacity=3)
+    isbns = ["97820700{:05d}".format(n) for n in range(5)]
+    for isbn in isbns:
+        cache.add('dilicom', isbn)
+    # The oldest were dropped.
+    assert [cache.is_absent('dilicom', it) for it in isbns] == [False, False, True, True, True]
+    assert cache.stats()['dilicom']['evictions'] == 2
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import threading
+
+from .prefetch import Prefetcher
+
+SEARCHED = []
+GO = threading.Event()
+
+
+class FakeScraper(object):
+    SOURCE_NAME = "fake"
+    TOTAL_PAGES = 3
+    nocache = False
+
+    def __init__(self, *args, **kwargs):
+        self.ARGS = args
+        self.KWARGS = kwargs
+        self.page = kwargs.get('PAGE', 1)
+
+    def has_next_page(self, results):
+        return self.page < self.TOTAL_PAGES
+
+    def search(self):
+        GO.wait(1)
+        SEARCHED.append(self.page)
+        return [], []
+
+
+def test_prefetch_next():
+    prefetcher = Prefetcher(max_per_source=1)
+    assert prefetcher.prefetch_next(FakeScraper("agone"), [])
+    # Capped by source.
+    assert not prefetcher.prefetch_next(FakeScraper("hugo"), [])
+    # Last page.
+    assert not prefetcher.prefetch_next(FakeScraper("hugo", PAGE=3), [])
+    GO.set()
+    prefetcher.executor.shutdown(wait=True)
+    # Only page 2 was fetched.
+    assert SEARCHED == [2]
+    assert prefetcher.stats() == {'prefetched': 1, 'skipped': 1, 'running': 0}
+
+
+def test_equivalent_queries():
+    prefetcher = Prefetcher(max_per_source=3)
+    GO.clear()
+    assert prefetcher.prefetch_next(FakeScraper("Antigone", "Sophocle"), [])
+    # The same search, the same next page: fetched once.
+    assert not prefetcher.prefetch_next(FakeScraper("sophocle  antigone"), [])
+    assert prefetcher.prefetch_next(FakeScraper("sophocle", "antigone", PAGE=2), [])
+    GO.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert prefetcher.stats() == {'prefetched': 2, 'skipped': 0, 'running': 0}
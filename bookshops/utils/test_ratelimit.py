@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import time
+
+import pytest
+
+from . import ratelimit
+from .ratelimit import TokenBucket
+
+
+class FakeTime(object):
+    """
+    A clock that only moves when we sleep.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # The bucket is empty: wait for the next token(s).
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.2)
+    # The tokens come back with time.
+    clock.sleep(1)
+    assert bucket.reserve() == 0
+
+
+def test_stats_per_host(clock):
+    ratelimit.set_limit("http://www.example.com", rate=10, burst=1)
+    ratelimit.acquire("http://www.example.com/search?q=foo")
+    ratelimit.acquire("http://www.example.com/product/1")
+    stats = ratelimit.stats()["http://www.example.com"]
+    assert stats['requests'] == 2
+    assert stats['max_wait'] == pytest.approx(0.1)
+    assert stats['total_wait'] == pytest.approx(0.1)
+    assert clock.now == pytest.approx(1000.1)
+
+
+def test_wait_within_deadline():
+    from . import httpclient
+    budget = httpclient.budget
+    limits = httpclient.ratelimit
+
+    url = "http://www.deadline.example/search?q=foo"
+    limits.set_limit(url, rate=1, burst=1)
+    limits.pause(url, 3)
+    start = time.monotonic()
+    with budget.scope(0.5):
+        with pytest.raises(budget.DeadlineExceeded):
+            httpclient.get(url)
+    # We didn't sleep past the deadline, nor send the request.
+    assert time.monotonic() - start < 0.1
+    # We didn't take the token: the next one is still 3s away.
+    assert 2.9 < limits.get_bucket("http://www.deadline.example").reserve() <= 3
@@ -18,3 +18,15 @@ def test_price_fmt():
     assert '10 €' == price_fmt("10", None)
     assert '10 €' == price_fmt("10", '€')
     assert '10 €' == price_fmt("10", '€')
+
+
+def test_canonical_query():
+    from .scraperUtils import canonical_query
+
+    assert canonical_query(("Antigone", "sophocle")) == "antigone sophocle"
+    assert canonical_query(("sophocle  Antigone, ",)) == "antigone sophocle"
+    assert canonical_query(("Les Misérables",)) == canonical_query(("les miserables",))
+    assert canonical_query(("2-07-036002-4",)) == canonical_query(("9782070360024",))
+    assert canonical_query(("ed:Agone",)) == "ed:agone"
+    assert canonical_query(("hugo",), {'PAGE': 1, 'FETCH': False}) == "hugo"
+    assert canonical_query(("hugo",), {'PAGE': 2}) == "hugo|PAGE=2"
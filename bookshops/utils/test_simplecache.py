@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run:
+make unit
+"""
+
+import time
+
+from .simplecache import Cache
+
+
+def test_lru_eviction():
+    cache = Cache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # b was the least recently used.
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_expiry_and_size():
+    cache = Cache(ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+    cache = Cache(max_entries=None, max_bytes=200)
+    cache.set('a', "x" * 100)
+    cache.set('b', "y" * 100)
+    assert cache.stats()['size'] <= 200
+    assert cache.get('a') is None
+
+
+def test_admission():
+    cache = Cache(max_entries=1, admission=True)
+    cache.set('popular', 1)
+    for _ in range(3):
+        cache.get('popular')
+    # Asked once, less than the entry it would evict.
+    cache.get('once')
+    assert not cache.set('once', 2)
+    assert cache.get('popular') == 1
+    assert cache.stats()['rejections'] == 1
+
+
+def test_sqlite_backend(tmpdir):
+    from .sqlitecache import SqliteCache
+
+    path = str(tmpdir.join("cache.sqlite"))
+    cache = SqliteCache(path, ttl=60, compact_interval=0)
+    cache.set('a', [{'title': "Les Misérables"}])
+    # Another process would open the same file.
+    other = SqliteCache(path, ttl=60, compact_interval=0)
+    assert other.get('a') == [{'title': "Les Misérables"}]
+    cache.set('b', 1, ttl=-1)
+    assert other.get('b') is None
+    assert cache.compact() == 1
+    assert other.stats()['entries'] == 1
+
+
+def test_promoted_entry_keeps_its_expiry(tmpdir, monkeypatch):
+    from . import simplecache
+
+    monkeypatch.setattr(simplecache, 'CACHE', Cache())
+    simplecache.set_backend(str(tmpdir.join("cache.sqlite")))
+    try:
+        key = simplecache._key("lelivre.ch", ["antigone"])
+        simplecache.DISK.set(key, [{'title': "Antigone"}], ttl=0.3)
+        # Read from the disk, kept in memory.
+        assert simplecache.get_cache("lelivre.ch", ["antigone"]) == [{'title': "Antigone"}]
+        assert simplecache.CACHE.peek(key) == [{'title': "Antigone"}]
+        time.sleep(0.35)
+        assert simplecache.CACHE.peek(key) is None
+        assert simplecache.get_cache("lelivre.ch", ["antigone"]) is None
+    finally:
+        simplecache.set_backend(None)
+
+
+def test_cardstore():
+    from .cardstore import CardStore
+
+    store = CardStore()
+    store.put({'isbn': "2-07-036002-4", 'data_source': 'librairiedeparis',
+               'title': "Madame Bovary", 'description': None})
+    # postSearch completes the card.
+    store.put({'isbn': "9782070360024", 'data_source': 'librairiedeparis',
+               'title': "", 'description': "Emma..."})
+    card = store.get("9782070360024", 'librairiedeparis')
+    assert card['title'] == "Madame Bovary"
+    assert card['description'] == "Emma..."
+    assert store.get("9782070360024", 'lelivre.ch') is None
+    assert list(store.get_any("2070360024").keys()) == ['librairiedeparis']
+
+
+def test_stale_while_revalidate():
+    import threading
+    from . import simplecache
+
+    cache = simplecache.Cache()
+    cache.set('a', 1, soft_ttl=-1)
+    assert cache.get_stale('a') == (1, True)
+
+    refreshed = []
+    go = threading.Event()
+
+    def refresh():
+        go.wait(1)
+        refreshed.append(1)
+
+    refresher = simplecache.Refresher(per_source=1)
+    assert refresher.submit('source', 'a', refresh)
+    # Deduplicated, and bounded by source.
+    assert not refresher.submit('source', 'a', refresh)
+    assert not refresher.submit('source', 'b', refresh)
+    assert refresher.submit('other', 'c', refresh)
+    go.set()
+    refresher.executor.shutdown(wait=True)
+    assert refreshed == [1, 1]
+    assert refresher.stats() == {'refreshes': 2, 'refreshes_skipped': 1, 'refreshing': 0}
@@ -69,6 +69,7 @@ setup(
             "bucher = bookshops.deDE.buchlentner.buchlentnerScraper:run",
             "discogs = bookshops.all.discogs.discogsScraper:run",
             "movies = bookshops.all.momox.momox:run",
+            "bulkimport = bookshops.bulkimport:run",
         ],
     },
 